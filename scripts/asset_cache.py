@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源磁盘缓存（浏览器池的所有上下文共用，可选）
+
+共享浏览器里的上下文都是临时的，Chromium 自带的 HTTP 缓存无法跨次运行保留，
+因此在路由层缓存 CSS / JS / 字体 / 图片：命中时直接 fulfill，未命中时 route.fetch() 后写盘。
+
+  - 按域名分目录：<ASSET_CACHE_DIR>/<host>/<sha256(url)>.body / .json
+  - 只缓存 GET 且状态为 200 的静态资源；Cloudflare 验证相关请求（与 resource_blocker 的始终放行规则相同）不缓存
+  - 带 no-store / no-cache / private、max-age=0 或 Vary: * 的响应不缓存
+  - 条目有效期取 min(max-age, ASSET_CACHE_MAX_AGE_HOURS)；没有 max-age 时按 Expires 计算，Expires 无效或已过去则不缓存
+  - prune() 先删已过期的条目（按各自的 stored_at + 有效期），再按最近使用时间（mtime）淘汰，直到总大小不超过上限
+
+环境变量：
+  ASSET_CACHE_DIR              缓存目录，未设置时不启用（配合 actions/cache 在多次运行间保留）
+  ASSET_CACHE_MAX_MB           总大小上限，默认 100
+  ASSET_CACHE_MAX_AGE_HOURS    条目有效期上限，默认 168（7 天）
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+from resource_blocker import is_always_allowed
+
+CACHEABLE_TYPES = ("script", "stylesheet", "font", "image")
+SKIPPED_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection", "set-cookie"}
+UNCACHEABLE_DIRECTIVES = ("no-store", "no-cache", "private")
+
+
+class AssetCache:
+
+    def __init__(self, directory: Optional[str], max_bytes: int = 100 * 1024 * 1024, max_age: float = 7 * 86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+
+    @classmethod
+    def from_env(cls) -> "AssetCache":
+        return cls(
+            directory=os.environ.get("ASSET_CACHE_DIR", "").strip() or None,
+            max_bytes=int(float(os.environ.get("ASSET_CACHE_MAX_MB") or 100) * 1024 * 1024),
+            max_age=float(os.environ.get("ASSET_CACHE_MAX_AGE_HOURS") or 168) * 3600,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def _paths(self, url: str):
+        host = urlparse(url).hostname or "_"
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, host, key)
+        return base + ".body", base + ".json"
+
+    def ttl(self, headers: dict) -> Optional[float]:
+        """按响应头决定条目有效期（秒），不可缓存时返回 None"""
+        cache_control = headers.get("cache-control", "").lower()
+        if any(d in cache_control for d in UNCACHEABLE_DIRECTIVES):
+            return None
+        if headers.get("vary", "").strip() == "*":
+            return None
+        match = re.search(r"(?:^|[,\s])max-age=(\d+)", cache_control)
+        if match:
+            max_age = int(match.group(1))
+            return min(max_age, self.max_age) if max_age > 0 else None
+        if "expires" in headers:
+            lifetime = self._expires_lifetime(headers)
+            return min(lifetime, self.max_age) if lifetime and lifetime > 0 else None
+        return self.max_age
+
+    @staticmethod
+    def _expires_lifetime(headers: dict) -> Optional[float]:
+        """Expires 减去响应的 Date（没有 Date 时用当前时间），格式无效返回 None"""
+        try:
+            expires = parsedate_to_datetime(headers["expires"]).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return None
+        try:
+            date = parsedate_to_datetime(headers["date"]).timestamp() if headers.get("date") else time.time()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            date = time.time()
+        return expires - date
+
+    def _expired(self, meta: dict, now: float) -> bool:
+        return now - meta.get("stored_at", 0) > min(meta.get("ttl", self.max_age), self.max_age)
+
+    def load(self, url: str):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        # mtime 记录最近使用时间，供 prune() 淘汰；有效期看 stored_at + ttl
+        now = time.time()
+        if self._expired(meta, now):
+            return None
+        for path in (body_path, meta_path):
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        return meta, body
+
+    def store(self, url: str, status: int, headers: dict, body: bytes, ttl: Optional[float] = None):
+        body_path, meta_path = self._paths(url)
+        try:
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            with open(body_path, "wb") as f:
+                f.write(body)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"url": url, "status": status, "headers": headers, "stored_at": time.time(),
+                           "ttl": ttl if ttl is not None else self.max_age}, f)
+        except OSError:
+            pass
+
+    async def install(self, context):
+        if self.enabled:
+            await context.route("**/*", self._handle)
+
+    async def _handle(self, route, request):
+        if (request.method != "GET" or request.resource_type not in CACHEABLE_TYPES
+                or is_always_allowed(request.url)):
+            await route.fallback()
+            return
+
+        cached = self.load(request.url)
+        if cached is not None:
+            meta, body = cached
+            self.hits += 1
+            self.bytes_served += len(body)
+            await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+            return
+
+        self.misses += 1
+        try:
+            response = await route.fetch()
+        except Exception:
+            await route.fallback()
+            return
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in SKIPPED_HEADERS}
+        ttl = self.ttl({k.lower(): v for k, v in headers.items()})
+        if response.status == 200 and ttl is not None:
+            self.store(request.url, response.status, headers, await response.body(), ttl)
+        await route.fulfill(response=response)
+
+    def prune(self):
+        """按最近使用时间淘汰到总大小上限以内，并打印本次命中情况"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return
+        entries = []
+        total = 0
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".body"):
+                    continue
+                body_path = os.path.join(root, name)
+                meta_path = body_path[:-5] + ".json"
+                try:
+                    stat = os.stat(body_path)
+                    size = stat.st_size + (os.path.getsize(meta_path) if os.path.exists(meta_path) else 0)
+                except OSError:
+                    continue
+                try:
+                    with open(meta_path, encoding="utf-8") as f:
+                        expired = self._expired(json.load(f), now)
+                except (OSError, ValueError):
+                    expired = True  # 元数据缺失或损坏，条目已无法使用
+                entries.append((expired, stat.st_mtime, size, body_path, meta_path))
+                total += size
+
+        removed = 0
+        # 先删过期条目，再按最久未使用的顺序删
+        for expired, _, size, body_path, meta_path in sorted(entries, key=lambda e: (not e[0], e[1])):
+            if not expired and total <= self.max_bytes:
+                break
+            for path in (body_path, meta_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        if self.hits or self.misses or removed:
+            print(f"🗄 资源缓存: 命中 {self.hits} 次 ({self.bytes_served // 1024} KB)，未命中 {self.misses} 次，"
+                  f"淘汰 {removed} 个，当前 {total // 1024 // 1024} MB")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Playwright 浏览器池（Castle-Host / Data Online / KataBump / Pella / Weirdhost 共用）
+
+  - 整个进程只启动一次 Chromium，合并运行时所有脚本共用同一个实例
+  - 预热若干上下文，统一 UA、视口和反检测脚本
+  - 上下文归还时关闭页面、清空 Cookie 和权限，并按访问过的源清除 localStorage / IndexedDB / Service Worker / Cache Storage
+    （sessionStorage 随页面关闭），下一个账号借到同一个上下文时不会带上前一个账号的状态；使用满 max_uses 次后关闭重建
+  - 带 storage_state 的上下文含账号会话，不进池，用完即关
+  - 每个上下文安装请求拦截（图片/字体/媒体/统计脚本，见 resource_blocker.py）
+  - 设置 ASSET_CACHE_DIR 后，放行的静态资源按域名缓存到磁盘，跨次运行复用（见 asset_cache.py）
+
+用法：
+  from browser_pool import browser_pool
+  async with browser_pool() as pool:
+      async with pool.context() as context:
+          page = await context.new_page()
+
+  合并运行器先 set_shared_pool(pool)，之后各脚本的 browser_pool() 直接借用这个池。
+
+环境变量：
+  BROWSER_POOL_SIZE       预热的上下文数，默认 2
+  BROWSER_POOL_MAX_USES   每个上下文最多使用次数，默认 5
+"""
+
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from asset_cache import AssetCache
+from playwright.async_api import async_playwright
+from resource_blocker import ResourceBlocker
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+
+LAUNCH_ARGS = [
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-blink-features=AutomationControlled",
+    "--disable-infobars",
+    "--window-size=1280,900",
+]
+
+DEFAULT_CONTEXT_OPTIONS = {
+    "user_agent": USER_AGENT,
+    "viewport": {"width": 1280, "height": 900},
+    "locale": "en-US",
+}
+
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+    Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
+    Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
+    window.chrome = window.chrome || { runtime: {} };
+"""
+
+_shared: Optional["BrowserPool"] = None
+
+
+class BrowserPool:
+    """一个 Chromium 进程 + 按上下文参数分组的空闲上下文池"""
+
+    def __init__(self, size: Optional[int] = None, max_uses: Optional[int] = None,
+                 headless: bool = True, launch_args: Optional[List[str]] = None,
+                 blocker: Optional[ResourceBlocker] = None, asset_cache: Optional[AssetCache] = None):
+        self.size = size if size is not None else int(os.environ.get("BROWSER_POOL_SIZE") or 2)
+        self.max_uses = max_uses if max_uses is not None else int(os.environ.get("BROWSER_POOL_MAX_USES") or 5)
+        self.headless = headless
+        self.launch_args = launch_args or LAUNCH_ARGS
+        self.blocker = blocker or ResourceBlocker.from_env()
+        self.asset_cache = asset_cache or AssetCache.from_env()
+        self.browser = None
+        self._playwright = None
+        self._idle: Dict[str, list] = {}
+        self._uses: Dict[int, int] = {}
+        self._origins: Dict[int, set] = {}
+        self._warming: set = set()
+
+    async def start(self) -> "BrowserPool":
+        self._playwright = await async_playwright().start()
+        self.browser = await self._playwright.chromium.launch(headless=self.headless, args=self.launch_args)
+        await asyncio.gather(*(self._warm({}) for _ in range(self.size)))
+        return self
+
+    async def close(self):
+        for task in list(self._warming):
+            task.cancel()
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        self._idle.clear()
+        self._uses.clear()
+        self._origins.clear()
+        self.asset_cache.prune()
+
+    @staticmethod
+    def _key(options: dict) -> str:
+        return json.dumps(options, sort_keys=True, default=str)
+
+    def _track_origins(self, context):
+        """记录上下文访问过的源，归还时逐个清除存储"""
+        origins = self._origins.setdefault(id(context), set())
+
+        def on_navigated(frame):
+            parsed = urlparse(frame.url)
+            if parsed.scheme in ("http", "https"):
+                origins.add(f"{parsed.scheme}://{parsed.netloc}")
+
+        context.on("page", lambda page: page.on("framenavigated", on_navigated))
+
+    async def _new_context(self, options: dict):
+        options = dict(options)
+        init_script = options.pop("init_script", None)
+        context = await self.browser.new_context(**{**DEFAULT_CONTEXT_OPTIONS, **options})
+        await context.add_init_script(STEALTH_SCRIPT)
+        if init_script:
+            await context.add_init_script(init_script)
+        self._track_origins(context)
+        # 路由按注册的逆序执行：拦截器后注册先执行，放行的请求再 fallback 到资源缓存
+        await self.asset_cache.install(context)
+        await self.blocker.install(context)
+        self._uses[id(context)] = 0
+        return context
+
+    async def _warm(self, options: dict):
+        context = await self._new_context(options)
+        self._idle.setdefault(self._key(options), []).append(context)
+
+    def _warm_in_background(self, options: dict):
+        task = asyncio.ensure_future(self._warm(options))
+        self._warming.add(task)
+        task.add_done_callback(self._warming.discard)
+
+    def prewarm(self, count: int, **options):
+        """在后台预先创建 count 个指定参数的上下文，调用方随后借用时无需等待"""
+        idle = self._idle.setdefault(self._key(options), [])
+        for _ in range(max(0, count - len(idle))):
+            self._warm_in_background(options)
+
+    async def _discard(self, context):
+        self._uses.pop(id(context), None)
+        self._origins.pop(id(context), None)
+        try:
+            await context.close()
+        except Exception:
+            pass
+
+    async def _reset(self, context) -> bool:
+        """归还前清理会话痕迹；清理失败说明上下文已损坏（或无法确认已清理），由调用方关闭"""
+        try:
+            for page in list(context.pages):
+                await page.close()
+            await context.clear_cookies()
+            await context.clear_permissions()
+            origins = self._origins.get(id(context))
+            if origins:
+                page = await context.new_page()
+                try:
+                    cdp = await context.new_cdp_session(page)
+                    for origin in origins:
+                        await cdp.send("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+                    await cdp.detach()
+                finally:
+                    await page.close()
+                origins.clear()
+            return True
+        except Exception:
+            return False
+
+    @asynccontextmanager
+    async def context(self, storage_state=None, **options):
+        """
+        借出一个上下文。options 为 new_context 参数（覆盖默认的 UA/视口/语言），相同参数的上下文共用一个空闲队列；
+        额外的 init_script 在通用反检测脚本之后注入。
+        带 storage_state 时新建专用上下文，用完关闭。
+        """
+        if self.browser is None:
+            await self.start()
+
+        if storage_state is not None:
+            context = await self._new_context({**options, "storage_state": storage_state})
+            try:
+                yield context
+            finally:
+                await self._discard(context)
+            return
+
+        idle = self._idle.setdefault(self._key(options), [])
+        context = idle.pop() if idle else await self._new_context(options)
+        try:
+            yield context
+        finally:
+            uses = self._uses.get(id(context), 0) + 1
+            self._uses[id(context)] = uses
+            alive = self.browser is not None
+            if alive and uses < self.max_uses and len(idle) < max(self.size, 1) and await self._reset(context):
+                idle.append(context)
+            else:
+                await self._discard(context)
+                # 默认参数的上下文用满回收后在后台补一个，下次借用时无需等待
+                if alive and not options and len(idle) < self.size:
+                    self._warm_in_background(options)
+
+
+def set_shared_pool(pool: Optional[BrowserPool]):
+    global _shared
+    _shared = pool
+
+
+@asynccontextmanager
+async def browser_pool(**kwargs):
+    """有共享池（合并运行器设置）时直接借用，否则启动一个独立的池，退出时关闭"""
+    if _shared is not None:
+        yield _shared
+        return
+    pool = BrowserPool(**kwargs)
+    await pool.start()
+    try:
+        yield pool
+    finally:
+        await pool.close()
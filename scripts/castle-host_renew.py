@@ -5,6 +5,8 @@ Castle-Host 服务器自动续约脚本
 功能：多账号支持 + 自动启动关机服务器 + Cookie自动更新
 配置变量:
 - CASTLE_COOKIES=PHPSESSID=xxx; uid=xxx,PHPSESSID=xxx; uid=xxx  (多账号用逗号分隔)
+- RENEW_SCHEDULE_FILE=renew-schedule.json  (可选，记录到期和冷却时间，未到续约时间的服务器跳过续约点击；
+  启动关机服务器每次照常执行，见 renew_schedule.py)
 """
 
 import os
@@ -19,11 +21,18 @@ from base64 import b64encode
 from datetime import datetime
 from dataclasses import dataclass
 from typing import Optional, Tuple, List, Dict
-from playwright.async_api import async_playwright, BrowserContext, Page
+from playwright.async_api import BrowserContext, Page
+from term_sanitize import sanitize
+from browser_pool import BrowserPool, browser_pool
+from renew_schedule import RenewSchedule
+from renew_trace import ACCOUNT, API, NAVIGATE, NOTIFY, RENEW, SERVER, span, trace_run
 
 LOG_FILE = "castle_renew.log"
 REQUEST_TIMEOUT = 30
 PAGE_TIMEOUT = 60000
+COOLDOWN_HOURS = 24  # 免费续约每 24 小时一次
+ALERT_DAYS = 1
+SCHEDULE = RenewSchedule.from_env()
 
 logging.basicConfig(
     level=logging.INFO,
@@ -36,6 +45,7 @@ class RenewalStatus(Enum):
     SUCCESS = "success"
     FAILED = "failed"
     RATE_LIMITED = "rate_limited"
+    SKIPPED = "skipped"
 
 @dataclass
 class ServerResult:
@@ -101,6 +111,10 @@ class Notifier:
         self.token, self.chat_id = token, chat_id
     
     async def send(self, msg: str) -> Optional[int]:
+        with span(NOTIFY, channel="telegram"):
+            return await self._send(msg)
+
+    async def _send(self, msg: str) -> Optional[int]:
         if not self.token or not self.chat_id:
             return None
         try:
@@ -183,7 +197,8 @@ class CastleClient:
     
     async def get_server_ids(self) -> List[str]:
         try:
-            await self.page.goto(f"{self.base}/servers", wait_until="networkidle")
+            with span(NAVIGATE, page="servers"):
+                await self.page.goto(f"{self.base}/servers", wait_until="networkidle")
             content = await self.page.content()
             match = re.search(r'var\s+ServersID\s*=\s*\[([\d,\s]+)\]', content)
             if match:
@@ -197,12 +212,13 @@ class CastleClient:
     async def get_console_log(self, sid: str) -> str:
         """获取服务器控制台日志"""
         try:
-            await self.page.goto(f"{self.base}/servers/console/index/{sid}", wait_until="networkidle")
-            await self.page.wait_for_timeout(3000)
+            with span(NAVIGATE, page="console"):
+                await self.page.goto(f"{self.base}/servers/console/index/{sid}", wait_until="networkidle")
+                await self.page.wait_for_timeout(3000)
             
             console = self.page.locator("#console_data")
             if await console.count() > 0:
-                log = await console.text_content() or ""
+                log = sanitize(await console.text_content() or "")
                 logger.info(f"📜 获取到控制台日志 ({len(log)} 字符)")
                 return log
         except Exception as e:
@@ -232,7 +248,8 @@ class CastleClient:
     
     async def get_expiry(self, sid: str) -> str:
         try:
-            await self.page.goto(f"{self.base}/servers/pay/index/{sid}", wait_until="networkidle")
+            with span(NAVIGATE, page="pay"):
+                await self.page.goto(f"{self.base}/servers/pay/index/{sid}", wait_until="networkidle")
             text = await self.page.text_content("body")
             match = re.search(r"(\d{2}\.\d{2}\.\d{4})", text)
             return match.group(1) if match else ""
@@ -252,6 +269,14 @@ class CastleClient:
         
         self.page.on("response", capture)
         
+        with span(RENEW) as step:
+            status, msg = await self._click_renew(masked, api_resp)
+            step.set("outcome", status.value)
+            if status == RenewalStatus.FAILED:
+                step.fail(msg)
+            return status, msg
+
+    async def _click_renew(self, masked: str, api_resp: Dict) -> Tuple[RenewalStatus, str]:
         for sel in ["#freebtn", 'button:has-text("Продлить")', 'a:has-text("Продлить")', 
                     'button:has-text("Бесплатно")', 'a:has-text("Бесплатно")']:
             try:
@@ -260,10 +285,12 @@ class CastleClient:
                     await btn.click()
                     logger.info(f"🖱️ 服务器 {masked} 已点击续约")
                     
-                    for _ in range(20):
-                        if api_resp.get("data"):
-                            break
-                        await asyncio.sleep(0.5)
+                    with span(API, endpoint="buy_months") as step:
+                        for _ in range(20):
+                            if api_resp.get("data"):
+                                break
+                            await asyncio.sleep(0.5)
+                        step.set("received", bool(api_resp.get("data")))
                     
                     if api_resp.get("data"):
                         data = api_resp["data"]
@@ -289,7 +316,15 @@ class CastleClient:
         except:
             return None
 
-async def process_account(cookie_str: str, idx: int, config: Config, notifier: Notifier) -> Tuple[Optional[str], List[Tuple[str, int, str]]]:
+def record_schedule(sid: str, status: RenewalStatus):
+    if status == RenewalStatus.SUCCESS:
+        SCHEDULE.renewed("castle-host", sid, COOLDOWN_HOURS)
+    elif status == RenewalStatus.RATE_LIMITED:
+        SCHEDULE.cooling("castle-host", sid, COOLDOWN_HOURS)
+    elif status == RenewalStatus.FAILED:
+        SCHEDULE.update("castle-host", sid, outcome="error")
+
+async def process_account(pool: BrowserPool, cookie_str: str, idx: int, config: Config, notifier: Notifier) -> Tuple[Optional[str], List[Tuple[str, int, str]]]:
     """返回(新Cookie, [(服务器ID, 消息ID, 控制台日志)])"""
     cookies = parse_cookies(cookie_str)
     if not cookies:
@@ -301,12 +336,7 @@ async def process_account(cookie_str: str, idx: int, config: Config, notifier: N
     
     started_servers: List[Tuple[str, int, str]] = []  # (服务器ID, 消息ID, 日志)
     
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True, args=["--no-sandbox"])
-        ctx = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            viewport={"width": 1920, "height": 1080}
-        )
+    async with pool.context() as ctx:
         await ctx.add_cookies(cookies)
         page = await ctx.new_page()
         page.set_default_timeout(PAGE_TIMEOUT)
@@ -323,16 +353,21 @@ async def process_account(cookie_str: str, idx: int, config: Config, notifier: N
             
             for sid in server_ids:
                 logger.info(f"--- 处理服务器 {mask_id(sid)} ---")
-                
-                # 启动并获取日志
-                started, console_log = await client.start_if_stopped(sid)
-                
-                expiry = await client.get_expiry(sid)
-                d = days_left(expiry)
-                logger.info(f"📅 到期: {convert_date(expiry)} ({d}天)")
-                
-                status, msg = await client.renew(sid)
-                logger.info(f"📝 结果: {msg}")
+                with span(SERVER, server=mask_id(sid)):
+                    # 启动并获取日志
+                    started, console_log = await client.start_if_stopped(sid)
+                    
+                    expiry = await client.get_expiry(sid)
+                    d = days_left(expiry)
+                    logger.info(f"📅 到期: {convert_date(expiry)} ({d}天)")
+                    
+                    SCHEDULE.update("castle-host", sid, expiry_text=expiry or None, alert_days=ALERT_DAYS)
+                    if SCHEDULE.is_due("castle-host", sid):
+                        status, msg = await client.renew(sid)
+                        record_schedule(sid, status)
+                    else:
+                        status, msg = RenewalStatus.SKIPPED, "未到续约时间"
+                    logger.info(f"📝 结果: {msg}")
                 
                 results.append(ServerResult(sid, status, msg, expiry, d, started, console_log))
                 await asyncio.sleep(2)
@@ -343,6 +378,8 @@ async def process_account(cookie_str: str, idx: int, config: Config, notifier: N
                     stat = "✅ 续约成功 (+1天)"
                 elif r.status == RenewalStatus.RATE_LIMITED:
                     stat = "📝 今日已续期"
+                elif r.status == RenewalStatus.SKIPPED:
+                    stat = "⏭ 未到续约时间"
                 else:
                     stat = f"❌ 续约失败: {r.message}"
                 
@@ -372,9 +409,6 @@ async def process_account(cookie_str: str, idx: int, config: Config, notifier: N
             logger.error(f"❌ 账号#{idx+1} 异常: {e}")
             await notifier.send(f"❌ 账号#{idx+1} 异常: {e}")
             return None, []
-        finally:
-            await ctx.close()
-            await browser.close()
 
 async def main():
     logger.info("=" * 50)
@@ -395,17 +429,21 @@ async def main():
     changed = False
     all_started: List[Tuple[str, int, str]] = []
     
-    for i, cookie in enumerate(config.cookies_list):
-        new, started = await process_account(cookie, i, config, notifier)
-        all_started.extend(started)
-        if new:
-            new_cookies.append(new)
-            if new != cookie:
-                changed = True
-        else:
-            new_cookies.append(cookie)
-        if i < len(config.cookies_list) - 1:
-            await asyncio.sleep(5)
+    # 所有账号共用一个浏览器，上下文归还时清空 Cookie
+    async with browser_pool(size=1) as pool:
+        for i, cookie in enumerate(config.cookies_list):
+            with span(ACCOUNT, account=f"#{i+1}"):
+                new, started = await process_account(pool, cookie, i, config, notifier)
+            all_started.extend(started)
+            if new:
+                new_cookies.append(new)
+                if new != cookie:
+                    changed = True
+            else:
+                new_cookies.append(cookie)
+            if i < len(config.cookies_list) - 1:
+                await asyncio.sleep(5)
+    SCHEDULE.save()
     
     # 发送控制台日志文件
     for sid, msg_id, console_log in all_started:
@@ -425,5 +463,9 @@ async def main():
     
     logger.info("👋 完成")
 
+async def run():
+    with trace_run("castle-host"):
+        await main()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(run())
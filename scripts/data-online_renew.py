@@ -1,138 +1,599 @@
 import asyncio
+import json
 import os
+import re
+import secrets
+import aiohttp
 import httpx
 from datetime import datetime
-from playwright.async_api import async_playwright
+from urllib.parse import urlparse
+from yarl import URL
+from browser_pool import browser_pool
+from term_sanitize import CSI_RE, ESC_RE, sanitize, strip_ansi
+from screenshot_policy import ScreenshotPolicy
+from session_store import SessionStore
+from renew_trace import ACCOUNT, API, LOGIN, NAVIGATE, NOTIFY, RENEW, span, trace_run
 
-async def send_telegram_notification(bot_token, chat_id, username, screenshot_path):
-    """发送 Telegram 通知"""
+DEFAULT_HOST = "https://sv66.dataonline.vn:2222"
+DEFAULT_COMMAND = 'pgrep -f "npm" >/dev/null || nohup ./npm -c config.yml >/dev/null 2>&1 &'
+DEFAULT_CONCURRENCY = 3
+DEFAULT_STATE_DIR = ".dataonline-state"
+DEFAULT_HEALTH_CHECK = 'pgrep -f "npm" >/dev/null'
+ENDPOINTS_FILE = "endpoints.json"  # 每台主机的终端 WebSocket 地址（非敏感，明文保存）
+LOGIN_FIELD = 'div.Input#username'
+FORCE_RESTART = os.environ.get('DATA_FORCE_RESTART', '').lower() in ('1', 'true', 'yes')
+
+def format_status(exit_status):
+    if exit_status is None:
+        return "⚠️ 已发送（未取得退出码）"
+    if exit_status == 0:
+        return "✅ 完成 (exit 0)"
+    return f"❌ 失败 (exit {exit_status})"
+
+def escape_html(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+async def send_telegram_notification(bot_token, chat_id, results):
+    """发送 Telegram 汇总通知（每台主机每条命令的退出码，失败时附输出末尾）"""
+    with span(NOTIFY, method="sendMessage"):
+        await _send_telegram_notification(bot_token, chat_id, results)
+
+async def _send_telegram_notification(bot_token, chat_id, results):
     
     # 获取当前时间
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M")
     
     # 构建消息
+    sections = []
+    for result in results:
+        lines = [f"👤 账号: {result['username']} @ {urlparse(result['host']).hostname}"]
+        if result['healthy']:
+            lines.append("└ 💚 进程运行中，无需重启")
+        if result['error']:
+            lines.append(f"└ ❌ 出错: {escape_html(result['error'])}")
+        for i, item in enumerate(result['commands']):
+            branch = "└" if i == len(result['commands']) - 1 else "├"
+            lines.append(f"{branch} {format_status(item['exit_status'])}: <code>{escape_html(item['command'][:60])}</code>")
+            if item['exit_status'] not in (None, 0) and item['output']:
+                lines.append(f"<pre>{escape_html(item['output'][-500:])}</pre>")
+        sections.append("\n".join(lines))
+    
     message = f"""🎁 Data Online 重启报告
 ⏰ {current_time}
 ━━━━━━━━━━━━━━━━━━
-📅
-├ 👤 账号: {username}
-└ 重启: ✅ 完成"""
+""" + "\n\n".join(sections)
     
     async with httpx.AsyncClient() as client:
-        # 发送图片和消息
-        url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        data = {
+            'chat_id': chat_id,
+            'text': message[:4096],
+            'parse_mode': 'HTML'
+        }
+        
+        response = await client.post(url, data=data)
         
-        with open(screenshot_path, 'rb') as photo:
-            files = {'photo': ('result.png', photo, 'image/png')}
-            data = {
-                'chat_id': chat_id,
-                'caption': message,
-                'parse_mode': 'HTML'
-            }
+        if response.status_code == 200:
+            print("📨 Telegram 通知发送成功!")
+        else:
+            print(f"❌ Telegram 通知发送失败: {response.text}")
+
+SCREENSHOTS = ScreenshotPolicy.from_env()
+
+async def read_terminal_output(page):
+    """读取 xterm DOM 渲染层的终端文本并清理"""
+    try:
+        rows = page.locator('.xterm-rows')
+        if await rows.count() > 0:
+            return sanitize(await rows.first.inner_text(), drop_blank=True)
+    except Exception:
+        pass
+    return ""
+
+# 终端 WebSocket 地址匹配（可用 DATA_TERMINAL_WS 覆盖为正则）
+TERMINAL_WS_PATTERN = re.compile(os.environ.get('DATA_TERMINAL_WS') or r'terminal|pty|xterm', re.IGNORECASE)
+# 输入帧模板，默认原始文本帧（xterm attach 协议）；JSON 协议可设为 {"type":"input","data":%s}
+TERMINAL_FRAME = os.environ.get('DATA_TERMINAL_FRAME') or ''
+PROMPT_PATTERN = re.compile(r'[$#>%]\s*$')
+PROMPT_TAIL = 256  # 提示符只看输出末尾这么多字符
+# 完整的转义序列（OSC 必须已收到终止符）；输出末尾的 ESC 不是完整序列的开头时，说明序列被分块截断了
+COMPLETE_ESCAPE = re.compile(rf"{CSI_RE}|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|{ESC_RE}")
+
+class OutputCursor:
+    """从某个分块位置起增量清理终端输出：每块只处理一次，查找也只扫描新增部分"""
+
+    HOLD = 256  # 末尾可能是没收全的转义序列，先留着等下一块
+
+    def __init__(self, chunks, start=0):
+        self.chunks = chunks
+        self.index = start
+        self.text = ''
+        self._hold = ''
+        self._scanned = 0
+
+    def update(self):
+        if self.index < len(self.chunks):
+            pending = self._hold + ''.join(self.chunks[self.index:])
+            self.index = len(self.chunks)
+            cut = pending.rfind('\x1b')
+            if cut == -1 or len(pending) - cut > self.HOLD or COMPLETE_ESCAPE.match(pending, cut):
+                cut = len(pending)
+            self.text += strip_ansi(pending[:cut])
+            self._hold = pending[cut:]
+        return self.text
+
+    def search(self, pattern, overlap):
+        """在上次扫描位置（回退 overlap 个字符，防止匹配跨块）之后查找"""
+        self.update()
+        match = pattern.search(self.text, max(0, self._scanned - overlap))
+        self._scanned = len(self.text)
+        return match
+
+    def prompt(self, after=0):
+        """输出末尾（after 之后）是否是提示符"""
+        self.update()
+        tail = self.text[max(after, len(self.text) - PROMPT_TAIL):].rstrip('\r\n')
+        return PROMPT_PATTERN.search(tail)
+
+class TerminalDriver:
+    """接管面板终端的 WebSocket：整条命令一帧发出，读取输出流直到退出码标记和提示符出现"""
+
+    def __init__(self, frame_template=TERMINAL_FRAME):
+        self.frame_template = frame_template
+        self.url = None
+        self._send = None
+        self._reader = None
+        self._chunks = []
+        self._connected = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    async def attach(self, page):
+        """必须在打开终端页面之前调用"""
+        await page.route_web_socket(TERMINAL_WS_PATTERN, self._route)
+
+    def _route(self, ws):
+        server = ws.connect_to_server()
+
+        def to_page(message):
+            ws.send(message)
+            self._on_output(message)
+
+        # 设置了处理函数后不再自动转发，两个方向都手动转发
+        server.on_message(to_page)
+        ws.on_message(lambda message: server.send(message))
+        if self._send is None:
+            self._send = server.send
+            self.url = ws.url
+            self._connected.set()
+
+    def attach_socket(self, ws, url):
+        """不经浏览器、直接连接（aiohttp WebSocket）时使用，后台读取输出"""
+        self._send = ws.send_str
+        self.url = url
+        self._reader = asyncio.ensure_future(self._read(ws))
+        self._connected.set()
+
+    async def _read(self, ws):
+        async for msg in ws:
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                self._on_output(msg.data)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+
+    def _on_output(self, message):
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', errors='replace')
+        if self.frame_template and message.startswith('{'):
+            try:
+                payload = json.loads(message)
+                message = str(payload.get('data') or payload.get('output') or '')
+            except (ValueError, AttributeError):
+                pass
+        self._chunks.append(message)
+        self._changed.set()
+
+    def _encode(self, text):
+        if not self.frame_template:
+            return text
+        return self.frame_template.replace('%s', json.dumps(text))
+
+    async def _wait_until(self, predicate, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            result = predicate()
+            if result:
+                return result
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return predicate()
+
+    async def connect(self, timeout=20):
+        """等待终端 WebSocket 建立，并等到第一个提示符（最多 timeout 秒）；提示符没出现时返回 False"""
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        if not await self._wait_until(OutputCursor(self._chunks).prompt, timeout):
+            print(f"⚠️ 终端 {timeout} 秒内未出现提示符，shell 可能未就绪")
+            return False
+        return True
+
+    async def run(self, command, timeout=30, prompt_timeout=3):
+        """执行命令，返回 (退出码, 清理后的输出)；超时时退出码为 None"""
+        marker = f'__DA_EXIT_{secrets.token_hex(4)}'
+        # 退出码后必须跟换行，避免在 "=1" / "27" 分两块到达时提前匹配
+        pattern = re.compile(rf'{marker}=(\d+)[\r\n]')
+        start = len(self._chunks)
+        cursor = OutputCursor(self._chunks, start)
+
+        # 子 shell 包一层，命令以 & 结尾时也能接 echo；回显里的 $? 不会被数字模式误匹配
+        sent = self._send(self._encode(f'( {command} ); echo "{marker}=$?"\r'))
+        if asyncio.iscoroutine(sent):
+            await sent
+
+        match = await self._wait_until(lambda: cursor.search(pattern, len(marker) + 16), timeout)
+        if match:
+            await self._wait_until(lambda: cursor.prompt(match.end()), prompt_timeout)
+
+        output = sanitize(''.join(self._chunks[start:]), drop_blank=True)
+        lines = [line for line in output.split('\n') if marker not in line]
+        return (int(match.group(1)) if match else None), '\n'.join(lines)
+
+async def type_command(page, command):
+    """WebSocket 未接管时的后备方案：点击终端并逐字输入"""
+    for selector in ['.xterm', '.xterm-screen', '.terminal', 'canvas']:
+        try:
+            element = page.locator(selector).first
+            if await element.is_visible(timeout=2000):
+                await element.click()
+                print(f"  ✅ 已点击终端区域: {selector}")
+                break
+        except:
+            continue
+    else:
+        await page.mouse.click(640, 400)
+    
+    await page.keyboard.type(command, delay=30)
+    await page.keyboard.press('Enter')
+    await asyncio.sleep(5)
+    return await read_terminal_output(page)
+
+def load_targets():
+    """
+    DATA_ONLINE_CONFIG: JSON 列表（或指向 JSON 文件的路径），每项：
+      {"host": "https://sv66.dataonline.vn:2222", "username": "...", "password": "...", "commands": ["..."]}
+    host 可只写域名（默认 https 和 2222 端口），password 缺省时使用 DATA_PASSWORD，commands 缺省时使用默认重启命令。
+    可选 health_check（预检命令，退出码 0 表示无需重启；使用默认命令时默认为 pgrep npm）和 health_url（返回 2xx 即视为存活）。
+    未设置时使用 DATA_USERNAME / DATA_PASSWORD 和默认主机。
+    """
+    raw = os.environ.get('DATA_ONLINE_CONFIG', '').strip()
+    if raw and not raw.startswith('['):
+        with open(raw, encoding='utf-8') as f:
+            raw = f.read()
+    entries = json.loads(raw) if raw else [{}]
+    
+    targets = []
+    for entry in entries:
+        host = (entry.get('host') or DEFAULT_HOST).rstrip('/')
+        if '://' not in host:
+            host = f"https://{host}:2222"
+        username = entry.get('username') or os.environ.get('DATA_USERNAME', 'apiorgvm')
+        password = entry.get('password') or os.environ.get('DATA_PASSWORD')
+        commands = entry.get('commands') or [entry.get('command') or DEFAULT_COMMAND]
+        health_check = entry.get('health_check') or (DEFAULT_HEALTH_CHECK if commands == [DEFAULT_COMMAND] else None)
+        if not password:
+            print(f"❌ 跳过 {username} @ {host}: 未设置密码")
+            continue
+        targets.append({'host': host, 'username': username, 'password': password, 'commands': commands,
+                        'health_check': health_check, 'health_url': entry.get('health_url')})
+    return targets
+
+def load_endpoints(directory):
+    try:
+        with open(os.path.join(directory, ENDPOINTS_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_endpoints(directory, endpoints):
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, ENDPOINTS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(endpoints, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ 终端地址缓存保存失败: {e}")
+
+async def http_login(session, host, username, password):
+    """
+    DirectAdmin 纯 HTTP 登录：先试 Evolution 的 JSON 接口，再试传统 CMD_LOGIN 表单。
+    先清空 Cookie（里面可能是刚加载的过期会话），只有本次响应下发了新的会话 Cookie 且响应内容表明成功才算登录成功
+    """
+    session.cookie_jar.clear()
+    try:
+        async with session.post(f"{host}/api/login", json={'username': username, 'password': password},
+                                allow_redirects=False) as resp:
+            if resp.status == 200 and resp.cookies:
+                try:
+                    body = await resp.json(content_type=None)
+                except ValueError:
+                    body = None
+                if isinstance(body, dict) and not body.get('error') and body.get('type') != 'error':
+                    return True
+        session.cookie_jar.clear()
+        async with session.post(f"{host}/CMD_LOGIN", data={'username': username, 'password': password, 'referer': '/'},
+                                allow_redirects=False) as resp:
+            # 成功时 302 跳到 referer，失败时停留在（或跳回）登录页
+            location = resp.headers.get('Location', '')
+            return resp.status == 302 and bool(resp.cookies) and 'LOGIN' not in location.upper()
+    except aiohttp.ClientError:
+        return False
+
+async def run_over_socket(session, ws_url, target, tag):
+    """
+    直接连接终端 WebSocket：先执行预检命令，进程不在时在同一连接上执行命令集。
+    返回 {'healthy', 'commands'}；终端没有就绪或预检拿不到退出码时返回 None（连接失败抛 aiohttp 异常）
+    """
+    async with session.ws_connect(ws_url, origin=target['host'], heartbeat=20) as ws:
+        driver = TerminalDriver()
+        driver.attach_socket(ws, ws_url)
+        try:
+            if not await driver.connect(timeout=10):
+                return None
+            exit_status, _ = await driver.run(target['health_check'], timeout=15, prompt_timeout=0)
+            if exit_status is None:
+                return None
+            print(f"{tag} 🩺 预检命令退出码: {exit_status}")
+            if exit_status == 0:
+                return {'healthy': True, 'commands': []}
             
-            response = await client.post(url, data=data, files=files)
+            commands = []
+            for command in target['commands']:
+                if ws.closed:
+                    raise aiohttp.ClientConnectionError("终端 WebSocket 已断开")
+                print(f"{tag} ⌨️ 执行命令: {command}")
+                with span(RENEW, action="command", via="direct_websocket") as step:
+                    exit_status, output = await driver.run(command)
+                    step.set("exit_status", "unknown" if exit_status is None else exit_status)
+                    if exit_status not in (None, 0):
+                        step.fail(f"exit {exit_status}")
+                if output:
+                    print(f"{tag} 📜 终端输出:\n{output[-2000:]}")
+                print(f"{tag} 🔚 退出码: {exit_status if exit_status is not None else '未知'}")
+                commands.append({'command': command, 'exit_status': exit_status, 'output': output})
+            return {'healthy': False, 'commands': commands}
+        finally:
+            driver.close()
+
+async def probe_target(target, store, endpoints):
+    """
+    不启动浏览器的预检：进程存活时直接返回，不在时用同一个终端 WebSocket 执行命令集。
+    返回 {'healthy', 'commands'}；None 表示登录或 WebSocket 失败、无法判断（交给浏览器流程）
+    复用保存的会话 Cookie，失效时用 HTTP 登录；终端地址来自之前浏览器运行时记录的 WebSocket 地址
+    """
+    account = f"{target['username']}@{urlparse(target['host']).hostname}"
+    with span(API, endpoint="health_probe", account=account) as step:
+        outcome = await _probe_target(target, store, endpoints)
+        step.set("healthy", "unknown" if outcome is None else outcome['healthy'])
+        return outcome
+
+async def _probe_target(target, store, endpoints):
+    host, username, password = target['host'], target['username'], target['password']
+    tag = f"[{username}@{urlparse(host).hostname}]"
+    timeout = aiohttp.ClientTimeout(total=30)
+    connector = aiohttp.TCPConnector(ssl=False)
+    
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True), connector=connector, timeout=timeout) as session:
+        if target['health_url']:
+            try:
+                async with session.get(target['health_url']) as resp:
+                    if resp.status < 300:
+                        print(f"{tag} 💚 健康检查地址正常 ({resp.status})")
+                        return {'healthy': True, 'commands': []}
+                    print(f"{tag} ⚠️ 健康检查地址返回 {resp.status}")
+            except aiohttp.ClientError as e:
+                print(f"{tag} ⚠️ 健康检查地址不可达: {e}")
+        
+        ws_url = endpoints.get(host)
+        if not target['health_check'] or not ws_url:
+            return None
+        
+        state = store.load(f"{username}@{host}", password)
+        if state:
+            for cookie in state.get('cookies', []):
+                session.cookie_jar.update_cookies({cookie['name']: cookie['value']}, response_url=URL(host))
+        
+        for attempt in ('cached', 'login'):
+            if attempt == 'login':
+                if not await http_login(session, host, username, password):
+                    print(f"{tag} ⚠️ HTTP 登录失败，改用浏览器")
+                    return None
+                print(f"{tag} 🔐 HTTP 登录成功")
+            elif not state:
+                continue
+            try:
+                return await run_over_socket(session, ws_url, target, tag)
+            except aiohttp.WSServerHandshakeError:
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"{tag} ⚠️ 终端连接失败: {e}")
+                return None
+        return None
+
+async def login(page, base_url, username, password, tag):
+    print(f"{tag} 🌐 访问: {base_url}")
+    with span(LOGIN):
+        with span(NAVIGATE, page="login"):
+            await page.goto(base_url, timeout=60000)
+        
+        print(f"{tag} 🔐 正在登录...")
+        await page.fill('div.Input#username input.Input__Text', username)
+        await page.fill('div.InputPassword#password input.InputPassword__Input', password)
+        await page.click('button.Button[type="submit"]')
+        
+        await page.locator(LOGIN_FIELD).wait_for(state='detached', timeout=30000)
+    print(f"{tag} ✅ 登录成功")
+
+async def open_terminal(page, driver, terminal_url):
+    """打开终端页面，返回 None 表示落在登录页（会话无效），否则返回是否接管了 WebSocket"""
+    with span(NAVIGATE, page="terminal") as step:
+        await page.goto(terminal_url, timeout=60000)
+        connect = asyncio.ensure_future(driver.connect())
+        login_form = asyncio.ensure_future(page.locator(LOGIN_FIELD).wait_for(state='visible', timeout=20000))
+        done, _ = await asyncio.wait({connect, login_form}, return_when=asyncio.FIRST_COMPLETED)
+        if login_form in done and login_form.exception() is None:
+            connect.cancel()
+            step.set("login_required", True)
+            return None
+        login_form.cancel()
+        return await connect
+
+async def run_target(pool, target, store, semaphore):
+    """在独立上下文中处理一台主机：复用已保存的会话，依次执行命令集"""
+    with span(ACCOUNT, account=f"{target['username']}@{urlparse(target['host']).hostname}") as step:
+        result = await _run_target(pool, target, store, semaphore)
+        if result['error']:
+            step.fail(result['error'])
+        return result
+
+async def _run_target(pool, target, store, semaphore):
+    host, username, password = target['host'], target['username'], target['password']
+    hostname = urlparse(host).hostname
+    account = f"{username}@{host}"
+    tag = f"[{username}@{hostname}]"
+    result = {'host': host, 'username': username, 'commands': [], 'error': None, 'healthy': False, 'terminal_ws': None}
+    
+    async with semaphore:
+        state = store.load(account, password)
+        async with pool.context(storage_state=state, ignore_https_errors=True) as context:
+            page = await context.new_page()
+            shots = SCREENSHOTS.recorder(f"{username}_{hostname}")
             
-            if response.status_code == 200:
-                print("📨 Telegram 通知发送成功!")
-            else:
-                print(f"❌ Telegram 通知发送失败: {response.text}")
+            try:
+                driver = TerminalDriver()
+                await driver.attach(page)
+                terminal_url = f"{host}/evo/user/terminal"
+                
+                connected = await open_terminal(page, driver, terminal_url) if state else None
+                if connected is None:
+                    if state:
+                        print(f"{tag} ℹ️ 保存的会话已失效，重新登录")
+                        store.discard(account)
+                    await login(page, host, username, password, tag)
+                    await shots.checkpoint(page, "1_after_login")
+                    print(f"{tag} 📺 访问终端: {terminal_url}")
+                    connected = await open_terminal(page, driver, terminal_url)
+                    if connected is None:
+                        raise Exception("登录后仍跳转到登录页")
+                else:
+                    print(f"{tag} ♻️ 复用已保存的会话")
+                
+                if connected:
+                    print(f"{tag} 🔌 已接管终端 WebSocket: {driver.url}")
+                    result['terminal_ws'] = driver.url
+                else:
+                    print(f"{tag} ⚠️ 未捕获终端 WebSocket，改用键盘输入")
+                    await shots.checkpoint(page, "2_terminal_page", selector='.xterm')
+                
+                for command in target['commands']:
+                    print(f"{tag} ⌨️ 执行命令: {command}")
+                    with span(RENEW, action="command", via="websocket" if connected else "keyboard") as step:
+                        if connected:
+                            exit_status, output = await driver.run(command)
+                        else:
+                            exit_status, output = None, await type_command(page, command)
+                        step.set("exit_status", "unknown" if exit_status is None else exit_status)
+                        if exit_status not in (None, 0):
+                            step.fail(f"exit {exit_status}")
+                    if output:
+                        print(f"{tag} 📜 终端输出:\n{output[-2000:]}")
+                    print(f"{tag} 🔚 退出码: {exit_status if exit_status is not None else '未知'}")
+                    result['commands'].append({'command': command, 'exit_status': exit_status, 'output': output})
+                
+                if any(item['exit_status'] not in (None, 0) for item in result['commands']):
+                    await shots.failure(page, "command_failed", selector='.xterm')
+                
+                store.save(account, password, await context.storage_state())
+            
+            except Exception as e:
+                print(f"{tag} ❌ 发生错误: {str(e)}")
+                result['error'] = str(e)
+                await shots.failure(page, "error_screenshot")
+    
+    return result
 
 async def main():
-    # 从环境变量获取凭据
-    username = os.environ.get('DATA_USERNAME', 'apiorgvm')
-    password = os.environ.get('DATA_PASSWORD')
     tg_bot_token = os.environ.get('TG_BOT_TOKEN')
     tg_chat_id = os.environ.get('TG_CHAT_ID')
     
-    if not password:
-        print("❌ 错误: DATA_PASSWORD 环境变量未设置")
+    targets = load_targets()
+    if not targets:
+        print("❌ 错误: 未配置主机（DATA_ONLINE_CONFIG 或 DATA_PASSWORD）")
         exit(1)
     
-    base_url = "https://sv66.dataonline.vn:2222"
-    command = 'pgrep -f "npm" >/dev/null || nohup ./npm -c config.yml >/dev/null 2>&1 &'
+    concurrency = int(os.environ.get('DATA_ONLINE_CONCURRENCY') or DEFAULT_CONCURRENCY)
+    store = SessionStore(
+        os.environ.get('DATA_STATE_DIR', DEFAULT_STATE_DIR).strip(),
+        os.environ.get('DATA_STATE_KEY', '').strip() or None
+    )
+    if not store.enabled:
+        print("ℹ️ 未安装 pynacl 或未设置 DATA_STATE_DIR，不保存会话")
     
-    async with async_playwright() as p:
-        print("🚀 启动浏览器...")
-        browser = await p.chromium.launch(
-            headless=True,
-            args=['--ignore-certificate-errors', '--no-sandbox']
-        )
-        
-        context = await browser.new_context(ignore_https_errors=True)
-        page = await context.new_page()
-        
-        try:
-            print(f"🌐 访问: {base_url}")
-            await page.goto(base_url, timeout=60000)
-            await page.wait_for_load_state('networkidle')
-            await asyncio.sleep(2)
-            
-            print("🔐 正在登录...")
-            await page.fill('div.Input#username input.Input__Text', username)
-            print(f"  ✅ 用户名已填写: {username}")
-            
-            await page.fill('div.InputPassword#password input.InputPassword__Input', password)
-            print("  ✅ 密码已填写")
-            
-            await page.click('button.Button[type="submit"]')
-            print("  ✅ 点击登录按钮")
-            
-            await page.wait_for_load_state('networkidle')
-            await asyncio.sleep(3)
-            await page.screenshot(path="1_after_login.png")
-            print("📸 登录后截图已保存")
-            
-            terminal_url = f"{base_url}/evo/user/terminal"
-            print(f"📺 访问终端: {terminal_url}")
-            await page.goto(terminal_url, timeout=60000)
-            await page.wait_for_load_state('networkidle')
-            await asyncio.sleep(5)
-            await page.screenshot(path="2_terminal_page.png")
-            print("📸 终端页面截图已保存")
-            
-            print(f"⌨️ 执行命令: {command}")
-            
-            for selector in ['.xterm', '.xterm-screen', '.terminal', 'canvas']:
-                try:
-                    element = page.locator(selector).first
-                    if await element.is_visible(timeout=2000):
-                        await element.click()
-                        print(f"  ✅ 已点击终端区域: {selector}")
-                        break
-                except:
-                    continue
-            else:
-                await page.mouse.click(640, 400)
-            
-            await asyncio.sleep(1)
-            await page.keyboard.type(command, delay=30)
-            await asyncio.sleep(0.5)
-            await page.keyboard.press('Enter')
-            print("  ✅ 命令已发送")
-            
-            await asyncio.sleep(5)
-            await page.screenshot(path="final_result.png")
-            print("📸 最终结果截图已保存")
-            
-            print("✅ 脚本执行完成!")
-            
-            # 发送 Telegram 通知
-            if tg_bot_token and tg_chat_id:
-                await send_telegram_notification(
-                    tg_bot_token, 
-                    tg_chat_id, 
-                    username, 
-                    "final_result.png"
-                )
+    endpoints = load_endpoints(store.directory)
+    results = [None] * len(targets)
+    pending = list(range(len(targets)))
+    
+    # 先做不启动浏览器的预检：进程不在时直接在预检的终端连接上重启，只有登录或连接失败的主机才走浏览器
+    if not FORCE_RESTART:
+        probes = await asyncio.gather(*(probe_target(t, store, endpoints) for t in targets))
+        pending = []
+        for i, (target, outcome) in enumerate(zip(targets, probes)):
+            if outcome:
+                results[i] = {'host': target['host'], 'username': target['username'], 'error': None,
+                              'terminal_ws': endpoints.get(target['host']), **outcome}
             else:
-                print("⚠️ 未设置 Telegram 配置，跳过通知")
-            
-        except Exception as e:
-            print(f"❌ 发生错误: {str(e)}")
-            await page.screenshot(path="error_screenshot.png")
-            raise
-        finally:
-            await browser.close()
+                pending.append(i)
+    
+    if pending:
+        print(f"🚀 启动浏览器... ({len(pending)} 台主机，并发 {concurrency})")
+        async with browser_pool(size=0) as pool:
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+            browser_results = await asyncio.gather(*(run_target(pool, targets[i], store, semaphore) for i in pending))
+        
+        for i, result in zip(pending, browser_results):
+            results[i] = result
+            if result['terminal_ws']:
+                endpoints[result['host']] = result['terminal_ws']
+        save_endpoints(store.directory, endpoints)
+    else:
+        print("💚 所有主机已在预检中处理完毕，无需启动浏览器")
+    
+    failed = [r for r in results
+              if r['error'] or any(item['exit_status'] not in (None, 0) for item in r['commands'])]
+    print(f"📊 汇总: {len(results) - len(failed)}/{len(results)} 台主机成功")
+    
+    # 发送 Telegram 通知
+    if tg_bot_token and tg_chat_id:
+        await send_telegram_notification(tg_bot_token, tg_chat_id, results)
+    else:
+        print("⚠️ 未设置 Telegram 配置，跳过通知")
+    
+    if failed:
+        exit(1)
+    print("✅ 脚本执行完成!")
+
+async def run():
+    with trace_run("data-online"):
+        await main()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    asyncio.run(run())
@@ -4,27 +4,50 @@
 KataBump 自动续订脚本 (支持 Turnstile 验证码)
 cron: 0 9,21 * * *
 new Env('KataBump续订');
+
+设置 RENEW_SCHEDULE_FILE 后记录每台服务器的到期时间和下次可续订时间，
+所有服务器都未到时间时直接退出（见 renew_schedule.py）
 """
 
 import os
 import sys
 import re
 import asyncio
-import requests
+import aiohttp
 import time
 from datetime import datetime, timezone, timedelta
-from playwright.async_api import async_playwright
+from browser_pool import browser_pool
+from renew_schedule import RenewSchedule
+from renew_trace import ACCOUNT, API, CHALLENGE, LOGIN, NAVIGATE, NOTIFY, RENEW, SERVER, current_span, span, trace_run
+from screenshot_policy import ScreenshotPolicy
 
 # 配置
 DASHBOARD_URL = 'https://dashboard.katabump.com'
-SERVER_ID = os.environ.get('KATA_SERVER_ID') or ''
 KATA_EMAIL = os.environ.get('KATA_EMAIL') or ''
 KATA_PASSWORD = os.environ.get('KATA_PASSWORD') or ''
+KATA_ACCOUNTS = os.environ.get('KATA_ACCOUNTS') or ''
+SERVER_ID = os.environ.get('KATA_SERVER_ID') or ''
+CAPTCHA_CONCURRENCY = int(os.environ.get('KATA_CAPTCHA_CONCURRENCY') or 3)
 TG_BOT_TOKEN = os.environ.get('TG_BOT_TOKEN') or ''
 TG_CHAT_ID = os.environ.get('TG_USER_ID') or ''
 CAPSOLVER_KEY = os.environ.get('CAPSOLVER_KEY') or ''
 SCREENSHOT_DIR = os.environ.get('SCREENSHOT_DIR') or '/tmp'
+SCREENSHOTS = ScreenshotPolicy.from_env(directory=SCREENSHOT_DIR)
 TURNSTILE_SITEKEY = '0x4AAAAAAA1IssKDXD0TRMjP'
+TURNSTILE_TOKEN_TTL = 280  # Turnstile token 有效期 300 秒，留出提交余量
+SCHEDULE = RenewSchedule.from_env()
+COOLDOWN_HOURS = 24  # 续订受限且提示里没有具体时间时，按上次成功后 24 小时再试
+ALERT_DAYS = 2  # 与续订提醒的剩余天数一致
+
+# 把 token 写入 Turnstile 小组件自己的隐藏输入框；不另造同名输入框，否则表单会提交两个值
+TURNSTILE_INPUT = '#renew-modal input[name="cf-turnstile-response"]'
+INJECT_TOKEN_JS = '''
+(token) => {
+    const inputs = Array.from(document.querySelectorAll('#renew-modal input[name="cf-turnstile-response"]'));
+    inputs.forEach(i => i.value = token);
+    return inputs.length;
+}
+'''
 
 
 def log(msg):
@@ -33,74 +56,232 @@ def log(msg):
     print(f'[{t}] {msg}')
 
 
-def tg_notify(message):
-    if not TG_BOT_TOKEN or not TG_CHAT_ID:
-        return False
-    try:
-        requests.post(
-            f'https://api.telegram.org/bot{TG_BOT_TOKEN}/sendMessage',
-            json={'chat_id': TG_CHAT_ID, 'text': message, 'parse_mode': 'HTML'},
-            timeout=30
-        )
+class TelegramDispatcher:
+    """后台发送 Telegram 消息和截图：调用方只入队不等待，按入队顺序逐条发送，退出前 flush()"""
+
+    API = 'https://api.telegram.org'
+
+    def __init__(self, token, chat_id):
+        self.token = token
+        self.chat_id = chat_id
+        self._queue = asyncio.Queue()
+        self._worker = None
+        self._session = None
+
+    @property
+    def enabled(self):
+        return bool(self.token and self.chat_id)
+
+    def notify(self, message):
+        return self._enqueue('sendMessage', {'text': message}, None)
+
+    def notify_photo(self, photo_path, caption=''):
+        if not photo_path:
+            return self.notify(caption)
+        return self._enqueue('sendPhoto', {'caption': caption}, photo_path)
+
+    def _enqueue(self, method, data, photo_path):
+        if not self.enabled:
+            return False
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+        # 记下入队时所在的步骤，发送耗时记到对应账号 / 服务器下
+        self._queue.put_nowait((method, data, photo_path, current_span()))
         return True
-    except:
-        return False
 
+    async def _run(self):
+        while True:
+            method, data, photo_path, parent = await self._queue.get()
+            try:
+                with span(NOTIFY, parent=parent, method=method):
+                    await self._send(method, data, photo_path)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log(f'⚠️ Telegram 发送失败: {e}')
+            finally:
+                self._queue.task_done()
 
-def tg_notify_photo(photo_path, caption=''):
-    if not TG_BOT_TOKEN or not TG_CHAT_ID:
-        return False
-    try:
+    async def _send(self, method, data, photo_path):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        url = f'{self.API}/bot{self.token}/{method}'
+        fields = {'chat_id': self.chat_id, 'parse_mode': 'HTML', **data}
+
+        if photo_path is None:
+            async with self._session.post(url, json=fields) as resp:
+                await resp.read()
+            return
+
+        form = aiohttp.FormData()
+        for key, value in fields.items():
+            form.add_field(key, str(value))
         with open(photo_path, 'rb') as f:
-            requests.post(
-                f'https://api.telegram.org/bot{TG_BOT_TOKEN}/sendPhoto',
-                data={'chat_id': TG_CHAT_ID, 'caption': caption, 'parse_mode': 'HTML'},
-                files={'photo': f},
-                timeout=60
-            )
-        return True
-    except:
-        return False
+            form.add_field('photo', f.read(), filename=os.path.basename(photo_path))
+        async with self._session.post(url, data=form) as resp:
+            await resp.read()
+
+    async def flush(self, timeout=120):
+        """等待队列发送完毕后关闭连接"""
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                log(f'⚠️ Telegram 队列未在 {timeout} 秒内发送完毕，剩余 {self._queue.qsize()} 条')
+            self._worker.cancel()
+            self._worker = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
 
 
-def solve_turnstile_capsolver(page_url, sitekey):
-    if not CAPSOLVER_KEY:
-        return None
-    
-    log('🔄 使用 Capsolver 解决 Turnstile...')
-    try:
-        resp = requests.post('https://api.capsolver.com/createTask', json={
-            'clientKey': CAPSOLVER_KEY,
-            'task': {'type': 'AntiTurnstileTaskProxyLess', 'websiteURL': page_url, 'websiteKey': sitekey}
-        }, timeout=30)
-        result = resp.json()
-        
-        if result.get('errorId') != 0:
-            log(f'❌ Capsolver 创建任务失败: {result.get("errorDescription")}')
+telegram = TelegramDispatcher(TG_BOT_TOKEN, TG_CHAT_ID)
+
+
+def tg_notify(message):
+    return telegram.notify(message)
+
+
+def tg_notify_photo(photo_path, caption=''):
+    return telegram.notify_photo(photo_path, caption)
+
+
+class CapsolverClient:
+    """异步 Capsolver 客户端：复用同一个连接池，轮询间隔指数退避"""
+
+    API = 'https://api.capsolver.com'
+
+    def __init__(self, client_key, timeout=60, first_poll=0.5, max_poll=5.0, max_concurrent=3):
+        self.client_key = client_key
+        self.timeout = timeout
+        self.first_poll = first_poll
+        self.max_poll = max_poll
+        self._session = None
+        self._slots = asyncio.Semaphore(max(1, max_concurrent))
+
+    async def _post(self, path, payload):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        async with self._session.post(f'{self.API}/{path}', json={'clientKey': self.client_key, **payload}) as resp:
+            return await resp.json(content_type=None)
+
+    async def solve_turnstile(self, page_url, sitekey):
+        if not self.client_key:
             return None
-        
-        task_id = result.get('taskId')
-        log(f'📋 任务创建成功: {task_id}')
-        
-        for i in range(60):
-            time.sleep(1)
-            resp = requests.post('https://api.capsolver.com/getTaskResult', json={
-                'clientKey': CAPSOLVER_KEY, 'taskId': task_id
-            }, timeout=30)
-            result = resp.json()
-            
-            if result.get('status') == 'ready':
-                log('✅ Turnstile 已解决')
-                return result.get('solution', {}).get('token')
-            elif result.get('status') == 'failed':
-                log(f'❌ Capsolver 失败: {result.get("errorDescription")}')
+        async with self._slots:
+            return await self._solve_turnstile(page_url, sitekey)
+
+    async def _solve_turnstile(self, page_url, sitekey):
+        log('🔄 使用 Capsolver 解决 Turnstile...')
+        try:
+            result = await self._post('createTask', {
+                'task': {'type': 'AntiTurnstileTaskProxyLess', 'websiteURL': page_url, 'websiteKey': sitekey}
+            })
+            if result.get('errorId') != 0:
+                log(f'❌ Capsolver 创建任务失败: {result.get("errorDescription")}')
                 return None
-        
-        log('❌ Capsolver 超时')
+
+            task_id = result.get('taskId')
+            log(f'📋 任务创建成功: {task_id}')
+
+            delay = self.first_poll
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(delay)
+                delay = min(delay * 1.5, self.max_poll)
+                result = await self._post('getTaskResult', {'taskId': task_id})
+
+                if result.get('status') == 'ready':
+                    log('✅ Turnstile 已解决')
+                    return result.get('solution', {}).get('token')
+                elif result.get('status') == 'failed' or result.get('errorId'):
+                    log(f'❌ Capsolver 失败: {result.get("errorDescription")}')
+                    return None
+
+            log('❌ Capsolver 超时')
+            return None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f'❌ Capsolver 错误: {e}')
+            return None
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class SpeculativeTurnstile:
+    """进程启动时就开始求解 Turnstile，token 连同取得时间一起缓存，模态框打开后直接注入"""
+
+    def __init__(self, client, page_url, sitekey):
+        self.client = client
+        self.page_url = page_url
+        self.sitekey = sitekey
+        self._task = None
+        self._token = None
+        self._obtained_at = 0.0
+
+    def start(self):
+        if self.client.client_key and self._task is None:
+            log('🚀 预先启动 Turnstile 求解')
+            self._task = asyncio.ensure_future(self._solve())
+
+    async def _solve(self):
+        token = await self.client.solve_turnstile(self.page_url, self.sitekey)
+        if token:
+            self._token, self._obtained_at = token, time.monotonic()
+        return token
+
+    def fresh_token(self):
+        """取出仍在有效期内的 token（一次性使用）"""
+        if self._token and time.monotonic() - self._obtained_at < TURNSTILE_TOKEN_TTL:
+            token, self._token = self._token, None
+            return token
         return None
-    except Exception as e:
-        log(f'❌ Capsolver 错误: {e}')
+
+    async def wait_token(self):
+        """等待预先求解的结果；已过期、已用过或失败时重新求解"""
+        token = self.fresh_token()
+        if token:
+            return token
+        if self._task is None or self._task.done():
+            self._token = None
+            self._task = asyncio.ensure_future(self._solve())
+        await asyncio.shield(self._task)
+        return self.fresh_token()
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+async def inject_turnstile_token(page, token, timeout=15000):
+    """等小组件渲染出输入框后写入 token，返回写入的输入框数量（0 表示输入框一直没出现）"""
+    try:
+        await page.locator(TURNSTILE_INPUT).first.wait_for(state='attached', timeout=timeout)
+    except Exception:
+        log('⚠️ Turnstile 输入框未出现，Token 未注入')
+        return 0
+    count = await page.evaluate(INJECT_TOKEN_JS, token)
+    log(f'✅ Token 已注入 ({count} 处)')
+    return count
+
+
+async def first_token(*coros):
+    """并发运行多个取 token 的协程，返回最先得到的非空 token，其余取消"""
+    tasks = [asyncio.ensure_future(c) for c in coros]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    return task.result()
         return None
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
 
 def get_expiry_from_text(text):
@@ -117,141 +298,168 @@ def days_until(date_str):
         return None
 
 
-async def run():
-    log('🚀 KataBump 自动续订')
-    log(f'🖥 服务器 ID: {SERVER_ID}')
-    
-    if not SERVER_ID:
-        raise Exception('未设置 KATA_SERVER_ID')
-    
-    server_url = f'{DASHBOARD_URL}/servers/edit?id={SERVER_ID}'
-    
-    async with async_playwright() as p:
-        # 使用新版 headless 模式，更难被检测
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-blink-features=AutomationControlled',
-                '--disable-infobars',
-                '--window-size=1280,900',
-                '--start-maximized',
-            ]
-        )
-        
-        context = await browser.new_context(
-            viewport={'width': 1280, 'height': 900},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            locale='en-US',
-            timezone_id='America/New_York',
-        )
-        
-        page = await context.new_page()
+def renewable_at(error_msg):
+    """从续订受限提示（如 "... You will be able to as of 17 October (in 2 days)"）推算可续订时间"""
+    match = re.search(r'in (\d+) (day|hour)', error_msg or '', re.IGNORECASE)
+    if not match:
+        return None
+    if match.group(2).lower() == 'hour':
+        return time.time() + int(match.group(1)) * 3600
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return (today + timedelta(days=int(match.group(1)))).timestamp()
+
+
+def parse_list(value):
+    """逗号或换行分隔的列表"""
+    return [item.strip() for item in re.split(r'[,\n]', value or '') if item.strip()]
+
+
+def parse_accounts():
+    """
+    KATA_ACCOUNTS: 邮箱:密码:服务器ID1|服务器ID2，多个账号用逗号或换行分隔
+    未设置时使用 KATA_EMAIL / KATA_PASSWORD，服务器来自 KATA_SERVER_ID（可逗号分隔多个）
+    """
+    accounts = []
+    for entry in parse_list(KATA_ACCOUNTS):
+        if entry.count(':') < 2:
+            log(f'⚠️ 账号格式错误，已跳过: {entry[:3]}***')
+            continue
+        email, rest = entry.split(':', 1)
+        password, servers = rest.rsplit(':', 1)
+        server_ids = [s.strip() for s in servers.split('|') if s.strip()]
+        if email.strip() and password and server_ids:
+            accounts.append({'email': email.strip(), 'password': password, 'servers': server_ids})
+
+    server_ids = parse_list(SERVER_ID)
+    if not accounts and KATA_EMAIL and KATA_PASSWORD and server_ids:
+        accounts.append({'email': KATA_EMAIL, 'password': KATA_PASSWORD, 'servers': server_ids})
+    return accounts
+
+
+def server_edit_url(server_id):
+    return f'{DASHBOARD_URL}/servers/edit?id={server_id}'
+
+
+async def login(context, account):
+    """每个账号只登录一次，同一上下文里的所有标签页共享登录状态"""
+    email = account['email']
+    page = await context.new_page()
+    log(f'🔐 正在登录 {email[:3]}***...')
+    with span(LOGIN):
+        with span(NAVIGATE, page='login'):
+            await page.goto(f'{DASHBOARD_URL}/auth/login', timeout=60000)
+            await page.wait_for_timeout(2000)
         
-        # 更完整的反检测脚本
-        await page.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-            Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
-            Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
-            window.chrome = { runtime: {} };
-            Object.defineProperty(navigator, 'permissions', {
-                get: () => ({ query: () => Promise.resolve({ state: 'granted' }) })
-            });
-        """)
+        await page.locator('input[name="email"], input[type="email"]').fill(email)
+        await page.locator('input[name="password"], input[type="password"]').fill(account['password'])
+        await page.locator('button[type="submit"], input[type="submit"]').first.click()
         
+        await page.wait_for_timeout(4000)
         try:
-            # 登录
-            log('🔐 正在登录...')
-            await page.goto(f'{DASHBOARD_URL}/auth/login', timeout=60000)
-            await page.wait_for_timeout(2000)
-            
-            await page.locator('input[name="email"], input[type="email"]').fill(KATA_EMAIL)
-            await page.locator('input[name="password"], input[type="password"]').fill(KATA_PASSWORD)
-            await page.locator('button[type="submit"], input[type="submit"]').first.click()
-            
-            await page.wait_for_timeout(4000)
-            try:
-                await page.wait_for_url('**/dashboard**', timeout=15000)
-            except:
-                pass
-            
-            if '/auth/login' in page.url:
-                screenshot_path = os.path.join(SCREENSHOT_DIR, 'login_failed.png')
-                await page.screenshot(path=screenshot_path, full_page=True)
-                tg_notify_photo(screenshot_path, '❌ 登录失败')
-                raise Exception('登录失败')
-            
-            log('✅ 登录成功')
-            
-            # 打开服务器页面
-            log(f'📄 打开服务器页面')
+            await page.wait_for_url('**/dashboard**', timeout=15000)
+        except:
+            pass
+        
+        if '/auth/login' in page.url:
+            screenshot_path = await SCREENSHOTS.recorder(f'login_{email[:3]}').failure(page, 'failed')
+            tg_notify_photo(screenshot_path, f'❌ 登录失败\n📧 {email[:3]}***')
+            raise Exception(f'登录失败: {email[:3]}***')
+    
+    log(f'✅ 登录成功 {email[:3]}***')
+    await page.close()
+
+
+async def renew_server(context, server_id, speculative):
+    """在独立标签页中续订一台服务器，返回 success / reminder / skipped"""
+    with span(SERVER, server=server_id) as step:
+        result = await _renew_server(context, server_id, speculative)
+        step.set('outcome', result)
+        return result
+
+
+async def _renew_server(context, server_id, speculative):
+    def say(msg):
+        log(f'[{server_id}] {msg}')
+    
+    server_url = server_edit_url(server_id)
+    shots = SCREENSHOTS.recorder(server_id)
+    page = await context.new_page()
+    
+    try:
+        # 打开服务器页面
+        say('📄 打开服务器页面')
+        with span(NAVIGATE, page='server'):
             await page.goto(server_url, timeout=60000, wait_until='domcontentloaded')
             
             try:
                 await page.locator('button[data-bs-target="#renew-modal"]').wait_for(timeout=20000)
-                log('✅ 页面加载完成')
+                say('✅ 页面加载完成')
             except:
                 await page.wait_for_timeout(5000)
-            
-            page_content = await page.content()
-            old_expiry = get_expiry_from_text(page_content) or '未知'
-            days = days_until(old_expiry)
-            log(f'📅 当前到期: {old_expiry} (剩余 {days} 天)')
-            
-            # 点击 Renew 按钮
-            log('🔍 查找 Renew 按钮...')
-            main_renew_btn = page.locator('button[data-bs-target="#renew-modal"]')
-            if await main_renew_btn.count() == 0:
-                main_renew_btn = page.locator('button.btn-outline-primary:has-text("Renew")')
-            
-            if await main_renew_btn.count() == 0:
-                screenshot_path = os.path.join(SCREENSHOT_DIR, 'no_renew.png')
-                await page.screenshot(path=screenshot_path, full_page=True)
-                tg_notify_photo(screenshot_path, f'❌ 未找到 Renew 按钮\n服务器: {SERVER_ID}')
-                raise Exception('未找到 Renew 按钮')
-            
-            log('🖱 点击 Renew 按钮...')
+        
+        await shots.checkpoint(page, 'loaded')
+        page_content = await page.content()
+        old_expiry = get_expiry_from_text(page_content) or '未知'
+        days = days_until(old_expiry)
+        say(f'📅 当前到期: {old_expiry} (剩余 {days} 天)')
+        SCHEDULE.update('katabump', server_id, expiry_text=get_expiry_from_text(page_content), alert_days=ALERT_DAYS)
+        
+        # 点击 Renew 按钮
+        say('🔍 查找 Renew 按钮...')
+        main_renew_btn = page.locator('button[data-bs-target="#renew-modal"]')
+        if await main_renew_btn.count() == 0:
+            main_renew_btn = page.locator('button.btn-outline-primary:has-text("Renew")')
+        
+        if await main_renew_btn.count() == 0:
+            screenshot_path = await shots.failure(page, 'no_renew')
+            tg_notify_photo(screenshot_path, f'❌ 未找到 Renew 按钮\n服务器: {server_id}')
+            raise Exception('未找到 Renew 按钮')
+        
+        say('🖱 点击 Renew 按钮...')
+        with span(RENEW, action='open_modal'):
             await main_renew_btn.first.click()
-            await page.wait_for_timeout(2000)
             
             # 等待模态框
             modal = page.locator('#renew-modal')
             try:
                 await modal.wait_for(state='visible', timeout=5000)
-                log('✅ 模态框已打开')
+                say('✅ 模态框已打开')
             except:
-                screenshot_path = os.path.join(SCREENSHOT_DIR, 'modal_error.png')
-                await page.screenshot(path=screenshot_path, full_page=True)
-                tg_notify_photo(screenshot_path, '❌ 模态框未打开')
+                screenshot_path = await shots.failure(page, 'modal_error')
+                tg_notify_photo(screenshot_path, f'❌ 模态框未打开\n服务器: {server_id}')
                 raise Exception('模态框未打开')
+        
+        # 处理 Turnstile 验证码
+        say('🔍 检查 Turnstile 验证码...')
+        turnstile = page.locator('#renew-modal .cf-turnstile, #renew-modal [data-sitekey]')
+        turnstile_token = None
+        
+        if await turnstile.count() > 0:
+            say('🛡 检测到 Turnstile 验证码')
+            turnstile_token = speculative.fresh_token()
+            if turnstile_token:
+                say('⚡ 使用预先求解的 Token')
+                if not await inject_turnstile_token(page, turnstile_token):
+                    turnstile_token = None
             
-            # 处理 Turnstile 验证码
-            log('🔍 检查 Turnstile 验证码...')
-            turnstile = page.locator('#renew-modal .cf-turnstile, #renew-modal [data-sitekey]')
-            turnstile_token = None
-            
-            if await turnstile.count() > 0:
-                log('🛡 检测到 Turnstile 验证码')
-                
+            async def native_attempt():
                 # 等待 iframe 加载
                 await page.wait_for_timeout(2000)
                 
                 # 尝试点击 Turnstile checkbox
-                log('🖱 尝试点击 Turnstile...')
+                say('🖱 尝试点击 Turnstile...')
                 try:
                     turnstile_iframe = page.frame_locator('#renew-modal iframe[src*="turnstile"]').first
                     checkbox = turnstile_iframe.locator('input[type="checkbox"], .cb-i, #cf-stage')
                     if await checkbox.count() > 0:
                         await checkbox.first.click()
-                        log('✅ 已点击 Turnstile checkbox')
+                        say('✅ 已点击 Turnstile checkbox')
                 except Exception as e:
-                    log(f'⚠️ 点击 checkbox 失败: {e}')
+                    say(f'⚠️ 点击 checkbox 失败: {e}')
                 
                 # 等待验证完成
-                log('⏳ 等待 Turnstile 验证...')
-                response_input = page.locator('#renew-modal input[name="cf-turnstile-response"]')
+                say('⏳ 等待 Turnstile 验证...')
+                response_input = page.locator(TURNSTILE_INPUT)
                 
                 for i in range(30):
                     await page.wait_for_timeout(1000)
@@ -259,105 +467,207 @@ async def run():
                     if await response_input.count() > 0:
                         current_value = await response_input.get_attribute('value') or ''
                         if len(current_value) > 20:
-                            log(f'✅ Turnstile 验证成功 ({i+1}秒)')
-                            turnstile_token = current_value
-                            break
+                            say(f'✅ Turnstile 验证成功 ({i+1}秒)')
+                            return current_value
                     
                     if i % 5 == 4:
-                        log(f'⏳ 继续等待... ({i+1}秒)')
-                        # 每5秒截图查看状态
-                        if i == 9:
-                            screenshot_path = os.path.join(SCREENSHOT_DIR, 'turnstile_waiting.png')
-                            await page.screenshot(path=screenshot_path, full_page=True)
-                
-                if not turnstile_token and CAPSOLVER_KEY:
-                    turnstile_token = solve_turnstile_capsolver(server_url, TURNSTILE_SITEKEY)
-                    if turnstile_token:
-                        await page.evaluate('(token) => { document.querySelectorAll(\'input[name="cf-turnstile-response"]\').forEach(i => i.value = token); }', turnstile_token)
-                        log('✅ Token 已注入')
-                
-                if not turnstile_token:
-                    log('❌ Turnstile 验证失败')
-                    screenshot_path = os.path.join(SCREENSHOT_DIR, 'turnstile_failed.png')
-                    await page.screenshot(path=screenshot_path, full_page=True)
-                    
-                    if days is not None and days <= 3:
-                        tg_notify_photo(screenshot_path, f'⚠️ 需要手动续订\n服务器: {SERVER_ID}\n到期: {old_expiry} (剩余 {days} 天)\n\n👉 {server_url}')
-                    else:
-                        log(f'ℹ️ 剩余 {days} 天，暂不紧急')
-                    return
-            else:
-                log('✅ 无需验证码')
+                        say(f'⏳ 继续等待... ({i+1}秒)')
+                        # 只截模态框区域，放进内存缓冲，验证失败时才写盘
+                        await shots.checkpoint(page, f'turnstile_waiting_{i+1}s', selector='#renew-modal .modal-content')
+                return None
             
-            # 提交续订
-            log('🖱 点击确认 Renew...')
-            submit_btn = page.locator('#renew-modal button[type="submit"]')
-            if await submit_btn.count() == 0:
-                submit_btn = page.locator('#renew-modal .modal-footer button.btn-primary')
+            async def capsolver_attempt():
+                token = await speculative.wait_token()
+                if token and await inject_turnstile_token(page, token):
+                    return token
+                return None
             
-            await submit_btn.first.click()
+            # 页面内点击与 Capsolver（预先求解中的任务）同时进行，谁先拿到 token 用谁
+            if not turnstile_token:
+                attempts = [native_attempt()]
+                if CAPSOLVER_KEY:
+                    attempts.append(capsolver_attempt())
+                with span(CHALLENGE, kind='turnstile', capsolver=bool(CAPSOLVER_KEY)) as challenge:
+                    turnstile_token = await first_token(*attempts)
+                    if not turnstile_token:
+                        challenge.fail('turnstile not solved')
             
-            log('⏳ 等待服务器响应...')
+            if not turnstile_token:
+                say('❌ Turnstile 验证失败')
+                screenshot_path = await shots.failure(page, 'turnstile_failed', selector='#renew-modal .modal-content')
+                
+                if days is not None and days <= 3:
+                    tg_notify_photo(screenshot_path, f'⚠️ 需要手动续订\n服务器: {server_id}\n到期: {old_expiry} (剩余 {days} 天)\n\n👉 {server_url}')
+                else:
+                    say(f'ℹ️ 剩余 {days} 天，暂不紧急')
+                SCHEDULE.update('katabump', server_id, renew_after=0, outcome='skipped')
+                return 'skipped'
+        else:
+            say('✅ 无需验证码')
+            # 预先求解的 token 用不上，停止轮询，不再占用 Capsolver 并发名额
+            speculative.cancel()
+        
+        # 提交续订
+        say('🖱 点击确认 Renew...')
+        submit_btn = page.locator('#renew-modal button[type="submit"]')
+        if await submit_btn.count() == 0:
+            submit_btn = page.locator('#renew-modal .modal-footer button.btn-primary')
+        
+        with span(RENEW, action='submit'):
+            await submit_btn.first.click()
+        
+        say('⏳ 等待服务器响应...')
+        with span(API, endpoint='renew'):
             await page.wait_for_timeout(5000)
             
             try:
                 await page.wait_for_load_state('domcontentloaded', timeout=15000)
             except:
                 pass
+        
+        # 检查结果
+        say('🔍 检查续订结果...')
+        current_url = page.url
+        page_content = await page.content()
+        screenshot_path = await shots.capture(page, 'result')
+        
+        if 'renew=success' in current_url:
+            new_expiry = get_expiry_from_text(page_content) or '未知'
+            say(f'🎉 续订成功！新到期: {new_expiry}')
+            tg_notify_photo(screenshot_path, f'✅ KataBump 续订成功\n服务器: {server_id}\n原到期: {old_expiry}\n新到期: {new_expiry}')
+            SCHEDULE.renewed('katabump', server_id, COOLDOWN_HOURS, expiry_text=get_expiry_from_text(page_content))
+            return 'success'
+        
+        elif 'renew-error' in current_url:
+            error_match = re.search(r'renew-error=([^&]+)', current_url)
+            error_msg = '未知错误'
+            if error_match:
+                from urllib.parse import unquote
+                error_msg = unquote(error_match.group(1).replace('+', ' '))
             
-            # 检查结果
-            log('🔍 检查续订结果...')
-            current_url = page.url
-            page_content = await page.content()
-            screenshot_path = os.path.join(SCREENSHOT_DIR, 'result.png')
-            await page.screenshot(path=screenshot_path, full_page=True)
-            
-            if 'renew=success' in current_url:
-                new_expiry = get_expiry_from_text(page_content) or '未知'
-                log(f'🎉 续订成功！新到期: {new_expiry}')
-                tg_notify_photo(screenshot_path, f'✅ KataBump 续订成功\n服务器: {SERVER_ID}\n原到期: {old_expiry}\n新到期: {new_expiry}')
-                
-            elif 'renew-error' in current_url:
-                error_match = re.search(r'renew-error=([^&]+)', current_url)
-                error_msg = '未知错误'
-                if error_match:
-                    from urllib.parse import unquote
-                    error_msg = unquote(error_match.group(1).replace('+', ' '))
-                
-                log(f'⚠️ 续订受限: {error_msg}')
-                if days is not None and days <= 2:
-                    tg_notify_photo(screenshot_path, f'ℹ️ KataBump 续订提醒\n服务器: {SERVER_ID}\n到期: {old_expiry} (剩余 {days} 天)\n📝 {error_msg}')
-            else:
-                log('🔄 重新检查到期时间...')
-                await page.goto(server_url, timeout=60000, wait_until='domcontentloaded')
-                await page.wait_for_timeout(3000)
-                
-                page_content = await page.content()
-                new_expiry = get_expiry_from_text(page_content) or '未知'
-                
-                if new_expiry != '未知' and old_expiry != '未知' and new_expiry > old_expiry:
-                    log(f'🎉 续订成功！新到期: {new_expiry}')
-                    screenshot_path = os.path.join(SCREENSHOT_DIR, 'success.png')
-                    await page.screenshot(path=screenshot_path, full_page=True)
-                    tg_notify_photo(screenshot_path, f'✅ KataBump 续订成功\n服务器: {SERVER_ID}\n原到期: {old_expiry}\n新到期: {new_expiry}')
-                else:
-                    log(f'ℹ️ 到期时间: {new_expiry}')
-                    if days is not None and days <= 2:
-                        tg_notify_photo(screenshot_path, f'⚠️ 请检查续订状态\n服务器: {SERVER_ID}\n到期: {new_expiry} (剩余 {days} 天)\n\n👉 {server_url}')
+            say(f'⚠️ 续订受限: {error_msg}')
+            if days is not None and days <= 2:
+                tg_notify_photo(screenshot_path, f'ℹ️ KataBump 续订提醒\n服务器: {server_id}\n到期: {old_expiry} (剩余 {days} 天)\n📝 {error_msg}')
+            SCHEDULE.cooling('katabump', server_id, COOLDOWN_HOURS, until=renewable_at(error_msg))
+            return 'reminder'
         
-        except Exception as e:
-            log(f'❌ 错误: {e}')
-            try:
-                screenshot_path = os.path.join(SCREENSHOT_DIR, 'error.png')
-                await page.screenshot(path=screenshot_path, full_page=True)
+        say('🔄 重新检查到期时间...')
+        with span(NAVIGATE, page='server'):
+            await page.goto(server_url, timeout=60000, wait_until='domcontentloaded')
+            await page.wait_for_timeout(3000)
+        
+        page_content = await page.content()
+        new_expiry = get_expiry_from_text(page_content) or '未知'
+        
+        if new_expiry != '未知' and old_expiry != '未知' and new_expiry > old_expiry:
+            say(f'🎉 续订成功！新到期: {new_expiry}')
+            screenshot_path = await shots.capture(page, 'success')
+            tg_notify_photo(screenshot_path, f'✅ KataBump 续订成功\n服务器: {server_id}\n原到期: {old_expiry}\n新到期: {new_expiry}')
+            SCHEDULE.renewed('katabump', server_id, COOLDOWN_HOURS, expiry_text=get_expiry_from_text(page_content))
+            return 'success'
+        
+        say(f'ℹ️ 到期时间: {new_expiry}')
+        if days is not None and days <= 2:
+            tg_notify_photo(screenshot_path, f'⚠️ 请检查续订状态\n服务器: {server_id}\n到期: {new_expiry} (剩余 {days} 天)\n\n👉 {server_url}')
+        # 结果不确定，下次运行再检查
+        SCHEDULE.update('katabump', server_id, renew_after=0, outcome='reminder')
+        return 'reminder'
+    
+    except Exception as e:
+        say(f'❌ 错误: {e}')
+        SCHEDULE.update('katabump', server_id, outcome='error')
+        try:
+            screenshot_path = await shots.failure(page, 'error')
+            if screenshot_path:
                 tg_notify_photo(screenshot_path, f'❌ 出错: {e}')
-            except:
-                pass
-            tg_notify(f'❌ KataBump 出错\n🖥 {SERVER_ID}\n❗ {e}')
-            raise
+        except:
+            pass
+        tg_notify(f'❌ KataBump 出错\n🖥 {server_id}\n❗ {e}')
+        raise
+    
+    finally:
+        await page.close()
+
+
+# 在通用反检测脚本之外，KataBump 还需要让 permissions.query 一律返回 granted
+KATA_INIT_SCRIPT = '''
+    Object.defineProperty(navigator, 'permissions', {
+        get: () => ({ query: () => Promise.resolve({ state: 'granted' }) })
+    });
+'''
+KATA_CONTEXT_OPTIONS = {'timezone_id': 'America/New_York', 'init_script': KATA_INIT_SCRIPT}
+
+
+async def run_account(pool, account, speculatives):
+    """一个账号一个浏览器上下文：登录一次，各服务器在并行标签页中续订"""
+    with span(ACCOUNT, account=f'{account["email"][:3]}***'):
+        return await _run_account(pool, account, speculatives)
+
+
+async def _run_account(pool, account, speculatives):
+    async with pool.context(**KATA_CONTEXT_OPTIONS) as context:
+        try:
+            await login(context, account)
+        except Exception as e:
+            log(f'❌ {e}')
+            tg_notify(f'❌ KataBump 出错\n📧 {account["email"][:3]}***\n❗ {e}')
+            for server_id in account['servers']:
+                SCHEDULE.update('katabump', server_id, outcome='error')
+            return {server_id: e for server_id in account['servers']}
         
-        finally:
-            await browser.close()
+        results = await asyncio.gather(
+            *(renew_server(context, server_id, speculatives[server_id]) for server_id in account['servers']),
+            return_exceptions=True,
+        )
+        return dict(zip(account['servers'], results))
+
+
+async def run(accounts):
+    server_ids = [s for acc in accounts for s in acc['servers']]
+    SCHEDULE.retain('katabump', server_ids)
+    if not SCHEDULE.gate('katabump', server_ids):
+        SCHEDULE.save()
+        return
+    total = sum(len(acc['servers']) for acc in accounts)
+    log('🚀 KataBump 自动续订')
+    log(f'👥 账号: {len(accounts)} 个, 🖥 服务器: {total} 台')
+    
+    # 站点 key 和页面地址启动时已知，先把验证码求解放到后台，和启动浏览器、登录、打开页面并行；
+    # 只为调度认为需要续订的服务器预先求解（每次求解都要付费），其余的在模态框里真遇到验证码时再求解。
+    # 并发求解数量由 CapsolverClient 的信号量限制
+    capsolver = CapsolverClient(CAPSOLVER_KEY, max_concurrent=CAPTCHA_CONCURRENCY)
+    speculatives = {}
+    for acc in accounts:
+        for server_id in acc['servers']:
+            speculatives[server_id] = SpeculativeTurnstile(capsolver, server_edit_url(server_id), TURNSTILE_SITEKEY)
+            if SCHEDULE.is_due('katabump', server_id):
+                speculatives[server_id].start()
+    
+    try:
+        async with browser_pool(size=0) as pool:
+            pool.prewarm(len(accounts), **KATA_CONTEXT_OPTIONS)
+            results = {}
+            for account_results in await asyncio.gather(*(run_account(pool, acc, speculatives) for acc in accounts)):
+                results.update(account_results)
+    finally:
+        for speculative in speculatives.values():
+            speculative.cancel()
+        await capsolver.close()
+        await telegram.flush()
+        SCHEDULE.save()
+    
+    icons = {'success': '✅', 'reminder': 'ℹ️', 'skipped': '⏭'}
+    log('📊 汇总:')
+    failed = []
+    for server_id, result in results.items():
+        if isinstance(result, BaseException):
+            failed.append(server_id)
+            log(f'  ❌ {server_id}: {result}')
+        else:
+            log(f'  {icons.get(result, "•")} {server_id}: {result}')
+    
+    if failed:
+        raise Exception(f'{len(failed)}/{len(results)} 台服务器续订出错: {", ".join(failed)}')
 
 
 def main():
@@ -365,19 +675,17 @@ def main():
     log('   KataBump 自动续订')
     log('=' * 50)
     
-    if not KATA_EMAIL or not KATA_PASSWORD:
-        log('❌ 请设置 KATA_EMAIL 和 KATA_PASSWORD')
-        sys.exit(1)
-    
-    if not SERVER_ID:
-        log('❌ 请设置 KATA_SERVER_ID')
+    accounts = parse_accounts()
+    if not accounts:
+        log('❌ 请设置 KATA_ACCOUNTS，或 KATA_EMAIL、KATA_PASSWORD 和 KATA_SERVER_ID')
         sys.exit(1)
     
-    log(f'📧 邮箱: {KATA_EMAIL[:3]}***')
-    log(f'🖥 服务器: {SERVER_ID}')
-    log(f'🔑 Capsolver: {"已配置" if CAPSOLVER_KEY else "未配置"}')
+    for acc in accounts:
+        log(f'📧 邮箱: {acc["email"][:3]}*** -> 🖥 {", ".join(acc["servers"])}')
+    log(f'🔑 Capsolver: {"已配置" if CAPSOLVER_KEY else "未配置"} (并发 {CAPTCHA_CONCURRENCY})')
     
-    asyncio.run(run())
+    with trace_run('katabump'):
+        asyncio.run(run(accounts))
     log('🏁 完成')
 
 
@@ -8,27 +8,47 @@ Pella 自动续期脚本 增加重启功能
     - PELLA_PASSWORD / LEAFLOW_PASSWORD=登录密码
 - 多账号变量:
     - PELLA_ACCOUNTS / LEAFLOW_ACCOUNTS: 格式：邮箱1:密码1,邮箱2:密码2,邮箱3:密码3
+- 并发与等待变量 (可选):
+    - PELLA_CONCURRENCY=同时处理的账号数 (默认 3)，所有账号共用一个浏览器，各自独立上下文
+    - PELLA_WAIT_TIMEOUT=单个页面条件的等待上限秒数 (默认 15)，条件满足即返回
+- 会话复用变量 (可选，需要 pynacl):
+    - PELLA_STATE_DIR=加密会话保存目录 (默认 .pella-state，留空则禁用)
+    - PELLA_STATE_KEY=会话加密口令 (未设置时使用各账号密码派生密钥)
 - 通知变量 (可选):
     - TG_BOT_TOKEN=Telegram 机器人 Token
     - TG_CHAT_ID=Telegram 聊天 ID
+- 调度变量 (可选):
+    - RENEW_SCHEDULE_FILE=记录各账号的到期时间和今日已续期状态，未到时间的账号跳过续期点击
+      (重启服务器每次照常执行，见 renew_schedule.py)
 """
 
 import os
 import time
+import json
+import asyncio
 import logging
 import re
 import requests
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+from urllib.parse import urljoin
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+from term_sanitize import sanitize
+from session_store import SessionStore
+from browser_pool import browser_pool
+from renew_schedule import RenewSchedule, account_key
+from renew_trace import ACCOUNT, LOGIN, NAVIGATE, NOTIFY, RENEW, span, trace_run
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DEFAULT_CONCURRENCY = 3
+DEFAULT_STATE_DIR = ".pella-state"
+COOLDOWN_HOURS = 24  # 续期链接每天一次
+ALERT_DAYS = 1
+SCHEDULE = RenewSchedule.from_env()
+
 
 def mask_email(email):
     """隐藏邮箱地址"""
@@ -54,57 +74,202 @@ def mask_url(url):
     return url
 
 
+# 页面内重启输出收集器：只注入一次，只观察终端 pre 容器，逐条处理 MutationRecord 的 addedNodes，
+# 把新增的行追加到 window.__pellaRestart.lines；遇到完成标记时置 done，输出静默 quiet 毫秒后断开观察。
+# 终端容器还没渲染时，先用一个只看 childList 的观察器等它出现，找到后立即断开。
+RESTART_COLLECTOR_JS = """
+([markers, quiet]) => {
+    if (window.__pellaRestart) window.__pellaRestart.stop();
+    const state = { lines: [], done: false, lastChange: Date.now(), observers: [], timer: null };
+    state.stop = () => { state.observers.forEach(o => o.disconnect()); clearTimeout(state.timer); };
+
+    const findPre = () => document.querySelector("pre.bg-black, pre[class*='bg-black']") || document.querySelector('pre');
+
+    const push = (raw) => {
+        for (const part of (raw || '').split('\\n')) {
+            const text = part.trim();
+            if (!text || text === 'Copy') continue;
+            state.lines.push(text);
+            if (markers.some(m => text.includes(m))) state.done = true;
+        }
+    };
+
+    // 新增的节点：行 div 取其文本；包含多行的块逐个取最内层 div；直接挂在 pre 下的文本节点按行拆分
+    const addNode = (node, pre) => {
+        if (node.nodeType === Node.TEXT_NODE) {
+            if (node.parentNode === pre) push(node.textContent);
+            return;
+        }
+        if (node.nodeType !== Node.ELEMENT_NODE) return;
+        const rows = node.tagName === 'DIV' && !node.querySelector('div')
+            ? [node]
+            : Array.from(node.querySelectorAll('div')).filter(d => !d.querySelector('div'));
+        if (rows.length) rows.forEach(d => push(d.innerText));
+        else push(node.innerText);
+    };
+
+    const watch = (pre) => {
+        const observer = new MutationObserver(records => {
+            for (const record of records) record.addedNodes.forEach(n => addNode(n, pre));
+            state.lastChange = Date.now();
+            if (state.done) {
+                clearTimeout(state.timer);
+                state.timer = setTimeout(state.stop, quiet);
+            }
+        });
+        observer.observe(pre, { childList: true, subtree: true });
+        state.observers.push(observer);
+    };
+
+    const pre = findPre();
+    if (pre) {
+        watch(pre);
+    } else {
+        const finder = new MutationObserver(() => {
+            const found = findPre();
+            if (found) { finder.disconnect(); watch(found); }
+        });
+        finder.observe(document.body, { childList: true, subtree: true });
+        state.observers.push(finder);
+    }
+    window.__pellaRestart = state;
+}
+"""
+
+
+@dataclass
+class StepTiming:
+    name: str
+    elapsed: float
+    budget: float
+
+
 class PellaAutoRenew:
     LOGIN_URL = "https://www.pella.app/login"
     HOME_URL = "https://www.pella.app/home"
     RENEW_WAIT_TIME = 8
     WAIT_TIME_AFTER_LOGIN = 20
     RESTART_WAIT_TIME = 60
-
-    def __init__(self, email, password):
+    RESTART_QUIET_MS = 2000
+    RESTART_COMPLETION_MARKERS = [
+        "App is running",
+        "Thank you for using this script",
+        "enjoy!"
+    ]
+    WAIT_TIMEOUT = int(os.getenv('PELLA_WAIT_TIMEOUT', 15))
+    # 旧版各步骤固定 sleep 的最少耗时（秒），用于对比条件等待的实际耗时
+    LEGACY_SLEEP_BUDGET = {
+        "login": 11.4,
+        "get_server_url": 0,
+        "load_server": 5,
+        "renew_click": 12,
+        "restart_server": 6.5,
+    }
+
+    def __init__(self, email, password, pool, session_store=None, renew_due=True):
         self.email = email
         self.password = password
         self.initial_expiry_details = "N/A"
         self.initial_expiry_value = -1.0
+        self.expiry_value = -1.0
+        self.renew_due = renew_due
         self.server_url = None
         self.restart_output = ""
+        self.timings = []
         
         if not self.email or not self.password:
             raise ValueError("邮箱和密码不能为空")
         
-        self.driver = None
-        self.setup_driver()
+        self.pool = pool
+        self.session_store = session_store
+        self._contexts = AsyncExitStack()
+        self.context = None
+        self.page = None
     
-    def setup_driver(self):
-        chrome_options = Options()
-        
-        if os.getenv('GITHUB_ACTIONS'):
-            chrome_options.add_argument('--headless=new')
-            chrome_options.add_argument('--no-sandbox')
-            chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--disable-gpu')
-            chrome_options.add_argument('--window-size=1920,1080')
-        
-        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        
+    async def setup_context(self, storage_state=None):
+        """从共享浏览器池借用当前账号的上下文（带会话时为专用上下文）"""
         try:
-            self.driver = webdriver.Chrome(options=chrome_options)
-            self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        except WebDriverException as e:
-            logger.error(f"❌ 驱动初始化失败: {e}")
+            self.context = await self._contexts.enter_async_context(self.pool.context(
+                storage_state=storage_state,
+                viewport={'width': 1920, 'height': 1080},
+            ))
+            self.page = await self.context.new_page()
+        except PlaywrightError as e:
+            logger.error(f"❌ 上下文初始化失败: {e}")
             raise
 
-    def wait_for_element_clickable(self, by, value, timeout=10):
-        return WebDriverWait(self.driver, timeout).until(
-            EC.element_to_be_clickable((by, value))
-        )
+    @asynccontextmanager
+    async def step(self, name, budget, kind=None):
+        """记录步骤实际耗时，budget 为旧版固定 sleep 的最少耗时；kind 为 trace 中的统一步骤名"""
+        start = time.monotonic()
+        try:
+            with span(kind or name, step=name):
+                yield
+        finally:
+            self.timings.append(StepTiming(name, time.monotonic() - start, budget))
     
-    def wait_for_element_present(self, by, value, timeout=10):
-        return WebDriverWait(self.driver, timeout).until(
-            EC.presence_of_element_located((by, value))
-        )
+    def log_timings(self):
+        if not self.timings:
+            return
+        saved = sum(t.budget - t.elapsed for t in self.timings)
+        parts = [f"{t.name} {t.elapsed:.1f}s/{t.budget:.0f}s" for t in self.timings]
+        logger.info(f"⏱ 步骤耗时(实际/原固定等待): {', '.join(parts)} | 节省约 {saved:.1f}s")
+
+    async def wait_first(self, conditions, timeout):
+        """并发等待多个条件，返回最先满足的条件名；全部超时或失败返回 None"""
+        tasks = {asyncio.ensure_future(cond): name for name, cond in conditions.items()}
+        pending = set(tasks)
+        deadline = time.monotonic() + timeout
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        return tasks[task]
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def wait_for_element_clickable(self, selector, timeout=10):
+        locator = self.page.locator(selector).first
+        await locator.wait_for(state="visible", timeout=timeout * 1000)
+        return locator
+
+    async def wait_for_element_present(self, selector, timeout=10):
+        locator = self.page.locator(selector).first
+        await locator.wait_for(state="attached", timeout=timeout * 1000)
+        return locator
+
+    async def wait_for_any_visible(self, selectors, timeout=10):
+        """等待任一选择器可见，按列表顺序返回第一个可见元素"""
+        union = None
+        for sel in selectors:
+            loc = self.page.locator(sel)
+            union = loc if union is None else union.or_(loc)
+        try:
+            await union.first.wait_for(state="visible", timeout=timeout * 1000)
+        except PlaywrightTimeoutError:
+            return None
+        for sel in selectors:
+            loc = self.page.locator(sel).first
+            if await loc.is_visible():
+                return loc
+        return None
+
+    async def load_server_page(self):
+        """打开服务器页面，过期信息渲染出来即返回"""
+        await self.page.goto(self.server_url, wait_until="domcontentloaded")
+        try:
+            await self.page.wait_for_function(
+                "() => /Your server expires in\\s*\\d+D/.test(document.body.innerText)",
+                timeout=self.WAIT_TIMEOUT * 1000
+            )
+        except PlaywrightTimeoutError:
+            logger.warning("⚠️ 等待过期信息超时")
 
     def extract_expiry_days(self, page_source):
         match = re.search(r"Your server expires in\s*(\d+)D\s*(\d+)H\s*(\d+)M", page_source)
@@ -119,7 +284,7 @@ class PellaAutoRenew:
             
         return "无法提取", -1.0
 
-    def find_and_click_button(self):
+    async def find_and_click_button(self):
         selectors = [
             "button.cl-formButtonPrimary",
             "button[data-localization-key='formButtonPrimary']",
@@ -129,46 +294,26 @@ class PellaAutoRenew:
             "form button"
         ]
         
-        for selector in selectors:
-            try:
-                if selector.startswith("//"):
-                    btn = WebDriverWait(self.driver, 3).until(
-                        EC.element_to_be_clickable((By.XPATH, selector))
-                    )
-                else:
-                    btn = WebDriverWait(self.driver, 3).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
-                    )
+        btn = await self.wait_for_any_visible(selectors, self.WAIT_TIMEOUT)
+        if not btn:
+            return False
+        try:
+            await btn.scroll_into_view_if_needed()
+            await btn.evaluate("el => el.click()")
+            return True
+        except PlaywrightError:
+            return False
                 
-                self.driver.execute_script("arguments[0].scrollIntoView(true);", btn)
-                time.sleep(0.3)
-                self.driver.execute_script("arguments[0].click();", btn)
-                return True
-            except:
-                continue
-        return False
-
-    def wait_for_password_field(self, timeout=15):
+    async def wait_for_password_field(self, timeout=15):
         selectors = [
             "input[type='password']",
             "input[name='password']",
             "input.cl-formFieldInput[type='password']",
             "#password",
         ]
+        return await self.wait_for_any_visible(selectors, timeout)
         
-        start = time.time()
-        while time.time() - start < timeout:
-            for sel in selectors:
-                try:
-                    elem = self.driver.find_element(By.CSS_SELECTOR, sel)
-                    if elem.is_displayed():
-                        return elem
-                except:
-                    pass
-            time.sleep(0.5)
-        return None
-
-    def check_for_error(self):
+    async def check_for_error(self):
         selectors = [
             ".cl-formFieldErrorText",
             "[data-localization-key*='error']",
@@ -176,94 +321,80 @@ class PellaAutoRenew:
         ]
         for sel in selectors:
             try:
-                err = self.driver.find_element(By.CSS_SELECTOR, sel)
-                if err.is_displayed():
-                    return err.text
+                err = self.page.locator(sel).first
+                if await err.is_visible():
+                    return await err.inner_text()
             except:
                 pass
         return None
 
-    def login(self):
+    async def login(self):
         logger.info("开始登录")
-        self.driver.get(self.LOGIN_URL)
-        time.sleep(4)
+        await self.page.goto(self.LOGIN_URL, wait_until="domcontentloaded")
         
-        def js_set_value(element, value):
-            element.clear()
-            element.click()
-            time.sleep(0.2)
-            element.send_keys(value)
-            time.sleep(0.2)
-            self.driver.execute_script("""
-                arguments[0].value = arguments[1];
-                arguments[0].dispatchEvent(new Event('input', { bubbles: true }));
-                arguments[0].dispatchEvent(new Event('change', { bubbles: true }));
-            """, element, value)
+        async def js_set_value(element, value):
+            await element.click()
+            await element.fill(value)
+            await element.evaluate("""
+                (el, value) => {
+                    el.value = value;
+                    el.dispatchEvent(new Event('input', { bubbles: true }));
+                    el.dispatchEvent(new Event('change', { bubbles: true }));
+                }
+            """, value)
         
         try:
-            email_input = self.wait_for_element_present(By.CSS_SELECTOR, "input[name='identifier']", 15)
-            js_set_value(email_input, self.email)
-            if email_input.get_attribute('value') != self.email:
-                email_input.clear()
-                email_input.send_keys(self.email)
+            email_input = await self.wait_for_element_clickable("input[name='identifier']", 15)
+            await js_set_value(email_input, self.email)
+            if await email_input.input_value() != self.email:
+                await email_input.fill(self.email)
             logger.info("✅ 邮箱输入完成")
         except Exception as e:
             raise Exception(f"❌ 输入邮箱失败: {e}")
             
         try:
-            time.sleep(1)
-            if not self.find_and_click_button():
+            if not await self.find_and_click_button():
                 raise Exception("❌ 无法点击Continue按钮")
             
-            password_input = self.wait_for_password_field(timeout=15)
+            password_input = await self.wait_for_password_field(timeout=15)
             if not password_input:
-                error = self.check_for_error()
+                error = await self.check_for_error()
                 if error:
                     raise Exception(f"❌ 登录错误: {error}")
                 raise Exception("❌ 密码框未出现")
             
             logger.info("✅ 进入密码步骤")
-            time.sleep(1)
         except Exception as e:
             raise Exception(f"❌ 第一步失败: {e}")
 
         try:
-            password_input = self.wait_for_element_present(By.CSS_SELECTOR, "input[type='password']", 10)
-            js_set_value(password_input, self.password)
+            await js_set_value(password_input, self.password)
             logger.info("✅ 密码输入完成")
         except Exception as e:
             raise Exception(f"❌ 输入密码失败: {e}")
 
         try:
-            time.sleep(2)
-            if not self.find_and_click_button():
+            if not await self.find_and_click_button():
                 raise Exception("❌ 无法点击登录按钮")
         except Exception as e:
             raise Exception(f"❌ 点击登录失败: {e}")
 
         try:
-            for _ in range(self.WAIT_TIME_AFTER_LOGIN // 2):
-                time.sleep(2)
-                url = self.driver.current_url
+            outcome = await self.wait_first({
+                "home": self.page.wait_for_url(lambda u: '/home' in u or '/dashboard' in u),
+                "left_login": self.page.wait_for_url(lambda u: '/login' not in u and '/sign-in' not in u),
+                "error": self.page.locator(".cl-formFieldErrorText").first.wait_for(state="visible"),
+            }, self.WAIT_TIME_AFTER_LOGIN)
                 
-                if '/home' in url or '/dashboard' in url:
-                    logger.info("✅ 登录成功")
-                    return True
+            if outcome == "home":
+                logger.info("✅ 登录成功")
+                return True
                 
-                error = self.check_for_error()
-                if error:
-                    raise Exception(f"❌ 登录失败: {error}")
+            if outcome == "error":
+                raise Exception(f"❌ 登录失败: {await self.check_for_error()}")
                 
-                if '/login' not in url and '/sign-in' not in url:
-                    self.driver.get(self.HOME_URL)
-                    time.sleep(2)
-                    if '/home' in self.driver.current_url:
-                        logger.info("✅ 登录成功")
-                        return True
-            
-            self.driver.get(self.HOME_URL)
-            time.sleep(3)
-            if '/home' in self.driver.current_url:
+            await self.page.goto(self.HOME_URL, wait_until="domcontentloaded")
+            if '/home' in self.page.url:
                 logger.info("✅ 登录成功")
                 return True
             
@@ -271,67 +402,89 @@ class PellaAutoRenew:
         except Exception as e:
             raise Exception(f"❌ 登录验证失败: {e}")
 
-    def get_server_url(self):
-        if '/home' not in self.driver.current_url:
-            self.driver.get(self.HOME_URL)
-            time.sleep(3)
+    async def restore_session(self):
+        """用已保存的会话直接打开首页，仍处于登录状态则跳过登录流程"""
+        await self.page.goto(self.HOME_URL, wait_until="domcontentloaded")
+        outcome = await self.wait_first({
+            "home": self.page.locator("a[href*='/server/']").first.wait_for(state="visible"),
+            "login": self.page.wait_for_url(lambda u: '/login' in u or '/sign-in' in u),
+        }, self.WAIT_TIMEOUT)
+        if outcome == "home":
+            logger.info("✅ 已复用保存的会话")
+            return True
+        logger.info("ℹ️ 保存的会话已失效，重新登录")
+        self.session_store.discard(self.email)
+        await self.context.clear_cookies()
+        return False
+
+    async def save_session(self):
+        if self.session_store:
+            self.session_store.save(self.email, self.password, await self.context.storage_state())
+
+    async def get_server_url(self):
+        if '/home' not in self.page.url:
+            await self.page.goto(self.HOME_URL, wait_until="domcontentloaded")
             
         try:
-            link = self.wait_for_element_clickable(By.CSS_SELECTOR, "a[href*='/server/']", 15)
-            link.click()
-            WebDriverWait(self.driver, 10).until(EC.url_contains("/server/"))
-            self.server_url = self.driver.current_url
+            link = await self.wait_for_element_clickable("a[href*='/server/']", 15)
+            await link.click()
+            await self.page.wait_for_url("**/server/**", timeout=10000)
+            self.server_url = self.page.url
             logger.info(f"✅ 服务器: {mask_url(self.server_url)}")
             return True
         except Exception as e:
             raise Exception(f"❌ 获取服务器失败: {e}")
     
-    def renew_server(self):
+    async def renew_server(self):
         if not self.server_url:
             raise Exception("❌ 缺少服务器URL")
             
-        self.driver.get(self.server_url)
-        time.sleep(5)
+        async with self.step("load_server", self.LEGACY_SLEEP_BUDGET["load_server"], NAVIGATE):
+            await self.load_server_page()
 
-        self.initial_expiry_details, self.initial_expiry_value = self.extract_expiry_days(self.driver.page_source)
+        self.initial_expiry_details, self.initial_expiry_value = self.extract_expiry_days(await self.page.content())
         logger.info(f"📅 当前过期: {self.initial_expiry_details}")
+        self.expiry_value = self.initial_expiry_value
 
         if self.initial_expiry_value == -1.0:
             raise Exception("❌ 无法提取过期时间")
 
+        if not self.renew_due:
+            return "⏭ 未到续期时间"
+
         try:
             selector = "a[href*='/renew/']:not(.opacity-50):not(.pointer-events-none)"
             count = 0
-            original = self.driver.current_window_handle
             
             while True:
-                buttons = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                if not buttons:
+                buttons = self.page.locator(selector)
+                if await buttons.count() == 0:
                     break
 
-                url = buttons[0].get_attribute('href')
+                url = await buttons.first.get_attribute('href')
                 logger.info(f"续期 #{count + 1}")
                 
-                self.driver.execute_script("window.open(arguments[0]);", url)
-                time.sleep(1)
-                self.driver.switch_to.window(self.driver.window_handles[-1])
-                time.sleep(self.RENEW_WAIT_TIME)
-                self.driver.close()
-                self.driver.switch_to.window(original)
-                count += 1
+                async with self.step(f"renew#{count + 1}", self.LEGACY_SLEEP_BUDGET["renew_click"], RENEW):
+                    renew_page = await self.context.new_page()
+                    try:
+                        await renew_page.goto(urljoin(self.page.url, url), wait_until="domcontentloaded")
+                        try:
+                            await renew_page.wait_for_load_state("networkidle", timeout=self.RENEW_WAIT_TIME * 1000)
+                        except PlaywrightTimeoutError:
+                            pass
+                    finally:
+                        await renew_page.close()
+                    count += 1
                 
-                self.driver.get(self.server_url)
-                time.sleep(3)
+                    await self.load_server_page()
 
             if count == 0:
-                disabled = self.driver.find_elements(By.CSS_SELECTOR, "a[href*='/renew/'].opacity-50")
+                disabled = await self.page.locator("a[href*='/renew/'].opacity-50").count()
                 return "📅 今日已续期" if disabled else "❌ 未找到续期按钮"
 
-            self.driver.get(self.server_url)
-            time.sleep(5)
-            
-            final, final_val = self.extract_expiry_days(self.driver.page_source)
+            final, final_val = self.extract_expiry_days(await self.page.content())
             logger.info(f"📅 续期后: {final}")
+            self.expiry_value = max(self.expiry_value, final_val)
             
             if final_val > self.initial_expiry_value:
                 return f"✅ 续期成功 {self.initial_expiry_details} -> {final}"
@@ -340,7 +493,7 @@ class PellaAutoRenew:
         except Exception as e:
             raise Exception(f"❌ 续期错误: {e}")
 
-    def restart_server(self):
+    async def restart_server(self):
         """点击重启按钮并等待输出"""
         if not self.server_url:
             logger.warning("⚠️ 缺少服务器URL，跳过重启")
@@ -348,47 +501,30 @@ class PellaAutoRenew:
         
         logger.info("🔄 开始重启服务器...")
         
-        if '/server/' not in self.driver.current_url:
-            self.driver.get(self.server_url)
-            time.sleep(3)
+        if '/server/' not in self.page.url:
+            await self.load_server_page()
         
         try:
-            restart_btn = None
-            selectors = [
+            restart_btn = await self.wait_for_any_visible([
                 "//button[contains(text(), 'RESTART')]",
                 "//button[.//text()[contains(., 'RESTART')]]",
-            ]
-            
-            for sel in selectors:
-                try:
-                    restart_btn = WebDriverWait(self.driver, 5).until(
-                        EC.element_to_be_clickable((By.XPATH, sel))
-                    )
-                    if restart_btn:
-                        break
-                except:
-                    continue
+            ], 5)
             
             if not restart_btn:
-                buttons = self.driver.find_elements(By.TAG_NAME, "button")
-                for btn in buttons:
-                    try:
-                        if 'RESTART' in btn.text.upper():
-                            restart_btn = btn
-                            break
-                    except:
-                        continue
+                buttons = self.page.locator("button", has_text="RESTART")
+                if await buttons.count() > 0:
+                    restart_btn = buttons.first
             
             if not restart_btn:
                 logger.warning("⚠️ 未找到 RESTART 按钮")
                 return False, ""
             
-            self.driver.execute_script("arguments[0].scrollIntoView(true);", restart_btn)
-            time.sleep(0.5)
-            self.driver.execute_script("arguments[0].click();", restart_btn)
+            await self._install_restart_collector()
+            await restart_btn.scroll_into_view_if_needed()
+            await restart_btn.evaluate("el => el.click()")
             logger.info("✅ 已点击 RESTART 按钮")
             
-            output = self._wait_for_restart_output()
+            output = await self._wait_for_restart_output()
             self.restart_output = output
             
             if output:
@@ -402,89 +538,78 @@ class PellaAutoRenew:
             logger.error(f"❌ 重启失败: {e}")
             return False, ""
 
-    def _wait_for_restart_output(self):
-        """等待重启输出完成并返回输出内容"""
+    async def _install_restart_collector(self):
+        """注入页面内输出收集器：MutationObserver 增量收集新行并标记完成"""
+        self._restart_cursor = 0
+        await self.page.evaluate(RESTART_COLLECTOR_JS, [self.RESTART_COMPLETION_MARKERS, self.RESTART_QUIET_MS])
+
+    async def _fetch_restart_delta(self):
+        """一次调用取回收集器中尚未读取的新行"""
+        delta = await self.page.evaluate(
+            "(from) => { const c = window.__pellaRestart; return c ? { lines: c.lines.slice(from), done: c.done } : { lines: [], done: false }; }",
+            self._restart_cursor
+        )
+        self._restart_cursor += len(delta["lines"])
+        return delta["lines"], delta["done"]
+
+    async def _wait_for_restart_output(self):
+        """等待收集器发出完成信号（且输出静默 RESTART_QUIET_MS）后返回输出内容"""
         logger.info("⏳ 等待重启输出...")
         
-        start_time = time.time()
-        last_output = ""
-        stable_count = 0
+        lines = []
+        deadline = time.monotonic() + self.RESTART_WAIT_TIME
         
-        while time.time() - start_time < self.RESTART_WAIT_TIME:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning("⚠️ 等待重启输出超时")
+                break
             try:
-                pre_elements = self.driver.find_elements(By.CSS_SELECTOR, "pre.bg-black, pre[class*='bg-black']")
-                
-                if not pre_elements:
-                    pre_elements = self.driver.find_elements(By.TAG_NAME, "pre")
-                
-                current_output = ""
-                for pre in pre_elements:
-                    try:
-                        divs = pre.find_elements(By.TAG_NAME, "div")
-                        for div in divs:
-                            text = div.text.strip()
-                            if text and text != "Copy":
-                                current_output += text + "\n"
-                        
-                        if not current_output:
-                            current_output = pre.text
-                    except:
-                        continue
-                
-                if current_output:
-                    completion_markers = [
-                        "App is running",
-                        "Thank you for using this script",
-                        "enjoy!"
-                    ]
-                    
-                    is_complete = any(marker in current_output for marker in completion_markers)
-                    
-                    if current_output == last_output:
-                        stable_count += 1
-                    else:
-                        stable_count = 0
-                        last_output = current_output
-                    
-                    if is_complete and stable_count >= 2:
-                        return self._clean_output(current_output)
+                await self.page.wait_for_function(
+                    "(quiet) => { const c = window.__pellaRestart; return c && c.done && Date.now() - c.lastChange >= quiet; }",
+                    arg=self.RESTART_QUIET_MS,
+                    polling=500,
+                    timeout=min(remaining, 10) * 1000
+                )
+                done = True
+            except PlaywrightTimeoutError:
+                done = False
+            except PlaywrightError as e:
+                logger.debug(f"获取输出时出错: {e}")
+                break
                 
-                time.sleep(2)
+            new_lines, _ = await self._fetch_restart_delta()
+            lines.extend(new_lines)
+            if done:
+                break
+            logger.info(f"⏳ 已收到 {len(lines)} 行输出...")
                 
-            except Exception as e:
-                logger.debug(f"获取输出时出错: {e}")
-                time.sleep(2)
-        
-        if last_output:
-            return self._clean_output(last_output)
-        return ""
+        return self._clean_output("\n".join(lines))
 
     def _clean_output(self, output):
-        """清理输出内容"""
-        if not output:
-            return ""
-        
-        lines = output.split('\n')
-        cleaned_lines = []
+        """清理输出内容（转义序列、回车覆盖、进度条与重复行）"""
+        return sanitize(output, drop_blank=True, drop_lines=("Copy",))
         
-        for line in lines:
-            line = line.strip()
-            if not line or line == "Copy":
-                continue
-            line = re.sub(r'\[\d+;\d+H|\[\d+J|\[0J', '', line)
-            cleaned_lines.append(line)
-        
-        return '\n'.join(cleaned_lines)
-            
-    def run(self):
+    async def run(self):
         try:
             logger.info(f"处理账号: {mask_email(self.email)}")
-            
-            if self.login() and self.get_server_url():
-                result = self.renew_server()
+            state = self.session_store.load(self.email, self.password) if self.session_store else None
+            await self.setup_context(state)
+            
+            async with self.step("login", self.LEGACY_SLEEP_BUDGET["login"], LOGIN):
+                logged_in = bool(state) and await self.restore_session()
+                if not logged_in:
+                    logged_in = await self.login()
+            if logged_in:
+                await self.save_session()
+                async with self.step("get_server_url", self.LEGACY_SLEEP_BUDGET["get_server_url"], NAVIGATE):
+                    got_server = await self.get_server_url()
+            if logged_in and got_server:
+                result = await self.renew_server()
                 logger.info(f"续期结果: {result}")
                 
-                restart_success, restart_output = self.restart_server()
+                async with self.step("restart_server", self.LEGACY_SLEEP_BUDGET["restart_server"]):
+                    restart_success, restart_output = await self.restart_server()
                 
                 return True, result, restart_output
                 
@@ -494,8 +619,8 @@ class PellaAutoRenew:
             logger.error(f"❌ 失败: {e}")
             return False, f"❌ 失败: {e}", ""
         finally:
-            if self.driver:
-                self.driver.quit()
+            self.log_timings()
+            await self._contexts.aclose()
 
 
 class MultiAccountManager:
@@ -503,6 +628,13 @@ class MultiAccountManager:
         self.tg_token = os.getenv('TG_BOT_TOKEN', '')
         self.tg_chat = os.getenv('TG_CHAT_ID', '')
         self.accounts = self.load_accounts()
+        self.concurrency = max(1, int(os.getenv('PELLA_CONCURRENCY', DEFAULT_CONCURRENCY)))
+        self.session_store = SessionStore(
+            os.getenv('PELLA_STATE_DIR', DEFAULT_STATE_DIR).strip(),
+            os.getenv('PELLA_STATE_KEY', '').strip() or None
+        )
+        if not self.session_store.enabled:
+            logger.info("ℹ️ 未安装 pynacl 或未设置 PELLA_STATE_DIR，不保存会话")
     
     def load_accounts(self):
         accounts = []
@@ -535,7 +667,8 @@ class MultiAccountManager:
         
         for email, success, result, restart_output in results:
             try:
-                self._send_single_notification(email, success, result, restart_output)
+                with span(NOTIFY, account=mask_email(email)):
+                    self._send_single_notification(email, success, result, restart_output)
                 time.sleep(0.5)
             except Exception as e:
                 logger.error(f"❌ 发送 {mask_email(email)} 通知失败: {e}")
@@ -548,6 +681,8 @@ class MultiAccountManager:
                 status = "✅"
             elif "已续期" in result:
                 status = "📅"
+            elif "未到续期时间" in result:
+                status = "⏭"
             else:
                 status = "❌"
             
@@ -633,23 +768,56 @@ class MultiAccountManager:
         except Exception as e:
             logger.error(f"❌ 发送日志文件失败: {e}")
     
-    def run_all(self):
-        results = []
-        total = len(self.accounts)
+    async def _run_account(self, pool, semaphore, index, acc):
+        with span(ACCOUNT, account=mask_email(acc['email'])) as step:
+            email, success, result, restart_output = await self._renew_account(pool, semaphore, index, acc)
+            step.set("outcome", result)
+            if not success:
+                step.fail(result)
+            return email, success, result, restart_output
         
-        for i, acc in enumerate(self.accounts, 1):
-            logger.info(f"[{i}/{total}] {mask_email(acc['email'])}")
-            
+    async def _renew_account(self, pool, semaphore, index, acc):
+        async with semaphore:
+            logger.info(f"[{index}/{len(self.accounts)}] {mask_email(acc['email'])}")
             try:
-                renew = PellaAutoRenew(acc['email'], acc['password'])
-                success, result, restart_output = renew.run()
-                if i < total:
-                    time.sleep(5)
+                renew = PellaAutoRenew(acc['email'], acc['password'], pool, self.session_store,
+                                       renew_due=SCHEDULE.is_due("pella", account_key(acc['email'])))
+                success, result, restart_output = await renew.run()
+                self.record_schedule(acc['email'], result, renew.expiry_value)
             except Exception as e:
                 success, result, restart_output = False, f"❌ 异常: {e}", ""
-            
-            results.append((acc['email'], success, result, restart_output))
+                self.record_schedule(acc['email'], result)
+            return acc['email'], success, result, restart_output
+            
+    def record_schedule(self, email, result, expiry_days=-1.0):
+        """页面上只有剩余天数，换算成到期时间记录"""
+        key = account_key(email)
+        fields = {"alert_days": ALERT_DAYS}
+        if expiry_days >= 0:
+            expiry = time.time() + expiry_days * 86400
+            fields.update(expiry=expiry, expiry_text=datetime.fromtimestamp(expiry).strftime("%Y-%m-%d %H:%M"))
+        if "成功" in result:
+            SCHEDULE.renewed("pella", key, COOLDOWN_HOURS, **fields)
+        elif "已续期" in result:
+            SCHEDULE.cooling("pella", key, COOLDOWN_HOURS, **fields)
+        elif "未到续期时间" in result:
+            SCHEDULE.update("pella", key, **fields)
+        else:
+            SCHEDULE.update("pella", key, outcome="error", **fields)
         
+    async def run_all(self):
+        SCHEDULE.retain("pella", [account_key(acc['email']) for acc in self.accounts])
+        headless = bool(os.getenv('GITHUB_ACTIONS'))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with browser_pool(size=0, headless=headless) as pool:
+            results = await asyncio.gather(*(
+                self._run_account(pool, semaphore, i, acc)
+                for i, acc in enumerate(self.accounts, 1)
+            ))
+
+        results = list(results)
+        SCHEDULE.save()
         self.send_notification(results)
         return all(s for _, s, _, _ in results), results
 
@@ -657,7 +825,8 @@ class MultiAccountManager:
 def main():
     try:
         manager = MultiAccountManager()
-        manager.run_all()
+        with trace_run("pella"):
+            asyncio.run(manager.run_all())
     except Exception as e:
         logger.error(f"❌ 错误: {e}")
         exit(1)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合并续期运行器：一个进程、一个浏览器，按声明式配置并发运行各续期脚本
+
+配置（RENEW_ALL_CONFIG：JSON 字符串或 JSON 文件路径，默认 renew_all.json）：
+  {
+    "concurrency": 3,                      # 全局同时运行的任务数
+    "providers": [
+      {"provider": "weirdhost", "env": {"REMEMBER_WEB_COOKIE": "$WEIRDHOST_COOKIES"}},
+      {"provider": "pella", "name": "pella-b", "env": {"PELLA_ACCOUNTS": "$PELLA_ACCOUNTS_B"},
+       "rate_limit": {"concurrency": 1, "min_interval": 30}},
+      {"provider": "katabump", "enabled": false}
+    ]
+  }
+
+  - provider: castle-host / data-online / katabump / pella / weirdhost
+  - env: 该任务专用的环境变量，值中的 $VAR / ${VAR} 从当前环境展开；
+         脚本本身以及导入时创建的 SCHEDULE / SCREENSHOTS 读到的是各自任务的环境，互不影响。
+         浏览器池、资源拦截、资源缓存、trace 和运行历史整个进程只有一份，
+         对应的变量（SHARED_ENV_PREFIXES）只能在外层环境设置，写在任务 env 里会报错
+  - rate_limit: 同一 provider 的所有任务共享，concurrency 为同时运行数（默认 1），
+                min_interval 为相邻两次启动的最小间隔秒数（默认 0）
+  - 未找到配置时，每个 provider 各运行一次，使用当前环境
+
+结果汇总打印，并写入 RENEW_ALL_RESULT（默认 renew-all-result.json）；有任务失败时退出码为 1。
+各任务的步骤耗时合并写入同一个 trace 文件（见 renew_trace.py）。
+"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+from browser_pool import BrowserPool, set_shared_pool
+from renew_trace import JOB, span, trace_run
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG_FILE = "renew_all.json"
+DEFAULT_RESULT_FILE = "renew-all-result.json"
+DEFAULT_CONCURRENCY = 3
+# 进程级共享组件读取的变量前缀：browser_pool / resource_blocker / asset_cache / renew_trace / run_metrics
+SHARED_ENV_PREFIXES = ("BROWSER_POOL_", "RESOURCE_BLOCK", "RESOURCE_ALLOW_", "ASSET_CACHE_", "RENEW_TRACE_", "RUN_METRICS_")
+
+
+async def run_castle_host(module):
+    if not module.Config.from_env().cookies_list:
+        return "skipped", "CASTLE_COOKIES 未设置"
+    await module.main()
+
+
+async def run_data_online(module):
+    if not module.load_targets():
+        return "skipped", "未配置主机"
+    await module.main()
+
+
+async def run_katabump(module):
+    accounts = module.parse_accounts()
+    if not accounts:
+        return "skipped", "未配置账号"
+    await module.run(accounts)
+
+
+async def run_pella(module):
+    try:
+        manager = module.MultiAccountManager()
+    except ValueError as e:
+        return "skipped", str(e)
+    ok, results = await manager.run_all()
+    detail = f"{sum(1 for _, success, _, _ in results if success)}/{len(results)} 个账号成功"
+    return ("success" if ok else "failed"), detail
+
+
+async def run_weirdhost(module):
+    if not module.parse_list_env("REMEMBER_WEB_COOKIE"):
+        return "skipped", "REMEMBER_WEB_COOKIE 未设置"
+    await module.add_server_time()
+
+
+# provider -> (脚本文件, 入口)；入口返回 None 视为成功，或返回 (状态, 说明)
+PROVIDERS = {
+    "castle-host": ("castle-host_renew.py", run_castle_host),
+    "data-online": ("data-online_renew.py", run_data_online),
+    "katabump": ("katabump_renew.py", run_katabump),
+    "pella": ("pella_renew.py", run_pella),
+    "weirdhost": ("weirdhost_renew.py", run_weirdhost),
+}
+
+
+@dataclass
+class JobResult:
+    name: str
+    provider: str
+    status: str  # success / failed / skipped
+    seconds: float
+    detail: str = ""
+
+
+class ScopedOS(types.ModuleType):
+    """替换脚本模块里的 os：environ / getenv 读任务自己的环境，其余属性转发到真正的 os"""
+
+    def __init__(self, environ: Dict[str, str]):
+        super().__init__("os")
+        self.environ = environ
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def getenv(self, key, default=None):
+        return self.environ.get(key, default)
+
+
+class ProviderLimiter:
+    """同一 provider 的并发数和启动间隔限制"""
+
+    def __init__(self, concurrency: int = 1, min_interval: float = 0):
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.min_interval = min_interval
+        self._lock = asyncio.Lock()
+        self._last_start = None
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self._lock:
+            if self._last_start is not None:
+                wait = self._last_start + self.min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self._last_start = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+def expand_env(env: dict) -> Dict[str, str]:
+    return {str(k): os.path.expandvars(str(v)) for k, v in (env or {}).items()}
+
+
+def load_config() -> dict:
+    raw = os.environ.get("RENEW_ALL_CONFIG", "").strip()
+    if not raw and os.path.exists(DEFAULT_CONFIG_FILE):
+        raw = DEFAULT_CONFIG_FILE
+    if not raw:
+        return {"providers": [{"provider": name} for name in PROVIDERS]}
+    if not raw.startswith("{"):
+        with open(raw, encoding="utf-8") as f:
+            raw = f.read()
+    return json.loads(raw)
+
+
+def load_provider(script: str, name: str, env: Dict[str, str]):
+    """
+    每个任务加载一份独立的模块实例：导入期间临时套用任务环境（脚本在模块级读取的常量因此生效），
+    导入后把模块的 os 换成 ScopedOS，运行期间读取的环境变量也互不干扰
+    """
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    environ = {**os.environ, **env}
+    spec = importlib.util.spec_from_file_location(f"renew_job_{name.replace('-', '_')}", os.path.join(SCRIPTS_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+
+    saved = dict(os.environ)
+    os.environ.update(env)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    module.os = ScopedOS(environ)
+    return module
+
+
+async def run_job(job: dict, limiter: ProviderLimiter, semaphore: asyncio.Semaphore) -> JobResult:
+    provider, name = job["provider"], job["name"]
+    script, entry = PROVIDERS[provider]
+
+    async with limiter, semaphore:
+        print(f"▶️ [{name}] 开始")
+        start = time.monotonic()
+        with span(JOB, provider=provider, job=name) as step:
+            try:
+                module = load_provider(script, name, expand_env(job.get("env")))
+                outcome = await entry(module)
+                status, detail = outcome if outcome else ("success", "")
+            except SystemExit as e:
+                status, detail = ("success", "") if not e.code else ("failed", f"退出码 {e.code}")
+            except Exception as e:
+                status, detail = "failed", f"{type(e).__name__}: {e}"
+            step.set("status", status)
+            if status == "failed":
+                step.fail(detail)
+        result = JobResult(name, provider, status, round(time.monotonic() - start, 1), detail)
+        print(f"⏹ [{name}] {status} ({result.seconds}s) {detail}")
+        return result
+
+
+def build_jobs(config: dict) -> List[dict]:
+    jobs, seen = [], set()
+    for entry in config.get("providers", []):
+        provider = entry.get("provider")
+        if provider not in PROVIDERS:
+            print(f"⚠️ 未知 provider: {provider}，已跳过")
+            continue
+        if entry.get("enabled", True) is False:
+            continue
+        name = entry.get("name") or provider
+        while name in seen:
+            name += "+"
+        seen.add(name)
+        shared = sorted(k for k in (entry.get("env") or {}) if str(k).startswith(SHARED_ENV_PREFIXES))
+        if shared:
+            raise ValueError(f"任务 {name} 的 env 不能覆盖进程级共享设置: {', '.join(shared)}")
+        jobs.append({**entry, "name": name})
+    return jobs
+
+
+def build_limiters(jobs: List[dict]) -> Dict[str, ProviderLimiter]:
+    limiters = {}
+    for job in jobs:
+        if job["provider"] not in limiters:
+            limit = job.get("rate_limit") or {}
+            limiters[job["provider"]] = ProviderLimiter(int(limit.get("concurrency", 1)),
+                                                        float(limit.get("min_interval", 0)))
+    return limiters
+
+
+async def run_all(config: dict) -> List[JobResult]:
+    jobs = build_jobs(config)
+    if not jobs:
+        print("❌ 没有启用的任务")
+        return []
+    limiters = build_limiters(jobs)
+    concurrency = int(config.get("concurrency") or os.environ.get("RENEW_ALL_CONCURRENCY") or DEFAULT_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    print(f"🚀 {len(jobs)} 个任务，全局并发 {concurrency}")
+
+    with trace_run("renew-all"):
+        pool = BrowserPool()
+        await pool.start()
+        set_shared_pool(pool)
+        try:
+            return list(await asyncio.gather(*(run_job(job, limiters[job["provider"]], semaphore) for job in jobs)))
+        finally:
+            set_shared_pool(None)
+            await pool.close()
+
+
+def print_summary(results: List[JobResult]):
+    icons = {"success": "✅", "failed": "❌", "skipped": "⏭"}
+    print("=" * 50)
+    print("📊 汇总")
+    for r in results:
+        print(f"  {icons.get(r.status, '•')} {r.name:<16} {r.seconds:>7.1f}s  {r.detail}")
+    print("=" * 50)
+
+
+def main():
+    results = asyncio.run(run_all(load_config()))
+    print_summary(results)
+
+    path = os.environ.get("RENEW_ALL_RESULT", DEFAULT_RESULT_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([asdict(r) for r in results], f, ensure_ascii=False, indent=2)
+
+    if not results or any(r.status == "failed" for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
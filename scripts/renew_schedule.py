@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+续期调度状态（Castle-Host / KataBump / Pella / Weirdhost 共用）
+
+每台服务器（或账号）记录一条：
+  - expiry       到期时间（各脚本从页面读到的 get_expiry / get_expiry_from_text / get_expiry_time / extract_expiry_days）
+  - renew_after  冷却结束时间：续期成功或"今日已续期"后，在此之前再运行也续不了
+  - alert_days   到期前多少天无论是否冷却都要运行（发到期提醒）
+  - outcome      最近一次结果；出错时 renew_after 清零，下次运行必定处理
+
+需要运行的时间 = min(renew_after, expiry - alert_days)。
+  - 只做续期的脚本（KataBump）启动时调用 gate()：所有已配置的服务器都没到时间就直接退出；
+    工作流还可以在安装依赖之前单独跑一个检查 job，连 Playwright 都不用装。
+    检查 job 看不到服务器列表，改为比较配置指纹（CONFIG_ENV），配置变化（新增/删除服务器）视为需要运行
+  - 每次运行还要重启/启动服务器的脚本（Castle-Host / Pella）不跳过整次运行，只用 is_due() 跳过单台服务器的续期
+  - 脚本用 retain() 删除已不在配置中的条目；长期没有再检查的条目（已到时间却超过保留天数未更新）保存时自动清理
+
+用法：
+  from renew_schedule import RenewSchedule
+  SCHEDULE = RenewSchedule.from_env()
+  if not SCHEDULE.gate("katabump", server_ids):
+      return
+  SCHEDULE.update("katabump", server_id, expiry_text="2025-01-31", alert_days=2)
+  SCHEDULE.renewed("katabump", server_id, cooldown_hours=24)
+  SCHEDULE.retain("katabump", server_ids)
+  SCHEDULE.save()
+
+命令：
+  python scripts/renew_schedule.py due <provider>   打印是否需要运行，并把 due=true/false 写入 GITHUB_OUTPUT
+  python scripts/renew_schedule.py show             列出各服务器的到期时间和下次需要运行的时间
+
+环境变量：
+  RENEW_SCHEDULE_FILE   状态文件路径，未设置时不启用（脚本每次照常完整运行）
+  FORCE_RENEW           设为 true 时忽略调度，始终运行
+  RENEW_SCHEDULE_KEEP_DAYS  已到时间但一直没有再检查的条目保留天数，默认 7
+  CONFIG_ENV 中列出的变量   计算配置指纹，工作流检查 job 需要传入与续期步骤相同的值
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+SLACK_SECONDS = 600  # 定时任务触发时间有抖动，还差不到 10 分钟视为已到时间
+EXPIRY_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d.%m.%Y")
+
+# 配置指纹用到的环境变量；# 开头的只计条目数（Cookie 会被脚本自动更新，值变化不代表服务器变化）
+CONFIG_ENV = {
+    "katabump": ("KATA_ACCOUNTS", "KATA_EMAIL", "KATA_SERVER_ID"),
+    "weirdhost": ("SERVER_URL", "#REMEMBER_WEB_COOKIE"),
+}
+
+
+def parse_expiry(text: Optional[str]) -> Optional[float]:
+    """把页面上的到期时间文字转成时间戳，无法识别时返回 None"""
+    if not text:
+        return None
+    for fmt in EXPIRY_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def account_key(value: str) -> str:
+    """按账号记录时（服务器地址登录后才知道），状态文件里只保存邮箱的哈希"""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:12]
+
+
+def config_fingerprint(provider: str, environ: Optional[Mapping[str, str]] = None) -> Optional[str]:
+    environ = os.environ if environ is None else environ
+    names = CONFIG_ENV.get(provider)
+    if not names:
+        return None
+    parts = []
+    for name in names:
+        if name.startswith("#"):
+            value = environ.get(name[1:], "")
+            parts.append(str(len([v for v in re.split(r"[,\n]", value) if v.strip()])))
+        else:
+            parts.append(environ.get(name, "").strip())
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def _format_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+
+
+class RenewSchedule:
+
+    def __init__(self, path: Optional[str], force: Optional[bool] = None, environ: Optional[Mapping[str, str]] = None):
+        # 环境在构造时确定：合并运行器里各任务的 FORCE_RENEW / 配置变量互不影响
+        self.environ = dict(os.environ if environ is None else environ)
+        self.path = path
+        self.force = force if force is not None else self.environ.get("FORCE_RENEW", "").lower() == "true"
+        self.servers: Dict[str, dict] = {}
+        self.config: Dict[str, str] = {}
+        self.keep_days = float(self.environ.get("RENEW_SCHEDULE_KEEP_DAYS") or 7)
+        self._touched = set()
+        self._removed = set()
+        self._configs = set()
+        if path:
+            self.servers, self.config = self._read()
+
+    @classmethod
+    def from_env(cls) -> "RenewSchedule":
+        return cls(os.environ.get("RENEW_SCHEDULE_FILE", "").strip() or None)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _read(self) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data.get("servers", {}), data.get("config", {})
+        except (OSError, ValueError):
+            pass
+        return {}, {}
+
+    def _stale(self, entry: dict, now: float) -> bool:
+        """已到时间却超过保留天数没有再检查：服务器多半已删除或改由别处续期"""
+        limit = now - self.keep_days * 86400
+        return self.due_at(entry) < limit and entry.get("checked_at", 0) < limit
+
+    def save(self):
+        """只写回本进程改过的条目，合并运行时各 provider 共用一个文件也不会互相覆盖"""
+        if not self.enabled or not (self._touched or self._removed or self._configs):
+            return
+        servers, config = self._read()
+        for key in self._removed:
+            servers.pop(key, None)
+        for key in self._touched:
+            servers[key] = self.servers[key]
+        for provider in self._configs | {servers[key]["provider"] for key in self._touched}:
+            fingerprint = config_fingerprint(provider, self.environ)
+            if fingerprint:
+                config[provider] = fingerprint
+        now = time.time()
+        servers = {key: entry for key, entry in servers.items() if not self._stale(entry, now)}
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"servers": servers, "config": config}, f, ensure_ascii=False, indent=2, sort_keys=True)
+            self.servers, self.config = servers, config
+            self._touched.clear()
+            self._removed.clear()
+            self._configs.clear()
+        except OSError as e:
+            print(f"⚠️ 调度状态保存失败: {e}")
+
+    # ---- 记录 ----
+
+    def update(self, provider: str, server: str, expiry: Optional[float] = None, expiry_text: Optional[str] = None,
+               renew_after: Optional[float] = None, alert_days: Optional[float] = None, outcome: Optional[str] = None):
+        key = f"{provider}/{server}"
+        entry = self.servers.setdefault(key, {"provider": provider, "server": server})
+        if expiry is None:
+            expiry = parse_expiry(expiry_text)
+        if expiry is not None:
+            entry["expiry"] = expiry
+        if expiry_text:
+            entry["expiry_text"] = expiry_text
+        if renew_after is not None:
+            entry["renew_after"] = renew_after
+        if alert_days is not None:
+            entry["alert_days"] = alert_days
+        if outcome is not None:
+            entry["outcome"] = outcome
+            if outcome == "error":
+                entry["renew_after"] = 0
+        entry["checked_at"] = time.time()
+        self._touched.add(key)
+        return entry
+
+    def renewed(self, provider: str, server: str, cooldown_hours: float, **fields):
+        now = time.time()
+        entry = self.update(provider, server, renew_after=now + cooldown_hours * 3600, outcome="success", **fields)
+        entry["last_success"] = now
+
+    def cooling(self, provider: str, server: str, cooldown_hours: float, until: Optional[float] = None, **fields):
+        """冷却中：知道结束时间就用它，否则按上次成功推算，都没有时一小时后再试"""
+        last = self.servers.get(f"{provider}/{server}", {}).get("last_success")
+        if until is None:
+            until = last + cooldown_hours * 3600 if last else time.time() + 3600
+        self.update(provider, server, renew_after=until, outcome="cooldown", **fields)
+
+    def note_config(self, provider: str):
+        """本次运行读取了完整配置：保存时更新配置指纹，即使没有服务器需要处理"""
+        self._configs.add(provider)
+
+    def retain(self, provider: str, servers: Iterable[str]):
+        """删除该 provider 下已不在配置中的条目"""
+        keep = set(servers)
+        for key, entry in list(self.servers.items()):
+            if entry.get("provider") == provider and entry.get("server") not in keep:
+                del self.servers[key]
+                self._touched.discard(key)
+                self._removed.add(key)
+
+    # ---- 判断 ----
+
+    @staticmethod
+    def due_at(entry: dict) -> float:
+        at = entry.get("renew_after") or 0
+        if entry.get("expiry") and entry.get("alert_days") is not None:
+            at = min(at, entry["expiry"] - entry["alert_days"] * 86400)
+        return at
+
+    def entries(self, provider: str) -> Dict[str, dict]:
+        return {e["server"]: e for e in self.servers.values() if e.get("provider") == provider}
+
+    def due(self, provider: str, servers: Optional[Iterable[str]] = None) -> Tuple[bool, str, Optional[float]]:
+        """
+        返回 (是否需要运行, 原因, 下次需要运行的时间)。
+        servers 为已配置的服务器；不知道时（工作流检查 job）比较配置指纹，并且只看没有过期清理的条目
+        """
+        known = self.entries(provider)
+        if not known:
+            return True, "没有调度记录", None
+        if servers is None:
+            fingerprint = config_fingerprint(provider, self.environ)
+            if fingerprint and self.config.get(provider) != fingerprint:
+                return True, "配置已变化", None
+            now = time.time()
+            known = {s: e for s, e in known.items() if not self._stale(e, now)}
+        else:
+            missing = [s for s in servers if s not in known]
+            if missing:
+                return True, f"{len(missing)} 台服务器没有调度记录", None
+            known = {s: known[s] for s in servers}
+        if not known:
+            return True, "没有需要检查的服务器", None
+
+        now = time.time()
+        server, entry = min(known.items(), key=lambda kv: self.due_at(kv[1]))
+        at = self.due_at(entry)
+        if at <= now + SLACK_SECONDS:
+            reason = "上次出错" if entry.get("outcome") == "error" else "已到续期或提醒时间"
+            return True, f"{server}: {reason}", at
+        return False, f"最早 {server} 于 {_format_time(at)} 需要处理（还有 {(at - now) / 3600:.1f} 小时）", at
+
+    def is_due(self, provider: str, server: str) -> bool:
+        """单台服务器是否需要续期（未启用、FORCE_RENEW 或没有记录时都返回 True）"""
+        if not self.enabled or self.force:
+            return True
+        entry = self.servers.get(f"{provider}/{server}")
+        return entry is None or self.due_at(entry) <= time.time() + SLACK_SECONDS
+
+    def gate(self, provider: str, servers: Optional[Iterable[str]] = None) -> bool:
+        """脚本入口调用：返回 False 表示没有需要处理的服务器，调用方应直接退出"""
+        if not self.enabled:
+            return True
+        if self.force:
+            print("⏰ FORCE_RENEW=true，忽略调度")
+            return True
+        if servers is not None:
+            servers = list(servers)
+            self.note_config(provider)
+        due, reason, _ = self.due(provider, servers)
+        print(f"⏰ {provider}: {'需要运行' if due else '跳过'}，{reason}")
+        return due
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "show"
+    schedule = RenewSchedule(os.environ.get("RENEW_SCHEDULE_FILE", "").strip() or "renew-schedule.json")
+
+    if command == "due" and len(sys.argv) > 2:
+        due = schedule.gate(sys.argv[2])
+        output = os.environ.get("GITHUB_OUTPUT")
+        if output:
+            with open(output, "a", encoding="utf-8") as f:
+                f.write(f"due={'true' if due else 'false'}\n")
+        return
+
+    if command == "show":
+        now = time.time()
+        for key, entry in sorted(schedule.servers.items(), key=lambda kv: RenewSchedule.due_at(kv[1])):
+            at = RenewSchedule.due_at(entry)
+            when = "现在" if at <= now else _format_time(at)
+            print(f"{key:<32} 到期 {entry.get('expiry_text', '未知'):<20} 下次 {when:<16} {entry.get('outcome', '')}")
+        return
+
+    print("用法: renew_schedule.py due <provider> | show")
+    sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
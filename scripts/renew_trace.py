@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+续期流程计时追踪（Castle-Host / Data Online / KataBump / Pella / Weirdhost 共用）
+
+  - span() 记录一个步骤，可嵌套；通过 contextvars 传递父 span，并发的 asyncio 任务互不干扰
+  - 排队异步执行的步骤（通知队列）可在入队时取 current_span()，发送时作为 parent 传回
+  - 子 span 继承父 span 的 provider / account / server 属性，汇总时可按账号区分
+  - trace_run() 包住一次完整运行：结束时写出 OpenTelemetry（OTLP/JSON）格式的 trace 文件，
+    并打印最慢步骤和各步骤耗时汇总
+  - 合并运行器（renew_all.py）外层也有 trace_run()，各脚本的 trace_run() 自动变成它的子 span，
+    整次运行只输出一个文件
+
+步骤名统一使用下面的常量，便于跨 provider 对比：
+  LOGIN 登录 / NAVIGATE 页面导航 / CHALLENGE 等待验证 / RENEW 点击续期 / API 接口响应 / NOTIFY 通知
+  ACCOUNT / SERVER / JOB 为分组用的外层 span
+
+用法：
+  from renew_trace import span, trace_run, NAVIGATE
+  with trace_run("castle-host"):
+      with span(NAVIGATE, account="#1", page="servers") as s:
+          ...
+          s.set("outcome", "ok")
+
+环境变量：
+  RENEW_TRACE_DIR   trace 文件目录，默认 traces；设为 off 只打印汇总不写文件
+  RENEW_TRACE_TOP   汇总中列出的最慢步骤数，默认 8
+  RUN_METRICS_DB    设置后同时把本次运行按账号追加到历史数据库（见 run_metrics.py）
+"""
+
+import contextvars
+import functools
+import json
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+LOGIN = "login"
+NAVIGATE = "navigate"
+CHALLENGE = "challenge"
+RENEW = "renew"
+API = "api"
+NOTIFY = "notify"
+
+# 分组用的外层 span，不计入最慢步骤
+RUN = "run"
+JOB = "job"
+ACCOUNT = "account"
+SERVER = "server"
+GROUPS = (RUN, JOB, ACCOUNT, SERVER)
+INHERITED_ATTRIBUTES = ("provider", "account", "server")
+DEFAULT_TRACE_DIR = "traces"
+
+_current: contextvars.ContextVar = contextvars.ContextVar("renew_trace_span", default=None)
+_finished: Dict[str, List["Span"]] = {}
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = ""
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: dict = field(default_factory=dict)
+    error: str = ""
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def fail(self, message: str):
+        """标记为失败（不抛异常的失败分支用，例如验证超时后返回 False）"""
+        self.error = message or "error"
+
+    @property
+    def seconds(self) -> float:
+        return max(0, self.end_ns - self.start_ns) / 1e9
+
+    @property
+    def label(self) -> str:
+        return " ".join(f"{k}={self.attributes[k]}" for k in INHERITED_ATTRIBUTES if self.attributes.get(k))
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes):
+    """
+    记录一个步骤；没有外层 trace_run() 时照常执行但不记录。
+    parent 用于在后台任务里补记步骤（例如通知队列），默认取当前 span。
+    """
+    parent = parent or _current.get()
+    inherited = {k: parent.attributes[k] for k in INHERITED_ATTRIBUTES if parent and k in parent.attributes}
+    current = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else "",
+        start_ns=time.time_ns(),
+        attributes={**inherited, **{k: v for k, v in attributes.items() if v is not None}},
+    )
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current.reset(token)
+        if parent is not None:
+            _finished.setdefault(current.trace_id, []).append(current)
+
+
+def traced(name: str, **attributes):
+    """协程函数装饰器：整个调用记为一个 span"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace_run(provider: str, **attributes):
+    """一次完整运行；最外层的 trace_run() 结束时导出文件并打印汇总"""
+    outermost = _current.get() is None
+    root = None
+    try:
+        with span(RUN, provider=provider, **attributes) as root:
+            yield root
+    finally:
+        if outermost and root is not None:
+            spans = [root] + _finished.pop(root.trace_id, [])
+            export(spans, provider)
+            print_summary(spans)
+            # 延迟导入：run_metrics 依赖本模块的常量
+            from run_metrics import record
+            record(spans)
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def to_otlp(spans: List[Span], service: str) -> dict:
+    """按 OTLP/JSON（ExportTraceServiceRequest）结构输出，可直接导入 Jaeger / Tempo 等"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", service)]},
+            "scopeSpans": [{
+                "scope": {"name": "renew_trace"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                    "name": s.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [_attribute(k, v) for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                } for s in sorted(spans, key=lambda s: s.start_ns)],
+            }],
+        }]
+    }
+
+
+def export(spans: List[Span], service: str) -> Optional[str]:
+    directory = os.environ.get("RENEW_TRACE_DIR", DEFAULT_TRACE_DIR).strip()
+    if not directory or directory.lower() in ("off", "0", "false", "no"):
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trace-{service}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(to_otlp(spans, service), f, ensure_ascii=False)
+        print(f"🧭 trace 已写入 {path}")
+        return path
+    except OSError as e:
+        print(f"⚠️ trace 写入失败: {e}")
+        return None
+
+
+def print_summary(spans: List[Span]):
+    steps = [s for s in spans if s.name != RUN]
+    if not steps:
+        return
+    top = int(os.environ.get("RENEW_TRACE_TOP") or 8)
+
+    print("⏱ 最慢步骤:")
+    for s in sorted((s for s in steps if s.name not in GROUPS), key=lambda s: -s.seconds)[:top]:
+        mark = " ❌" if s.error else ""
+        print(f"  {s.seconds:>7.1f}s  {s.name:<10} {s.label}{mark}")
+
+    groups: Dict[tuple, List[Span]] = {}
+    for s in steps:
+        groups.setdefault((s.attributes.get("provider", ""), s.name), []).append(s)
+    print("⏱ 步骤汇总（次数 / 平均 / 最长 / 失败）:")
+    for (provider, name), items in sorted(groups.items(), key=lambda kv: -sum(s.seconds for s in kv[1])):
+        durations = [s.seconds for s in items]
+        failed = sum(1 for s in items if s.error)
+        print(f"  {provider:<12} {name:<10} {len(items):>3}  {sum(durations) / len(durations):>6.1f}s  "
+              f"{max(durations):>6.1f}s  {failed}")
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求拦截：续期流程不需要的图片、字体、媒体和统计/广告脚本直接在路由层中止
+
+  - 按资源类型拦截（默认 image / media / font）
+  - 按域名拦截：默认只拦截常见统计/广告域名；设置允许列表后只放行主站、列表内域名和 Cloudflare
+  - Cloudflare 验证相关请求（challenges.cloudflare.com、/cdn-cgi/）始终放行
+  - 页面关闭时打印拦截数量、估算节省的流量和各次导航的 load 耗时
+    （从主框架导航请求发出算起，服务器重定向计入同一次导航，按最终文档的域名归类）
+  - 设置 RESOURCE_BLOCK_BASELINE 后，关闭拦截的运行按域名记录 load 耗时作为基线，
+    开启拦截时同时打印基线与本次耗时之差（节省的时间）
+
+环境变量：
+  RESOURCE_BLOCK          设为 off 关闭拦截（默认开启）
+  RESOURCE_BLOCK_TYPES    逗号分隔的资源类型，默认 image,media,font
+  RESOURCE_ALLOW_DOMAINS  逗号分隔的域名允许列表（可选，设置后第三方域名只放行列表内的）
+  RESOURCE_BLOCK_BASELINE 未拦截基线文件（JSON，可选）；先用 RESOURCE_BLOCK=off 跑几次记录基线
+
+浏览器池创建的上下文会自动安装，也可单独使用：
+  await ResourceBlocker.from_env().install(context)
+"""
+
+import json
+import os
+import statistics
+import time
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+DEFAULT_BLOCK_TYPES = ("image", "media", "font")
+
+ALWAYS_ALLOW_HOSTS = ("challenges.cloudflare.com", "cloudflare.com")
+ALWAYS_ALLOW_PATHS = ("/cdn-cgi/",)
+
+TRACKER_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "googleadservices.com", "adservice.google.com", "facebook.net", "connect.facebook.net",
+    "hotjar.com", "clarity.ms", "mc.yandex.ru", "segment.io", "mixpanel.com", "sentry.io",
+    "intercom.io", "crisp.chat", "tawk.to", "cloudflareinsights.com",
+)
+
+BASELINE_SAMPLES = 5  # 每个域名保留最近几次未拦截的 load 耗时，取中位数
+
+# 被拦截请求无法得知实际大小，按常见中位数估算（KB）
+ESTIMATED_KB = {"image": 25, "media": 300, "font": 35, "script": 40, "stylesheet": 15, "xhr": 2, "fetch": 2}
+
+
+def _host_matches(host: str, domains: Iterable[str]) -> bool:
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+def is_always_allowed(url: str) -> bool:
+    """Cloudflare 验证相关请求：拦截器始终放行，资源缓存也不缓存"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return _host_matches(host, ALWAYS_ALLOW_HOSTS) or any(p in parsed.path for p in ALWAYS_ALLOW_PATHS)
+
+
+def _site_domain(host: str) -> str:
+    """粗略取主域名（最后两段），用于判断第三方请求"""
+    parts = host.split(".")
+    return ".".join(parts[-2:]) if len(parts) >= 2 else host
+
+
+class PageStats:
+    def __init__(self):
+        self.blocked: Dict[str, int] = {}
+        self.estimated_kb = 0
+        self.allowed = 0
+        self.nav_started: Optional[float] = None
+        self.nav_host: Optional[str] = None
+        self.loads: List[Tuple[str, float]] = []  # (导航的域名, load 耗时 ms)
+
+
+class ResourceBlocker:
+    """上下文级路由拦截器，按页面统计拦截情况"""
+
+    def __init__(self, block_types: Iterable[str] = DEFAULT_BLOCK_TYPES,
+                 allow_domains: Optional[Iterable[str]] = None, enabled: bool = True,
+                 baseline_file: Optional[str] = None):
+        self.block_types = set(block_types)
+        self.allow_domains = tuple(allow_domains) if allow_domains else ()
+        self.enabled = enabled
+        self.baseline_file = baseline_file
+        self._baseline = self._load_baseline()
+        self._pages = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_env(cls) -> "ResourceBlocker":
+        types_raw = os.environ.get("RESOURCE_BLOCK_TYPES")
+        allow_raw = os.environ.get("RESOURCE_ALLOW_DOMAINS", "")
+        return cls(
+            block_types=[t.strip() for t in types_raw.split(",") if t.strip()] if types_raw is not None else DEFAULT_BLOCK_TYPES,
+            allow_domains=[d.strip().lower() for d in allow_raw.split(",") if d.strip()],
+            enabled=os.environ.get("RESOURCE_BLOCK", "on").lower() not in ("off", "0", "false", "no"),
+            baseline_file=os.environ.get("RESOURCE_BLOCK_BASELINE", "").strip() or None,
+        )
+
+    def _load_baseline(self) -> Dict[str, list]:
+        if not self.baseline_file:
+            return {}
+        try:
+            with open(self.baseline_file, encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _record_baseline(self, host: str, load_ms: float):
+        """关闭拦截时记录未拦截的 load 耗时"""
+        samples = self._baseline.setdefault(host, [])
+        samples.append(round(load_ms))
+        del samples[:-BASELINE_SAMPLES]
+        try:
+            with open(self.baseline_file, "w", encoding="utf-8") as f:
+                json.dump(self._baseline, f, indent=2, sort_keys=True)
+        except OSError as e:
+            print(f"⚠️ 拦截基线保存失败: {e}")
+
+    def classify(self, url: str, resource_type: str, page_url: str = "") -> Optional[str]:
+        """返回拦截原因（资源类型 / tracker / third-party），放行返回 None"""
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        if parsed.scheme not in ("http", "https"):
+            return None
+        if is_always_allowed(url):
+            return None
+        if resource_type == "document":
+            return None
+        if _host_matches(host, TRACKER_HOSTS):
+            return "tracker"
+        if resource_type in self.block_types:
+            return resource_type
+        if self.allow_domains:
+            site = _site_domain((urlparse(page_url).hostname or "").lower())
+            if site and not _host_matches(host, (site,) + self.allow_domains):
+                return "third-party"
+        return None
+
+    async def install(self, context):
+        if self.enabled:
+            await context.route("**/*", self._handle)
+            context.on("page", self._track_page)
+        elif self.baseline_file:
+            # 不拦截，只记录 load 耗时作为基线
+            context.on("page", self._track_page)
+
+    def _track_page(self, page):
+        self._pages[page] = PageStats()
+        page.on("request", lambda request: self._on_request(page, request))
+        page.on("load", lambda: self._on_load(page))
+        page.on("close", lambda: self.report(page))
+
+    def _on_request(self, page, request):
+        """主框架导航开始计时；重定向的后续请求沿用起点，只更新域名"""
+        stats = self._pages.get(page)
+        try:
+            if stats is None or not request.is_navigation_request() or request.frame.parent_frame is not None:
+                return
+        except Exception:
+            return
+        if request.redirected_from is None:
+            stats.nav_started = time.monotonic()
+        stats.nav_host = urlparse(request.url).hostname
+
+    def _on_load(self, page):
+        stats = self._pages.get(page)
+        if stats is not None and stats.nav_started is not None:
+            stats.loads.append((stats.nav_host, (time.monotonic() - stats.nav_started) * 1000))
+            stats.nav_started = None
+
+    async def _handle(self, route, request):
+        try:
+            page = request.frame.page
+        except Exception:
+            page = None
+        page_url = page.url if page is not None else ""
+        reason = self.classify(request.url, request.resource_type, page_url)
+        stats = self._pages.get(page) if page is not None else None
+
+        if reason is None:
+            if stats is not None:
+                stats.allowed += 1
+            # 交给后注册的路由（如 asset_cache）或直接发出
+            await route.fallback()
+            return
+
+        if stats is not None:
+            stats.blocked[reason] = stats.blocked.get(reason, 0) + 1
+            stats.estimated_kb += ESTIMATED_KB.get(request.resource_type, 10)
+        await route.abort("blockedbyclient")
+
+    def report(self, page):
+        stats = self._pages.pop(page, None)
+        if stats is None:
+            return
+        if not self.enabled:
+            for nav_host, load_ms in stats.loads:
+                if nav_host:
+                    self._record_baseline(nav_host, load_ms)
+            return
+        if not stats.blocked:
+            return
+        host = urlparse(page.url).hostname or page.url
+        detail = ", ".join(f"{k} {v}" for k, v in sorted(stats.blocked.items(), key=lambda kv: -kv[1]))
+        loads = []
+        for nav_host, load_ms in stats.loads:
+            load = f"{nav_host} {load_ms:.0f} ms"
+            if self._baseline.get(nav_host):
+                baseline = statistics.median(self._baseline[nav_host])
+                load += f"（未拦截基线 {baseline:.0f} ms，节省 {baseline - load_ms:.0f} ms）"
+            loads.append(load)
+        load = f"，load {'; '.join(loads)}" if loads else ""
+        print(f"🧱 {host}: 拦截 {sum(stats.blocked.values())} 个请求 ({detail})，"
+              f"放行 {stats.allowed} 个，约省 {stats.estimated_kb} KB{load}")
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+续期运行历史（SQLite）与回归检测
+
+每次运行结束时（renew_trace 最外层的 trace_run() 退出时）按账号追加一条紧凑记录：
+  provider、账号哈希、结果（success / cooldown / challenge_timeout / failed）、总耗时、各步骤耗时
+数据库是单个文件，配合 actions/cache 在多次运行间保留，也可作为 artifact 下载。
+
+结果归类：
+  - failed：账号或服务器步骤出错
+  - challenge_timeout：有验证等待（CHALLENGE）失败
+  - cooldown：冷却期 / 今日已续期 / 续期受限
+  - success：其余情况
+
+用法：
+  python scripts/run_metrics.py report [--db run-metrics.db] [--days 30] [--recent 5] [--strict]
+    对比每个 provider 最近 N 次运行与更早的基线：
+      - 总耗时或某步骤耗时的中位数上升超过阈值 → 耗时回归
+      - 失败率 / 验证超时率 / 冷却率上升超过阈值 → 失败率上升
+    --strict 时发现问题退出码为 1，可在工作流中作为检查步骤
+
+环境变量：
+  RUN_METRICS_DB              数据库路径，未设置时不记录
+  RUN_METRICS_KEEP_DAYS       保留天数，默认 90
+  RUN_METRICS_SLOWDOWN        耗时回归阈值（比例），默认 0.5（即慢 50%）
+  RUN_METRICS_MIN_SECONDS     耗时回归的最小绝对差值（秒），默认 5
+  RUN_METRICS_RATE_DELTA      失败率上升阈值（百分点），默认 20
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from renew_trace import ACCOUNT, CHALLENGE, GROUPS, JOB, RUN, Span
+
+BAD_OUTCOMES = ("cooldown", "challenge_timeout", "failed")
+
+# 各脚本在 span 的 outcome 属性里写的结果 → 统一结果
+OUTCOME_ALIASES = {
+    "success": "success",
+    "reminder": "cooldown",
+    "cooldown": "cooldown",
+    "rate_limited": "cooldown",
+    "skipped": "success",
+    "error": "failed",
+    "failed": "failed",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    run_id TEXT,
+    provider TEXT NOT NULL,
+    account TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_provider_time ON runs(provider, started_at);
+CREATE INDEX IF NOT EXISTS steps_run ON steps(run);
+"""
+
+
+def account_hash(provider: str, account: str) -> str:
+    """账号只保存哈希，数据库可以放心作为 artifact 上传"""
+    return hashlib.sha256(f"{provider}:{account}".encode("utf-8")).hexdigest()[:12]
+
+
+def normalize_outcome(value) -> Optional[str]:
+    if value is None:
+        return None
+    text = str(value)
+    if text in OUTCOME_ALIASES:
+        return OUTCOME_ALIASES[text]
+    # pella 的 outcome 是给人看的结果文字
+    if "已续期" in text:
+        return "cooldown"
+    if "❌" in text:
+        return "failed"
+    if "成功" in text:
+        return "success"
+    return None
+
+
+def summarize(spans: List[Span]) -> List[dict]:
+    """
+    把一次运行的 span 按 (provider, account) 归并成记录（子 span 都继承了这两个属性）；
+    不属于任何账号的步骤（汇总通知等）和整体出错的 run / job 记为该 provider 的一条账号为空的记录
+    """
+    groups: Dict[tuple, List[Span]] = {}
+    for s in spans:
+        key = (s.attributes.get("provider", ""), str(s.attributes.get("account", "")))
+        if s.name in (RUN, JOB):
+            if s.error:
+                groups.setdefault((key[0], ""), []).append(s)
+            continue
+        groups.setdefault(key, []).append(s)
+
+    records = []
+    for (provider, account), items in groups.items():
+        outcomes = {normalize_outcome(s.attributes.get("outcome")) for s in items}
+        if any(s.error for s in items if s.name in GROUPS) or "failed" in outcomes:
+            outcome = "failed"
+        elif any(s.error for s in items if s.name == CHALLENGE):
+            outcome = "challenge_timeout"
+        elif "cooldown" in outcomes:
+            outcome = "cooldown"
+        else:
+            outcome = "success"
+
+        steps: Dict[str, list] = {}
+        for s in items:
+            if s.name in GROUPS:
+                continue
+            item = steps.setdefault(s.name, [0, 0.0, 0])
+            item[0] += 1
+            item[1] += s.seconds
+            item[2] += 1 if s.error else 0
+
+        accounts = [s for s in items if s.name == ACCOUNT]
+        timed = accounts or items
+        records.append({
+            "started_at": min(s.start_ns for s in timed) / 1e9,
+            "provider": provider,
+            "account": account_hash(provider, account),
+            "outcome": outcome,
+            "seconds": (max(s.end_ns for s in timed) - min(s.start_ns for s in timed)) / 1e9,
+            "steps": steps,
+        })
+    return records
+
+
+class MetricsStore:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def append(self, records: List[dict], run_id: Optional[str] = None):
+        with self.db:
+            for r in records:
+                cursor = self.db.execute(
+                    "INSERT INTO runs (started_at, run_id, provider, account, outcome, seconds) VALUES (?, ?, ?, ?, ?, ?)",
+                    (r["started_at"], run_id, r["provider"], r["account"], r["outcome"], round(r["seconds"], 2)),
+                )
+                self.db.executemany(
+                    "INSERT INTO steps (run, name, count, seconds, failed) VALUES (?, ?, ?, ?, ?)",
+                    [(cursor.lastrowid, name, count, round(seconds, 2), failed)
+                     for name, (count, seconds, failed) in r["steps"].items()],
+                )
+
+    def prune(self, keep_days: float):
+        with self.db:
+            self.db.execute("DELETE FROM runs WHERE started_at < ?", (time.time() - keep_days * 86400,))
+
+    def history(self, provider: str, since: float) -> List[dict]:
+        runs = self.db.execute(
+            "SELECT id, outcome, seconds FROM runs WHERE provider = ? AND started_at >= ? ORDER BY started_at",
+            (provider, since),
+        ).fetchall()
+        steps: Dict[int, Dict[str, float]] = {}
+        for run, name, seconds in self.db.execute(
+                "SELECT steps.run, steps.name, steps.seconds FROM steps JOIN runs ON runs.id = steps.run "
+                "WHERE runs.provider = ? AND runs.started_at >= ?", (provider, since)):
+            steps.setdefault(run, {})[name] = seconds
+        return [{"outcome": outcome, "seconds": seconds, "steps": steps.get(run, {})} for run, outcome, seconds in runs]
+
+    def providers(self) -> List[str]:
+        return [row[0] for row in self.db.execute("SELECT DISTINCT provider FROM runs ORDER BY provider")]
+
+
+def record(spans: List[Span]):
+    """renew_trace 导出时调用；未设置 RUN_METRICS_DB 时什么也不做，记录失败不影响续期结果"""
+    path = os.environ.get("RUN_METRICS_DB", "").strip()
+    if not path:
+        return
+    try:
+        records = summarize(spans)
+        if not records:
+            return
+        store = MetricsStore(path)
+        try:
+            store.append(records, os.environ.get("GITHUB_RUN_ID"))
+            store.prune(float(os.environ.get("RUN_METRICS_KEEP_DAYS") or 90))
+        finally:
+            store.close()
+        print(f"🗃 运行记录已写入 {path} ({len(records)} 条)")
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ 运行记录写入失败: {e}")
+
+
+def _rates(runs: List[dict]) -> Dict[str, float]:
+    return {o: 100 * sum(1 for r in runs if r["outcome"] == o) / len(runs) for o in BAD_OUTCOMES}
+
+
+def _slowdown(name: str, baseline: List[float], recent: List[float], ratio: float, min_seconds: float) -> Optional[str]:
+    if len(baseline) < 2 or not recent:
+        return None
+    before, after = statistics.median(baseline), statistics.median(recent)
+    if after - before >= min_seconds and after > before * (1 + ratio):
+        return f"🐢 {name} 耗时回归: 中位数 {before:.1f}s → {after:.1f}s"
+    return None
+
+
+def analyze(runs: List[dict], recent_count: int, ratio: float, min_seconds: float, rate_delta: float) -> List[str]:
+    """把历史分成基线和最近 recent_count 次，返回发现的问题"""
+    if len(runs) <= recent_count:
+        return []
+    baseline, recent = runs[:-recent_count], runs[-recent_count:]
+    findings = []
+
+    found = _slowdown("总计", [r["seconds"] for r in baseline], [r["seconds"] for r in recent], ratio, min_seconds)
+    if found:
+        findings.append(found)
+    for name in sorted({n for r in runs for n in r["steps"]}):
+        found = _slowdown(name, [r["steps"][name] for r in baseline if name in r["steps"]],
+                          [r["steps"][name] for r in recent if name in r["steps"]], ratio, min_seconds)
+        if found:
+            findings.append(found)
+
+    before, after = _rates(baseline), _rates(recent)
+    for outcome in BAD_OUTCOMES:
+        if after[outcome] - before[outcome] >= rate_delta:
+            findings.append(f"📈 {outcome} 比例上升: {before[outcome]:.0f}% → {after[outcome]:.0f}%")
+    return findings
+
+
+def report(path: str, days: float, recent_count: int, strict: bool) -> int:
+    if not os.path.exists(path):
+        print(f"ℹ️ 暂无运行记录: {path}")
+        return 0
+    ratio = float(os.environ.get("RUN_METRICS_SLOWDOWN") or 0.5)
+    min_seconds = float(os.environ.get("RUN_METRICS_MIN_SECONDS") or 5)
+    rate_delta = float(os.environ.get("RUN_METRICS_RATE_DELTA") or 20)
+
+    store = MetricsStore(path)
+    problems = 0
+    try:
+        since = time.time() - days * 86400
+        print(f"📊 最近 {days:.0f} 天运行记录（最近 {recent_count} 次 vs 基线）")
+        for provider in store.providers():
+            runs = store.history(provider, since)
+            if not runs:
+                continue
+            rates = _rates(runs)
+            print("=" * 50)
+            print(f"{provider}: {len(runs)} 次，耗时中位数 {statistics.median(r['seconds'] for r in runs):.1f}s，"
+                  f"失败 {rates['failed']:.0f}% / 验证超时 {rates['challenge_timeout']:.0f}% / 冷却 {rates['cooldown']:.0f}%")
+            findings = analyze(runs, recent_count, ratio, min_seconds, rate_delta)
+            if len(runs) <= recent_count:
+                print(f"  ℹ️ 记录不足 {recent_count + 1} 次，暂不比较")
+            for finding in findings:
+                print(f"  {finding}")
+            if not findings and len(runs) > recent_count:
+                print("  ✅ 无回归")
+            problems += len(findings)
+    finally:
+        store.close()
+    return 1 if strict and problems else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="续期运行历史报告")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("report", help="检测耗时回归和失败率上升")
+    cmd.add_argument("--db", default=os.environ.get("RUN_METRICS_DB") or "run-metrics.db")
+    cmd.add_argument("--days", type=float, default=30)
+    cmd.add_argument("--recent", type=int, default=5)
+    cmd.add_argument("--strict", action="store_true", help="发现问题时退出码为 1")
+    args = parser.parse_args()
+    sys.exit(report(args.db, args.days, max(1, args.recent), args.strict))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+截图策略（KataBump / Weirdhost / Data Online 共用）
+
+默认只在出错时落盘：
+  - checkpoint()：诊断截图，只压缩后放进内存环形缓冲，出错时才随 failure() 一起写盘
+  - capture()：要随通知发送的截图，直接写盘
+  - failure()：写出错画面，并冲刷环形缓冲里最近的诊断帧
+  - 默认只截视口，可传 selector 或 clip 只截某个区域；格式可选 JPEG / PNG
+
+环境变量：
+  SCREENSHOT_MODE       failure（默认）/ always（诊断截图也直接写盘）/ off（不截图）
+  SCREENSHOT_FORMAT     jpeg（默认）/ png
+  SCREENSHOT_QUALITY    JPEG 质量，默认 70
+  SCREENSHOT_RING       内存中保留的最近诊断帧数，默认 3；0 表示跳过诊断截图
+  SCREENSHOT_FULL_PAGE  设为 1 时截整页
+  SCREENSHOT_DIR        输出目录
+
+用法：
+  from screenshot_policy import ScreenshotPolicy
+  shots = ScreenshotPolicy.from_env().recorder("server-1")
+  await shots.checkpoint(page, "after_login")
+  path = await shots.failure(page, "error")
+"""
+
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Tuple
+
+MODES = ("failure", "always", "off")
+FORMATS = ("jpeg", "png")
+
+
+@dataclass
+class ScreenshotPolicy:
+    directory: str = "."
+    mode: str = "failure"
+    fmt: str = "jpeg"
+    quality: int = 70
+    ring_size: int = 3
+    full_page: bool = False
+
+    @classmethod
+    def from_env(cls, directory: str = ".") -> "ScreenshotPolicy":
+        mode = (os.environ.get("SCREENSHOT_MODE") or "failure").strip().lower()
+        fmt = (os.environ.get("SCREENSHOT_FORMAT") or "jpeg").strip().lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        return cls(
+            directory=os.environ.get("SCREENSHOT_DIR") or directory,
+            mode=mode if mode in MODES else "failure",
+            fmt=fmt if fmt in FORMATS else "jpeg",
+            quality=int(os.environ.get("SCREENSHOT_QUALITY") or 70),
+            ring_size=max(0, int(os.environ.get("SCREENSHOT_RING") or 3)),
+            full_page=(os.environ.get("SCREENSHOT_FULL_PAGE") or "").lower() in ("1", "true", "yes"),
+        )
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.fmt == "jpeg" else "png"
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.fmt}"
+
+    def encode_options(self) -> dict:
+        """page.screenshot / locator.screenshot 共用的编码参数，按 CSS 像素输出避免高 DPI 放大"""
+        options = {"type": self.fmt, "scale": "css"}
+        if self.fmt == "jpeg":
+            options["quality"] = self.quality
+        return options
+
+    def recorder(self, tag: str = "") -> "ScreenshotRecorder":
+        return ScreenshotRecorder(self, tag)
+
+
+class ScreenshotRecorder:
+    """单个流程（一台服务器 / 一个账号）的截图记录器，持有自己的环形缓冲"""
+
+    def __init__(self, policy: ScreenshotPolicy, tag: str = ""):
+        self.policy = policy
+        self.tag = tag
+        self._ring: Deque[Tuple[str, bytes]] = deque(maxlen=policy.ring_size)
+
+    async def _grab(self, page, selector: Optional[str] = None, clip: Optional[dict] = None) -> bytes:
+        options = self.policy.encode_options()
+        if selector:
+            element = page.locator(selector).first
+            try:
+                if await element.is_visible():
+                    return await element.screenshot(**options)
+            except Exception:
+                pass
+        if clip:
+            return await page.screenshot(clip=clip, **options)
+        return await page.screenshot(full_page=self.policy.full_page, **options)
+
+    def _write(self, name: str, data: bytes) -> str:
+        os.makedirs(self.policy.directory, exist_ok=True)
+        filename = f"{self.tag}_{name}" if self.tag else name
+        path = os.path.join(self.policy.directory, f"{filename}.{self.policy.extension}")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    async def checkpoint(self, page, name: str, selector: Optional[str] = None,
+                         clip: Optional[dict] = None) -> Optional[str]:
+        """诊断截图：always 模式直接写盘，failure 模式只进环形缓冲"""
+        mode = self.policy.mode
+        if mode == "off" or (mode == "failure" and not self.policy.ring_size):
+            return None
+        try:
+            data = await self._grab(page, selector, clip)
+        except Exception:
+            return None
+        if mode == "always":
+            return self._write(name, data)
+        self._ring.append((name, data))
+        return None
+
+    async def capture(self, page, name: str, selector: Optional[str] = None,
+                      clip: Optional[dict] = None) -> Optional[str]:
+        """要随通知发送的截图，off 模式下返回 None"""
+        if self.policy.mode == "off":
+            return None
+        try:
+            return self._write(name, await self._grab(page, selector, clip))
+        except Exception:
+            return None
+
+    async def failure(self, page, name: str, selector: Optional[str] = None,
+                      clip: Optional[dict] = None) -> Optional[str]:
+        """出错时调用：先冲刷环形缓冲，再写出错画面"""
+        if self.policy.mode == "off":
+            return None
+        self.flush_ring()
+        return await self.capture(page, name, selector, clip)
+
+    def flush_ring(self) -> List[str]:
+        paths = []
+        for index, (name, data) in enumerate(self._ring, 1):
+            paths.append(self._write(f"ring{index}_{name}", data))
+        self._ring.clear()
+        return paths
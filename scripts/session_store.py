@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+浏览器会话持久化（Pella / Data Online 共用）
+
+按账号把 Playwright storage_state 用 SecretBox 加密后落盘，配合 Actions cache 在多次运行间复用登录状态。
+密钥由口令（未设置时用账号密码）和账号标识派生；未安装 pynacl 时自动禁用。
+
+用法：
+  from session_store import SessionStore
+  store = SessionStore(".pella-state", os.getenv("PELLA_STATE_KEY"))
+  state = store.load(email, password)
+  store.save(email, password, await context.storage_state())
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+try:
+    from nacl import secret, exceptions as nacl_exceptions
+    NACL_AVAILABLE = True
+except ImportError:
+    NACL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """按账号持久化浏览器会话（storage_state），使用 SecretBox 加密落盘"""
+
+    def __init__(self, directory, secret_key=None):
+        self.directory = directory
+        self.secret_key = secret_key
+
+    @property
+    def enabled(self):
+        return NACL_AVAILABLE and bool(self.directory)
+
+    def _path(self, account):
+        name = hashlib.sha256(account.lower().encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def _box(self, account, password):
+        material = f"{self.secret_key or password}:{account.lower()}".encode('utf-8')
+        return secret.SecretBox(hashlib.sha256(material).digest())
+
+    def load(self, account, password):
+        if not self.enabled:
+            return None
+        path = self._path(account)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return json.loads(self._box(account, password).decrypt(f.read()))
+        except (OSError, ValueError, nacl_exceptions.CryptoError) as e:
+            logger.warning(f"⚠️ 会话文件无法读取，忽略: {e}")
+            return None
+
+    def save(self, account, password, state):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            data = self._box(account, password).encrypt(json.dumps(state).encode('utf-8'))
+            with open(self._path(account), 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            logger.warning(f"⚠️ 会话保存失败: {e}")
+
+    def discard(self, account):
+        try:
+            os.remove(self._path(account))
+        except OSError:
+            pass
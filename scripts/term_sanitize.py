@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+终端输出清理器（Pella 重启日志 / Castle-Host 控制台 / Data Online 终端共用）
+
+功能：
+  - 去除 CSI / OSC / 其它 ESC 转义序列，以及浏览器渲染后丢失 ESC 的残留（如 [1;1H、[0J、[32m）
+  - 按真实终端语义处理回车覆盖（\\r）、退格（\\b）和清行（ESC[K）
+  - 折叠同一进度条的连续刷新（\\r 覆盖，或说明文字相同的连续进度条行），只保留最后一帧
+  - 折叠连续重复行
+  - 流式处理：feed() 可分块输入，整体为线性时间
+
+用法：
+  from term_sanitize import sanitize
+  clean = sanitize(raw_text)
+
+自检与基准测试：
+  python scripts/term_sanitize.py [日志文件 ...]
+"""
+
+import re
+import sys
+import time
+from typing import Iterable, List, Optional, Tuple
+
+# ESC[ ... 终止符 (CSI)，以及 8 位 C1 形式 \x9b
+CSI_RE = r"(?:\x1b\[|\x9b)[0-?]*[ -/]*[@-~]"
+# ESC] ... BEL 或 ESC\ (OSC)，例如设置窗口标题、超链接
+OSC_RE = r"(?:\x1b\]|\x9d)[^\x07\x1b\x9c]*(?:\x07|\x1b\\|\x9c)?"
+# 其它双字符 ESC 序列（ESC 7/8、ESC =、ESC (B 等）
+ESC_RE = r"\x1b[()][0-9A-Za-z]|\x1b[@-Z\\^_=>78]"
+# 网页终端 innerText 中 ESC 已丢失的光标/清屏/颜色残留：带数字参数的任意位置都去除；
+# 不带参数的 [H / [J / [K 只在行首或紧跟另一个残留时去除，且后面不能是字母、数字或 ]，避免误删 [HTTP]、[Koa]、[K8s] 这类日志前缀
+ORPHAN_RE = r"\[\d{1,3}(?:;\d{1,3})*[HfJKm]|(?:^|(?<=[HfJKm]))\[[HJK](?![A-Za-z\d\]])"
+# 除 \t \b \r 以外的控制字符
+CTRL_RE = r"[\x00-\x07\x0b\x0c\x0e-\x1a\x1c-\x1f\x7f]"
+
+ANSI_PATTERN = re.compile("|".join((CSI_RE, OSC_RE, ESC_RE, ORPHAN_RE, CTRL_RE)))
+ERASE_LINE_PATTERN = re.compile(r"\x1b\[[02]?K|\[[02]K|\[K(?![A-Za-z\d\]])")
+# 只有进度条/转圈字符才算进度行；单独的百分比（如 disk usage 45%）是普通日志
+PROGRESS_PATTERN = re.compile(r"[█▉▊▋▌▍▎▏▓▒░■]{3,}|[#=]{6,}|[⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏]")
+PROGRESS_NOISE_PATTERN = re.compile(r"[\d\s.,:/%█▉▊▋▌▍▎▏▓▒░■□#=>\-⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏|]+")
+
+
+def strip_ansi(text: str) -> str:
+    """只去除转义序列和控制字符，不处理回车/重复行"""
+    return ANSI_PATTERN.sub("", text)
+
+
+def progress_signature(line: str) -> Optional[str]:
+    """
+    进度条行返回去掉数字和进度字符后的签名，非进度行返回 None。
+    签名为空（只有进度条、没有说明文字）时也返回 None：无法确认连续两行是同一个进度条
+    """
+    if not PROGRESS_PATTERN.search(line):
+        return None
+    return PROGRESS_NOISE_PATTERN.sub("", line) or None
+
+
+def render_line(raw: str, screen: str = "") -> str:
+    """按终端语义渲染一行：\\r 回到行首覆盖，ESC[K 清除行尾，\\b 退格"""
+    if "\r" not in raw and "\b" not in raw and not screen:
+        return strip_ansi(raw)
+
+    buf = list(screen)
+    for seg in raw.split("\r"):
+        erase = ERASE_LINE_PATTERN.search(seg) is not None
+        seg = strip_ansi(seg)
+        if "\b" in seg:
+            chars: List[str] = []
+            for ch in seg:
+                if ch == "\b":
+                    if chars:
+                        chars.pop()
+                else:
+                    chars.append(ch)
+            seg = "".join(chars)
+        buf[0:len(seg)] = seg
+        if erase:
+            del buf[len(seg):]
+    return "".join(buf)
+
+
+class TerminalSanitizer:
+    """流式终端输出清理器，feed() 返回已完成的行，close() 冲刷剩余内容"""
+
+    def __init__(self, collapse_repeats: bool = True, collapse_progress: bool = True,
+                 drop_blank: bool = False, drop_lines: Iterable[str] = ()):
+        self.collapse_repeats = collapse_repeats
+        self.collapse_progress = collapse_progress
+        self.drop_blank = drop_blank
+        self.drop_lines = set(drop_lines)
+
+        self._pending: List[str] = []
+        self._screen = ""
+        self._held: Optional[str] = None
+        self._held_sig: Optional[str] = None
+        self._held_count = 0
+
+    def feed(self, chunk: str) -> List[str]:
+        out: List[str] = []
+        if "\n" in chunk:
+            parts = chunk.split("\n")
+            parts[0] = "".join(self._pending) + parts[0]
+            self._pending = [parts.pop()]
+            for raw in parts:
+                self._push(render_line(raw, self._screen), out)
+                self._screen = ""
+        else:
+            self._pending.append(chunk)
+
+        # 只有 \r 没有 \n 的进度条会让未完成行无限增长，先把最后一个 \r 之前的部分渲染掉
+        if "\r" in self._pending[-1]:
+            tail = "".join(self._pending)
+            cut = tail.rfind("\r")
+            if cut > 0:
+                self._screen = render_line(tail[:cut], self._screen)
+                tail = tail[cut:]
+            self._pending = [tail]
+        return out
+
+    def close(self) -> List[str]:
+        out: List[str] = []
+        tail = "".join(self._pending)
+        if tail or self._screen:
+            self._push(render_line(tail, self._screen), out)
+        self._pending, self._screen = [], ""
+        self._flush(out)
+        return out
+
+    def _push(self, line: str, out: List[str]):
+        line = line.rstrip()
+        if line.strip() in self.drop_lines or (self.drop_blank and not line.strip()):
+            return
+
+        if self._held is not None:
+            if self.collapse_repeats and line == self._held:
+                self._held_count += 1
+                return
+            sig = progress_signature(line) if self.collapse_progress else None
+            if sig is not None and sig == self._held_sig:
+                self._held, self._held_count = line, 1
+                return
+            self._flush(out)
+            self._held_sig = sig
+        else:
+            self._held_sig = progress_signature(line) if self.collapse_progress else None
+
+        self._held, self._held_count = line, 1
+
+    def _flush(self, out: List[str]):
+        if self._held is None:
+            return
+        if self._held_count > 1 and self._held.strip():
+            out.append(f"{self._held} (×{self._held_count})")
+        else:
+            out.append(self._held)
+        self._held, self._held_sig, self._held_count = None, None, 0
+
+
+def sanitize(text: str, **options) -> str:
+    """一次性清理整段终端输出"""
+    if not text:
+        return ""
+    cleaner = TerminalSanitizer(**options)
+    lines = cleaner.feed(text)
+    lines.extend(cleaner.close())
+    return "\n".join(lines).strip("\n")
+
+
+# 基准测试用的样本：Pella 重启输出（浏览器 innerText，ESC 已丢失）+ 带颜色和 \r 进度条的原始终端输出
+SAMPLE_LOG = (
+    "[1;1H[0J> Restarting server...\n"
+    "Copy\n"
+    "\x1b[32m✔\x1b[0m Installing dependencies\n"
+    + "".join(f"\rnpm http fetch GET 200 https://registry.npmjs.org/pkg {i}% [{'#' * (i // 10)}{' ' * (10 - i // 10)}]"
+              for i in range(0, 101, 4))
+    + "\n"
+    + "\x1b]0;node app.js\x07\x1b[1m[INFO]\x1b[22m Loading config.yml\n"
+    + "[INFO] heartbeat ok\n" * 5
+    + "Downloading ██░░░░░░░░ 20%\nDownloading ████░░░░░░ 40%\nDownloading ██████████ 100%\n"
+    "\x1b[2K\rApp is running on port 3000\n"
+    "Thank you for using this script, enjoy!\n"
+)
+
+# 自检：(输入, 期望输出)；普通日志里的 [HTTP] / [Koa] / [JVM] / [K8s] 前缀不能被当作残留去掉，
+# 带百分比但不是进度条的连续日志不能被折叠
+SELF_CHECK_SAMPLES = [
+    ("[1;1H[0J> Restarting server...", "> Restarting server..."),
+    ("[H[J> Restarting server...", "> Restarting server..."),
+    ("\x1b[32m✔\x1b[0m done", "✔ done"),
+    ("[HTTP] GET /index 200\n[Koa] listening\n[JVM] started", "[HTTP] GET /index 200\n[Koa] listening\n[JVM] started"),
+    ("progress 10%\r[Koa] listening", "[Koa] listening"),
+    ("[K8s] ok", "[K8s] ok"),
+    ("disk usage 45%\ndisk usage 90%\ndone\n", "disk usage 45%\ndisk usage 90%\ndone"),
+    ("Downloading ██░░░░ 20%\nDownloading ████░░ 60%\ndone", "Downloading ████░░ 60%\ndone"),
+]
+
+
+def _self_check():
+    for raw, expected in SELF_CHECK_SAMPLES:
+        got = sanitize(raw)
+        assert got == expected, f"sanitize({raw!r}) = {got!r}，期望 {expected!r}"
+    print(f"✅ 自检通过 ({len(SELF_CHECK_SAMPLES)} 条)")
+
+
+def _benchmark(samples: List[Tuple[str, str]]):
+    for name, sample in samples:
+        base_lines = sanitize(sample).count("\n") + 1
+        print(f"📄 {name}: {len(sample)} 字符 -> {base_lines} 行")
+        for mb in (1, 2, 4, 8):
+            text = sample * max(1, (mb * 1024 * 1024) // max(1, len(sample.encode("utf-8"))))
+            start = time.perf_counter()
+            cleaner = TerminalSanitizer()
+            count = 0
+            for i in range(0, len(text), 65536):
+                count += len(cleaner.feed(text[i:i + 65536]))
+            count += len(cleaner.close())
+            elapsed = time.perf_counter() - start
+            size = len(text.encode("utf-8")) / 1024 / 1024
+            print(f"  {size:5.1f} MB  {elapsed * 1000:8.1f} ms  {size / elapsed:6.1f} MB/s  -> {count} 行")
+
+
+if __name__ == "__main__":
+    _self_check()
+    files = sys.argv[1:]
+    if files:
+        samples = []
+        for path in files:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                samples.append((path, f.read()))
+    else:
+        samples = [("SAMPLE_LOG", SAMPLE_LOG)]
+    _benchmark(samples)
@@ -3,18 +3,38 @@
 """
 功能：使用 Cookie 登录 → 续期 → 提取新 Cookie → 更新 GitHub Secrets
 环境变量：
-  - REMEMBER_WEB_COOKIE : cookie 值（必须）
+  - REMEMBER_WEB_COOKIE : cookie 值（必须，多账号用逗号或换行分隔）
+  - SERVER_URL : 服务器地址（可选，逗号分隔；仅单账号时生效，不设置则自动获取账号下全部服务器）
+  - WEIRDHOST_CONCURRENCY : 同时处理的服务器数（可选，默认 3）
+  - WEIRDHOST_STATE_FILE : 本地状态缓存文件（可选，默认 weirdhost-state.json）
+  - WEIRDHOST_COOLDOWN_HOURS : 续期冷却时长（可选，默认 24）；缓存显示冷却中且未临近到期时不启动浏览器
+  - WEIRDHOST_HTTP_PROBE : 设为 1 时先用 HTTP 请求面板 API 刷新到期时间（可选）
+  - WEIRDHOST_DISCOVERY_DAYS : 缓存的账号服务器列表超过多少天重新获取（可选，默认 7）；本次已要为该账号启动浏览器时也顺便重新获取
+  - FORCE_RENEW : 设为 true 时忽略缓存（可选）
+  - RENEW_SCHEDULE_FILE : 共用的续期调度状态（可选），同步记录到期和冷却时间，供工作流在安装依赖前判断是否需要运行
+  - WEIRDHOST_DIRECT_RENEW : 设为 false 时禁用直接 API 续期（可选，默认启用；需先有一次浏览器续期记录请求形态）
   - REMEMBER_WEB_COOKIE_NAME : cookie 名称（可选，默认 'remember_web'）
+  - SCREENSHOT_MODE / SCREENSHOT_FORMAT / SCREENSHOT_RING : 截图策略（可选，默认只在出错时截图，见 screenshot_policy.py）
   - TG_BOT_TOKEN, TG_CHAT_ID : Telegram 通知（可选）
   - REPO_TOKEN : 用于自动更新 GitHub Secrets（可选但推荐）
   - GITHUB_REPOSITORY : 自动由 GitHub Actions 提供
 """
 import os
+import re
+import json
+import time
 import asyncio
+import weakref
 import aiohttp
 import base64
+from dataclasses import dataclass
 from datetime import datetime
-from playwright.async_api import async_playwright
+from typing import Optional
+from urllib.parse import unquote
+from screenshot_policy import ScreenshotPolicy
+from browser_pool import BrowserPool, browser_pool
+from renew_schedule import RenewSchedule
+from renew_trace import ACCOUNT, API, CHALLENGE, NAVIGATE, NOTIFY, RENEW, SERVER, span, trace_run
 
 try:
     from nacl import encoding, public
@@ -25,6 +45,16 @@ except ImportError:
 DEFAULT_DASHBOARD_URL = "https://hub.weirdhost.xyz/"
 DEFAULT_COOKIE_NAME = "remember_web"
 NOTIFY_DAYS_BEFORE = 2  # 到期前几天通知
+DEFAULT_CONCURRENCY = 3  # 同时处理的服务器页面数
+STATE_FILE = os.environ.get("WEIRDHOST_STATE_FILE", "weirdhost-state.json")
+COOLDOWN_HOURS = float(os.environ.get("WEIRDHOST_COOLDOWN_HOURS", "24"))
+COOLDOWN_SLACK_SECONDS = 600  # 定时任务触发时间有抖动，冷却剩余不足 10 分钟视为已结束
+HTTP_PROBE = os.environ.get("WEIRDHOST_HTTP_PROBE", "").lower() in ("1", "true", "yes")
+DISCOVERY_DAYS = float(os.environ.get("WEIRDHOST_DISCOVERY_DAYS", "7"))
+FORCE_RENEW = os.environ.get("FORCE_RENEW", "").lower() == "true"
+DIRECT_RENEW = os.environ.get("WEIRDHOST_DIRECT_RENEW", "true").lower() != "false"
+SCREENSHOTS = ScreenshotPolicy.from_env()
+SCHEDULE = RenewSchedule.from_env()
 
 
 def extract_server_id(url: str) -> str:
@@ -118,28 +148,108 @@ def is_cooldown_error(error_detail: str) -> bool:
     return any(kw in error_detail.lower() for kw in keywords)
 
 
+CF_CHALLENGE_HOST = "challenges.cloudflare.com"
+# Turnstile 小组件通过后会把 token 写入该隐藏输入框，iframe 本身不会消失
+CF_TOKEN_JS = """
+    () => Array.from(document.querySelectorAll('input[name="cf-turnstile-response"]')).some(i => (i.value || '').length > 20)
+"""
+# 本次运行中 CF 验证的累计统计
+CF_STATS = {"challenges": 0, "seconds": 0.0, "timeouts": 0}
+
+
+class ChallengeWatcher:
+    """通过导航/帧事件跟踪页面上的 Cloudflare 挑战，不需要轮询页面"""
+
+    def __init__(self, page):
+        self.page = page
+        self.document_challenge = False
+        self.changed = asyncio.Event()
+        page.on("response", self._on_response)
+        page.on("frameattached", self._on_frame)
+        page.on("framedetached", self._on_frame)
+        page.on("framenavigated", self._on_frame)
+
+    def _on_response(self, response):
+        try:
+            if response.request.resource_type != "document" or response.frame != self.page.main_frame:
+                return
+        except Exception:
+            return
+        # CF 拦截页（整页 "Just a moment..."）的响应头带 cf-mitigated: challenge
+        self.document_challenge = response.headers.get("cf-mitigated", "") == "challenge"
+        self.changed.set()
+
+    def _on_frame(self, frame):
+        self.changed.set()
+
+    def active(self) -> bool:
+        if self.document_challenge:
+            return True
+        return any(CF_CHALLENGE_HOST in (frame.url or "") for frame in self.page.frames)
+
+
+_watchers = weakref.WeakKeyDictionary()
+
+
+def watch_cloudflare(page) -> ChallengeWatcher:
+    """为页面挂上挑战监听，需在第一次导航前调用才能捕获整页拦截"""
+    watcher = _watchers.get(page)
+    if watcher is None:
+        watcher = _watchers[page] = ChallengeWatcher(page)
+    return watcher
+
+
 async def wait_for_cloudflare(page, max_wait: int = 120) -> bool:
-    print("🛡️ 等待 Cloudflare 验证...")
-    for i in range(max_wait):
+    watcher = watch_cloudflare(page)
+    if not watcher.active():
+        return True
+
+    with span(CHALLENGE, kind="cloudflare") as step:
+        print("🛡️ 检测到 Cloudflare 验证，等待中...")
+        start = time.monotonic()
+        token_task = None
+        solved = False
         try:
-            is_cf = await page.evaluate("""
-                () => {
-                    if (document.querySelector('iframe[src*="challenges.cloudflare.com"]')) return true;
-                    if (document.querySelector('[data-sitekey]')) return true;
-                    const text = document.body.innerText;
-                    return text.includes('Checking') || text.includes('moment') || text.includes('human');
-                }
-            """)
-            if not is_cf:
-                print(f"✅ CF 验证通过 ({i+1}秒)")
-                return True
-            if i % 10 == 0:
-                print(f"⏳ CF 验证中... ({i+1}/{max_wait}秒)")
-            await page.wait_for_timeout(1000)
-        except:
-            await page.wait_for_timeout(1000)
-    print("⚠️ CF 验证超时")
-    return False
+            while watcher.active():
+                remaining = max_wait - (time.monotonic() - start)
+                if remaining <= 0:
+                    break
+                if token_task is not None and token_task.done():
+                    if not token_task.cancelled() and token_task.exception() is None:
+                        solved = True
+                        break
+                    token_task = None  # 导航导致执行上下文失效时稍后重新挂上
+                    await asyncio.sleep(0.5)
+                    continue
+                if token_task is None:
+                    token_task = asyncio.ensure_future(
+                        page.wait_for_function(CF_TOKEN_JS, polling=500, timeout=remaining * 1000)
+                    )
+                watcher.changed.clear()
+                change_task = asyncio.ensure_future(watcher.changed.wait())
+                try:
+                    await asyncio.wait([token_task, change_task], timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    change_task.cancel()
+            else:
+                solved = True
+        finally:
+            if token_task is not None:
+                if not token_task.done():
+                    token_task.cancel()
+                elif not token_task.cancelled():
+                    token_task.exception()
+
+        elapsed = time.monotonic() - start
+        CF_STATS["challenges"] += 1
+        CF_STATS["seconds"] += elapsed
+        if solved:
+            print(f"✅ CF 验证通过 ({elapsed:.1f}秒)")
+            return True
+        CF_STATS["timeouts"] += 1
+        step.fail("cloudflare timeout")
+        print(f"⚠️ CF 验证超时 ({elapsed:.1f}秒)")
+        return False
 
 
 async def wait_for_page_ready(page, max_wait: int = 15) -> bool:
@@ -195,6 +305,11 @@ async def update_github_secret(secret_name: str, secret_value: str) -> bool:
 
 
 async def tg_notify(message: str):
+    with span(NOTIFY, method="sendMessage"):
+        await _tg_send_message(message)
+
+
+async def _tg_send_message(message: str):
     token = os.environ.get("TG_BOT_TOKEN")
     chat_id = os.environ.get("TG_CHAT_ID")
     if not token or not chat_id:
@@ -208,6 +323,11 @@ async def tg_notify(message: str):
 
 
 async def tg_notify_photo(photo_path: str, caption: str = ""):
+    with span(NOTIFY, method="sendPhoto"):
+        await _tg_send_photo(photo_path, caption)
+
+
+async def _tg_send_photo(photo_path: str, caption: str = ""):
     token = os.environ.get("TG_BOT_TOKEN")
     chat_id = os.environ.get("TG_CHAT_ID")
     if not token or not chat_id:
@@ -237,65 +357,53 @@ async def extract_remember_cookie(context) -> tuple:
     return (None, None)
 
 
+# 到期时间匹配模式，按优先级排列：(正则源码, flags)
+EXPIRY_PATTERNS = [
+    (r"유통기한[\s\S]*?(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})", ""),
+    (r"유통기한[\s\S]*?(\d{4}-\d{2}-\d{2})", ""),
+    (r"expiry[\s\S]*?(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})", "i"),
+    (r"expiry[\s\S]*?(\d{4}-\d{2}-\d{2})", "i"),
+    (r"(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})", ""),
+    (r"(\d{4}-\d{2}-\d{2})", ""),
+]
+
+# 单次页面调用：先用 XPath 直接定位到期标签所在元素，未命中再对整页文本按顺序匹配一次
+EXPIRY_EXTRACT_JS = """
+    (patterns) => {
+        const DATE = /(\\d{4}-\\d{2}-\\d{2}(?:\\s+\\d{2}:\\d{2}:\\d{2})?)/;
+        const label = document.evaluate(
+            "//*[not(self::script or self::style)][contains(text(), '유통기한') or contains(translate(text(), 'EXPIRY', 'expiry'), 'expiry')]",
+            document.body, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+        ).singleNodeValue;
+        if (label) {
+            const candidates = [label, label.nextElementSibling, label.parentElement, label.parentElement && label.parentElement.parentElement];
+            for (const el of candidates) {
+                const match = el && (el.textContent || '').match(DATE);
+                if (match) return { value: match[1].trim(), method: 'label' };
+            }
+        }
+
+        const text = document.body.innerText;
+        for (const [source, flags] of patterns) {
+            const match = text.match(new RegExp(source, flags));
+            if (match) return { value: match[1].trim(), method: 'scan' };
+        }
+        return { value: null, snippet: text.slice(0, 500) };
+    }
+"""
+
+
 async def get_expiry_time(page) -> str:
-    """获取到期时间，支持多种格式"""
+    """获取到期时间，支持多种格式（单次页面调用）"""
     try:
-        # 方法1: 通过正则匹配（多种模式）
-        expiry = await page.evaluate("""
-            () => {
-                const text = document.body.innerText;
-                
-                // 尝试多种正则模式
-                const patterns = [
-                    /유통기한[\\s\\S]*?(\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2})/,
-                    /유통기한[\\s\\S]*?(\\d{4}-\\d{2}-\\d{2})/,
-                    /expiry[\\s\\S]*?(\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2})/i,
-                    /expiry[\\s\\S]*?(\\d{4}-\\d{2}-\\d{2})/i,
-                    /(\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2})/,
-                    /(\\d{4}-\\d{2}-\\d{2})/
-                ];
-                
-                for (const pattern of patterns) {
-                    const match = text.match(pattern);
-                    if (match) {
-                        return match[1].trim();
-                    }
-                }
-                
-                return null;
-            }
-        """)
+        result = await page.evaluate(EXPIRY_EXTRACT_JS, EXPIRY_PATTERNS)
         
-        if expiry:
-            print(f"✅ 方法1获取到时间: {expiry}")
-            return expiry
-        
-        # 方法2: 通过选择器直接获取
-        expiry = await page.evaluate("""
-            () => {
-                // 查找包含时间的元素
-                const elements = document.querySelectorAll('p, span, div');
-                for (const el of elements) {
-                    const text = el.textContent || '';
-                    if (text.includes('유통기한') || text.includes('expiry')) {
-                        const match = text.match(/(\\d{4}-\\d{2}-\\d{2}(?:\\s+\\d{2}:\\d{2}:\\d{2})?)/);
-                        if (match) {
-                            return match[1].trim();
-                        }
-                    }
-                }
-                return null;
-            }
-        """)
+        if result.get("value"):
+            print(f"✅ 获取到时间({result['method']}): {result['value']}")
+            return result["value"]
         
-        if expiry:
-            print(f"✅ 方法2获取到时间: {expiry}")
-            return expiry
-        
-        # 方法3: 获取页面文本用于调试
-        page_text = await page.evaluate("() => document.body.innerText")
         print(f"⚠️ 未匹配到时间")
-        print(f"📄 页面文本片段: {page_text[:500]}")
+        print(f"📄 页面文本片段: {result.get('snippet', '')}")
         
         return "Unknown"
         
@@ -320,35 +428,35 @@ async def find_renew_button(page):
     return None
 
 
-async def get_first_server_url(page, dashboard_url: str) -> str:
-    """从仪表板页面自动获取第一个服务器的 URL"""
+async def get_server_urls(page, dashboard_url: str) -> list:
+    """从仪表板页面获取当前账号下所有服务器的 URL"""
     try:
         print(f"🔍 正在获取服务器列表...")
-        await page.goto(dashboard_url, timeout=90000)
+        with span(NAVIGATE, page="dashboard"):
+            await page.goto(dashboard_url, timeout=90000)
         await wait_for_cloudflare(page, max_wait=120)
         await page.wait_for_timeout(2000)
         
-        server_id = await page.evaluate("""
+        server_ids = await page.evaluate("""
             () => {
-                const firstLink = document.querySelector('table tr td a[href^="/server/"]');
-                if (firstLink) {
-                    const href = firstLink.getAttribute('href');
-                    return href.replace('/server/', '');
-                }
-                return null;
+                const ids = [];
+                document.querySelectorAll('table tr td a[href^="/server/"]').forEach(link => {
+                    const id = link.getAttribute('href').replace('/server/', '').replace(/\\/.*$/, '');
+                    if (id && !ids.includes(id)) ids.push(id);
+                });
+                return ids;
             }
         """)
         
-        if server_id:
-            server_url = f"https://hub.weirdhost.xyz/server/{server_id}"
-            print(f"✅ 自动获取到服务器: {mask_server_id(server_id)}")
-            return server_url
+        if server_ids:
+            print(f"✅ 自动获取到 {len(server_ids)} 个服务器: {[mask_server_id(s) for s in server_ids]}")
+            return [f"https://hub.weirdhost.xyz/server/{sid}" for sid in server_ids]
         else:
             print("⚠️ 未找到服务器")
-            return None
+            return []
     except Exception as e:
         print(f"⚠️ 获取服务器列表失败: {e}")
-        return None
+        return []
 
 
 def format_manual_renew_notification(server_url: str, expiry_time: str, remaining_days: int) -> str:
@@ -401,32 +509,246 @@ def format_time_fetch_error_notification(server_url: str) -> str:
 👉 <a href="{server_url}">点击检查</a>"""
 
 
-async def add_server_time():
-    cookie_value = os.environ.get("REMEMBER_WEB_COOKIE", "").strip()
-    cookie_name = os.environ.get("REMEMBER_WEB_COOKIE_NAME", DEFAULT_COOKIE_NAME)
-    dashboard_url = os.environ.get("DASHBOARD_URL", DEFAULT_DASHBOARD_URL)
+@dataclass
+class RenewOutcome:
+    account: int
+    server_url: str
+    status: str  # success / reminder / error / cooldown / skipped
+    message: str = ""  # 汇总通知中的片段，空表示静默
+    screenshot: Optional[str] = None
+    expiry: str = ""
 
-    if not cookie_value:
-        print("❌ REMEMBER_WEB_COOKIE 未设置")
-        return
 
-    print("🚀 启动 Playwright...")
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True, args=['--disable-blink-features=AutomationControlled'])
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            extra_http_headers={'Accept-Language': 'zh-CN,zh;q=0.9'}
-        )
-        await context.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', {get: () => false});
-            Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
-        """)
-        
+def load_state() -> dict:
+    """读取本地缓存的服务器状态（到期时间 / 冷却窗口 / 账号服务器列表及其获取时间）"""
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if isinstance(state, dict):
+            state.setdefault("servers", {})
+            state.setdefault("accounts", {})
+            state.setdefault("discovered_at", {})
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"servers": {}, "accounts": {}, "discovered_at": {}}
+
+
+def discovery_stale(state: dict, account: int) -> bool:
+    """账号的服务器列表是否该重新获取（新增的服务器只有重新获取才能发现）"""
+    discovered_at = state["discovered_at"].get(str(account), 0)
+    return time.time() - discovered_at > DISCOVERY_DAYS * 86400
+
+
+def save_state(state: dict):
+    try:
+        with open(STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"⚠️ 状态缓存保存失败: {e}")
+    SCHEDULE.save()
+
+
+async def probe_expiry(session, cookie_name: str, cookie_value: str, server_id: str) -> Optional[str]:
+    """不启动浏览器，直接用 remember Cookie 请求面板 API 读取到期时间；被拦截或无数据返回 None"""
+    url = f"https://hub.weirdhost.xyz/api/client/servers/{server_id}"
+    headers = {
+        "Accept": "application/json",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Cookie": f"{cookie_name}={cookie_value}",
+    }
+    try:
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=15)) as resp:
+            if resp.status != 200 or "json" not in resp.headers.get("Content-Type", ""):
+                return None
+            text = await resp.text()
+    except Exception:
+        return None
+    match = re.search(r'"[^"]*expir[^"]*"\s*:\s*"(\d{4}-\d{2}-\d{2})(?:[ T](\d{2}:\d{2}:\d{2}))?', text, re.IGNORECASE)
+    if not match:
+        return None
+    return f"{match.group(1)} {match.group(2)}" if match.group(2) else match.group(1)
+
+
+async def renewal_due(session, state: dict, server_url: str, cookie_name: str, cookie_value: str) -> tuple:
+    """判断服务器是否需要处理，返回 (是否需要, 原因, 是否可走直接 API 续期)"""
+    server_id = extract_server_id(server_url)
+    cached = state["servers"].get(server_id)
+    if not cached:
+        return True, "无缓存", False
+
+    expiry = cached.get("expiry", "")
+    if HTTP_PROBE and session is not None:
+        probed = await probe_expiry(session, cookie_name, cookie_value, server_id)
+        if probed:
+            expiry = cached["expiry"] = probed
+
+    remaining_days = calculate_remaining_days(expiry) if expiry else None
+    if remaining_days is None:
+        return True, "到期时间未知", False
+    if remaining_days <= NOTIFY_DAYS_BEFORE:
+        return True, f"剩余 {remaining_days} 天，需要提醒", False
+
+    wait = cached.get("cooldown_until", 0) - time.time()
+    if wait <= COOLDOWN_SLACK_SECONDS:
+        return True, "冷却已结束", True
+    return False, f"冷却中，还需 {wait / 3600:.1f} 小时，剩余 {remaining_days} 天", False
+
+
+def record_outcome(state: dict, outcome: "RenewOutcome"):
+    """把本次结果写回状态缓存"""
+    server_id = extract_server_id(outcome.server_url)
+    cached = state["servers"].setdefault(server_id, {})
+    now = time.time()
+    if outcome.expiry and outcome.expiry != "Unknown":
+        cached["expiry"] = outcome.expiry
+    if outcome.status == "success":
+        cached["last_success"] = now
+        cached["cooldown_until"] = now + COOLDOWN_HOURS * 3600
+    elif outcome.status == "cooldown":
+        # 冷却开始时间未知时，按上次成功推算，否则一小时后再试
+        last = cached.get("last_success")
+        cached["cooldown_until"] = last + COOLDOWN_HOURS * 3600 if last else now + 3600
+    cached["checked_at"] = now
+    # 与 renewal_due 的判断保持一致：冷却结束或进入提醒窗口时需要运行
+    renew_after = cached.get("cooldown_until", 0) if cached.get("expiry") else 0
+    SCHEDULE.update("weirdhost", server_id, expiry_text=cached.get("expiry"),
+                    renew_after=renew_after, alert_days=NOTIFY_DAYS_BEFORE, outcome=outcome.status)
+
+
+# 浏览器续期时记录下的 /renew 请求形态，保存到状态缓存的 renew_request 中
+RENEW_REQUEST_SHAPE: dict = {}
+# 回放时不复制的请求头：由 HTTP 客户端或 Cookie 自动生成
+SKIPPED_REQUEST_HEADERS = {"cookie", "content-length", "host", "connection", "accept-encoding"}
+CAPTCHA_MARKERS = ("turnstile", "captcha", "cf-chl")
+
+
+def record_renew_request(request, server_id: str):
+    """记录续期请求的方法、URL 模板、请求头和 CSRF 来源（不保存 Cookie 值）"""
+    headers = {}
+    csrf_header = None
+    for name, value in request.headers.items():
+        lname = name.lower()
+        if lname in SKIPPED_REQUEST_HEADERS or lname.startswith(":"):
+            continue
+        if lname in ("x-xsrf-token", "x-csrf-token"):
+            csrf_header = name
+            continue
+        headers[name] = value
+    body = request.post_data or ""
+    RENEW_REQUEST_SHAPE.update({
+        "method": request.method,
+        "url": request.url.replace(server_id, "{server_id}"),
+        "headers": headers,
+        "body": body.replace(server_id, "{server_id}"),
+        # Laravel 的 X-XSRF-TOKEN 取自 XSRF-TOKEN Cookie（URL 解码后）
+        "csrf_header": csrf_header,
+        "csrf_cookie": "XSRF-TOKEN" if csrf_header else None,
+        "needs_captcha": any(m in body.lower() for m in CAPTCHA_MARKERS),
+        "recorded_at": time.time(),
+    })
+
+
+def is_challenge_response(resp) -> bool:
+    if resp.headers.get("cf-mitigated", "") == "challenge":
+        return True
+    return resp.status in (403, 503) and "text/html" in resp.headers.get("Content-Type", "")
+
+
+async def direct_renew(shape: dict, cookie_name: str, cookie_value: str, server_id: str) -> Optional[tuple]:
+    """按记录的请求形态直接用 HTTP 续期，返回 (状态码, 响应体)；遇到 CF 挑战或网络错误返回 None"""
+    ua = shape.get("headers", {}).get("user-agent") or "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    timeout = aiohttp.ClientTimeout(total=30)
+    try:
+        async with aiohttp.ClientSession(cookies={cookie_name: cookie_value}, timeout=timeout) as session:
+            # 先访问面板建立会话，拿到 Laravel 的 XSRF-TOKEN Cookie
+            async with session.get(f"https://hub.weirdhost.xyz/server/{server_id}", headers={"User-Agent": ua}) as resp:
+                if is_challenge_response(resp):
+                    return None
+                await resp.read()
+
+            headers = dict(shape.get("headers", {}))
+            if shape.get("csrf_header"):
+                token = next((c.value for c in session.cookie_jar if c.key == shape["csrf_cookie"]), None)
+                if not token:
+                    return None
+                headers[shape["csrf_header"]] = unquote(token)
+
+            url = shape["url"].replace("{server_id}", server_id)
+            body = shape.get("body", "").replace("{server_id}", server_id) or None
+            async with session.request(shape["method"], url, headers=headers, data=body) as resp:
+                if is_challenge_response(resp):
+                    return None
+                try:
+                    return resp.status, await resp.json(content_type=None)
+                except ValueError:
+                    return resp.status, await resp.text()
+    except Exception as e:
+        print(f"⚠️ 直接续期请求失败: {e}")
+        return None
+
+
+async def try_direct_renew(shape: dict, cookie_name: str, cookie_value: str, account: int, server_url: str) -> Optional["RenewOutcome"]:
+    """直接 API 续期；返回 None 表示需要回退到浏览器点击"""
+    server_id = extract_server_id(server_url)
+    tag = f"[#{account + 1} {mask_server_id(server_id)}]"
+    with span(API, endpoint="direct_renew", server=mask_server_id(server_id)) as step:
+        result = await direct_renew(shape, cookie_name, cookie_value, server_id)
+        step.set("http_status", result[0] if result else 0)
+    if result is None:
+        print(f"{tag} 🛡 直接续期被拦截，回退到浏览器")
+        return None
+
+    status, body = result
+    print(f"{tag} 📡 直接续期 API 响应: {status}")
+    if status in (200, 201, 204):
+        async with aiohttp.ClientSession() as session:
+            new_expiry = await probe_expiry(session, cookie_name, cookie_value, server_id) or "Unknown"
+        new_remaining = format_remaining_time(new_expiry) if new_expiry != "Unknown" else "未知"
+        return RenewOutcome(account, server_url, "success", f"""✅ 续期成功！（直接 API）
+🖥 服务器: <code>{server_id}</code>
+📅 新到期时间: <code>{new_expiry}</code>
+⏳ 剩余时间: <b>{new_remaining}</b>""", expiry=new_expiry)
+
+    if status == 400:
+        error_detail = parse_renew_error(body)
+        if is_cooldown_error(error_detail):
+            print(f"{tag} ℹ️ 冷却期内（静默处理）")
+            return RenewOutcome(account, server_url, "cooldown")
+        print(f"{tag} ⚠️ 直接续期失败: {error_detail}，回退到浏览器")
+        return None
+
+    print(f"{tag} ⚠️ 直接续期 HTTP {status}，回退到浏览器")
+    return None
+
+
+def parse_list_env(name: str) -> list:
+    raw = os.environ.get(name, "")
+    return [item.strip() for item in raw.replace("\n", ",").split(",") if item.strip()]
+
+
+async def process_server(context, server_url: str, account: int, semaphore: asyncio.Semaphore) -> RenewOutcome:
+    """在账号上下文中新开标签页处理单个服务器"""
+    with span(SERVER, server=mask_server_id(extract_server_id(server_url))) as step:
+        outcome = await _process_server(context, server_url, account, semaphore)
+        step.set("outcome", outcome.status)
+        if outcome.status == "error":
+            step.fail("error")
+        return outcome
+
+
+async def _process_server(context, server_url: str, account: int, semaphore: asyncio.Semaphore) -> RenewOutcome:
+    server_id = extract_server_id(server_url)
+    masked_id = mask_server_id(server_id)
+    tag = f"[#{account + 1} {masked_id}]"
+
+    async with semaphore:
         page = await context.new_page()
         page.set_default_timeout(120000)
+        watch_cloudflare(page)
 
         renew_result = {"captured": False, "status": None, "body": None}
+        shots = SCREENSHOTS.recorder(server_id)
 
         async def capture_response(response):
             if "/renew" in response.url and "notfreeservers" in response.url:
@@ -436,160 +758,324 @@ async def add_server_time():
                     renew_result["body"] = await response.json()
                 except:
                     renew_result["body"] = await response.text()
-                print(f"📡 API 响应: {response.status}")
+                print(f"{tag} 📡 API 响应: {response.status}")
+
+        def capture_request(request):
+            if "/renew" in request.url and "notfreeservers" in request.url:
+                record_renew_request(request, server_id)
 
         page.on("response", capture_response)
+        page.on("request", capture_request)
 
         try:
-            await context.add_cookies([{"name": cookie_name, "value": cookie_value, "domain": "hub.weirdhost.xyz", "path": "/"}])
-
-            # 自动获取服务器 URL
-            server_url = os.environ.get("SERVER_URL", "").strip()
-            if not server_url:
-                server_url = await get_first_server_url(page, dashboard_url)
-                if not server_url:
-                    print("❌ 无法获取服务器 URL")
-                    return
-
-            server_id = extract_server_id(server_url)
-            masked_id = mask_server_id(server_id)
-            print(f"🌐 访问服务器: {masked_id}")
+            print(f"{tag} 🌐 访问服务器")
             
-            await page.goto(server_url, timeout=90000)
+            with span(NAVIGATE, page="server"):
+                await page.goto(server_url, timeout=90000)
             await wait_for_cloudflare(page, max_wait=120)
             await page.wait_for_timeout(2000)
             await wait_for_page_ready(page, max_wait=20)
+            await shots.checkpoint(page, "loaded")
 
             if "/auth/login" in page.url or "/login" in page.url:
-                print("❌ Cookie 已失效（静默处理）")
-                return
+                print(f"{tag} ❌ Cookie 已失效（静默处理）")
+                return RenewOutcome(account, server_url, "error")
 
-            print("✅ 登录成功")
+            print(f"{tag} ✅ 登录成功")
 
             expiry_time = await get_expiry_time(page)
             
             # 【核心逻辑】检查是否获取到时间
             if expiry_time == "Unknown" or not expiry_time:
-                print(f"\n{'='*50}")
-                print("❌ 无法获取到期时间，发送通知")
-                print(f"{'='*50}\n")
-                
-                msg = format_time_fetch_error_notification(server_url)
-                await page.screenshot(path="time_fetch_error.png", full_page=True)
-                await tg_notify_photo("time_fetch_error.png", msg)
-                print("✅ 已发送时间获取失败通知")
-                return
+                print(f"{tag} ❌ 无法获取到期时间，加入通知")
+                screenshot = await shots.failure(page, "time_fetch_error")
+                return RenewOutcome(account, server_url, "error",
+                                    format_time_fetch_error_notification(server_url), screenshot)
             
             remaining_time = format_remaining_time(expiry_time)
             remaining_days = calculate_remaining_days(expiry_time)
             
-            print(f"📅 到期: {expiry_time} | 剩余: {remaining_time} ({remaining_days}天)")
+            print(f"{tag} 📅 到期: {expiry_time} | 剩余: {remaining_time} ({remaining_days}天)")
 
             # 【核心逻辑】检查是否需要发送到期提醒
             if remaining_days is not None and remaining_days <= NOTIFY_DAYS_BEFORE:
-                print(f"\n{'='*50}")
-                print(f"⚠️ 触发到期提醒：剩余 {remaining_days} 天")
-                print(f"{'='*50}\n")
-                
-                msg = format_manual_renew_notification(server_url, expiry_time, remaining_days)
-                await tg_notify(msg)
-                print("✅ 已发送手动续订提醒")
-                return
+                print(f"{tag} ⚠️ 触发到期提醒：剩余 {remaining_days} 天")
+                return RenewOutcome(account, server_url, "reminder",
+                                    format_manual_renew_notification(server_url, expiry_time, remaining_days),
+                                    expiry=expiry_time)
 
-            print("\n" + "="*50)
-            print("📌 尝试自动续期")
-            print("="*50)
+            print(f"{tag} 📌 尝试自动续期")
             
             add_button = await find_renew_button(page)
             if not add_button:
-                print("⚠️ 未找到续期按钮（静默处理）")
-                return
+                print(f"{tag} ⚠️ 未找到续期按钮（静默处理）")
+                return RenewOutcome(account, server_url, "skipped", expiry=expiry_time)
 
-            await add_button.wait_for(state="visible", timeout=10000)
-            await page.wait_for_timeout(1000)
-            await add_button.click()
-            print("🔄 已点击续期按钮，等待 CF 验证...")
+            with span(RENEW, action="click"):
+                await add_button.wait_for(state="visible", timeout=10000)
+                await page.wait_for_timeout(1000)
+                await add_button.click()
+            print(f"{tag} 🔄 已点击续期按钮，等待 CF 验证...")
 
             await page.wait_for_timeout(5000)
             cf_passed = await wait_for_cloudflare(page, max_wait=120)
             
             if not cf_passed:
-                print("⚠️ CF 验证超时（静默处理）")
-                return
+                print(f"{tag} ⚠️ CF 验证超时（静默处理）")
+                await shots.failure(page, "cf_timeout")
+                return RenewOutcome(account, server_url, "skipped", expiry=expiry_time)
 
-            print("⏳ 等待复选框...")
+            print(f"{tag} ⏳ 等待复选框...")
             try:
                 checkbox = await page.wait_for_selector('input[type="checkbox"]', timeout=5000)
                 await checkbox.click()
-                print("✅ 已点击复选框")
+                print(f"{tag} ✅ 已点击复选框")
             except:
                 try:
                     await page.evaluate("document.querySelector('input[type=\"checkbox\"]')?.click()")
-                    print("✅ 已通过 JS 点击复选框")
+                    print(f"{tag} ✅ 已通过 JS 点击复选框")
                 except:
-                    print("⚠️ 未找到复选框")
+                    print(f"{tag} ⚠️ 未找到复选框")
 
-            print("⏳ 等待 API 响应...")
-            await page.wait_for_timeout(2000)
-            
-            for i in range(30):
-                if renew_result["captured"]:
-                    print(f"✅ 捕获到响应 ({i+1}秒)")
-                    break
-                if i % 5 == 4:
-                    print(f"⏳ 等待 API... ({i+1}秒)")
-                await page.wait_for_timeout(1000)
-
-            if renew_result["captured"]:
-                status = renew_result["status"]
-                body = renew_result["body"]
-
-                if status in (200, 201, 204):
-                    # 【核心逻辑】续期成功，发送通知
-                    await page.wait_for_timeout(2000)
-                    await page.reload()
-                    await wait_for_cloudflare(page, max_wait=30)
-                    await page.wait_for_timeout(3000)
-                    new_expiry = await get_expiry_time(page)
-                    new_remaining = format_remaining_time(new_expiry)
-                    
-                    msg = f"""🎁 <b>Weirdhost 续订报告</b>
-
-✅ 续期成功！
+            print(f"{tag} ⏳ 等待 API 响应...")
+            with span(API, endpoint="renew") as step:
+                await page.wait_for_timeout(2000)
+                
+                for i in range(30):
+                    if renew_result["captured"]:
+                        print(f"{tag} ✅ 捕获到响应 ({i+1}秒)")
+                        break
+                    if i % 5 == 4:
+                        print(f"{tag} ⏳ 等待 API... ({i+1}秒)")
+                    await page.wait_for_timeout(1000)
+                step.set("http_status", renew_result["status"] or 0)
+                if not renew_result["captured"]:
+                    step.fail("no response")
+
+            if not renew_result["captured"]:
+                print(f"{tag} ⚠️ 未检测到 API 响应（静默处理）")
+                return RenewOutcome(account, server_url, "skipped", expiry=expiry_time)
+
+            status = renew_result["status"]
+            body = renew_result["body"]
+
+            if status in (200, 201, 204):
+                # 【核心逻辑】续期成功，加入通知
+                await page.wait_for_timeout(2000)
+                await page.reload()
+                await wait_for_cloudflare(page, max_wait=30)
+                await page.wait_for_timeout(3000)
+                new_expiry = await get_expiry_time(page)
+                new_remaining = format_remaining_time(new_expiry)
+                
+                print(f"{tag} ✅ 续期成功！")
+                return RenewOutcome(account, server_url, "success", f"""✅ 续期成功！
 🖥 服务器: <code>{server_id}</code>
 📅 新到期时间: <code>{new_expiry}</code>
-⏳ 剩余时间: <b>{new_remaining}</b>
-💻 执行器: {get_executor_name()}"""
-                    
-                    print(f"\n{'='*50}")
-                    print("✅ 续期成功！发送通知")
-                    print(f"{'='*50}\n")
-                    await tg_notify(msg)
-
-                elif status == 400:
-                    error_detail = parse_renew_error(body)
-                    if is_cooldown_error(error_detail):
-                        print(f"ℹ️ 冷却期内（静默处理）")
-                    else:
-                        print(f"⚠️ 续期失败: {error_detail}（静默处理）")
-                else:
-                    print(f"⚠️ HTTP {status}（静默处理）")
+⏳ 剩余时间: <b>{new_remaining}</b>""", expiry=new_expiry)
+
+            if status == 400:
+                error_detail = parse_renew_error(body)
+                if is_cooldown_error(error_detail):
+                    print(f"{tag} ℹ️ 冷却期内（静默处理）")
+                    return RenewOutcome(account, server_url, "cooldown", expiry=expiry_time)
+                print(f"{tag} ⚠️ 续期失败: {error_detail}（静默处理）")
             else:
-                print("⚠️ 未检测到 API 响应（静默处理）")
+                print(f"{tag} ⚠️ HTTP {status}（静默处理）")
+            return RenewOutcome(account, server_url, "skipped", expiry=expiry_time)
+
+        except Exception as e:
+            print(f"{tag} ❌ 异常: {repr(e)}（静默处理）")
+            try:
+                await shots.failure(page, "error")
+            except Exception:
+                pass
+            return RenewOutcome(account, server_url, "error")
+
+        finally:
+            await page.close()
+
+
+async def process_account(pool: BrowserPool, cookie_name: str, cookie_value: str, account: int,
+                          dashboard_url: str, server_urls: list, semaphore: asyncio.Semaphore,
+                          known: Optional[list] = None) -> tuple:
+    """
+    返回 (新 Cookie 值, [RenewOutcome], 本次获取到的服务器列表或 None)；同一账号的服务器共用一个上下文并发处理。
+    server_urls 为 None 时自动获取并处理全部服务器；传入 known（缓存的列表）时也重新获取，
+    除 server_urls 外再处理列表里新增的服务器
+    """
+    with span(ACCOUNT, account=f"#{account + 1}"):
+        return await _process_account(pool, cookie_name, cookie_value, account, dashboard_url, server_urls, semaphore, known)
+
+
+async def _process_account(pool: BrowserPool, cookie_name: str, cookie_value: str, account: int,
+                           dashboard_url: str, server_urls: list, semaphore: asyncio.Semaphore,
+                           known: Optional[list]) -> tuple:
+    async with pool.context(extra_http_headers={'Accept-Language': 'zh-CN,zh;q=0.9'}) as context:
+        try:
+            await context.add_cookies([{"name": cookie_name, "value": cookie_value, "domain": "hub.weirdhost.xyz", "path": "/"}])
+
+            discovered = None
+            if server_urls is None or known is not None:
+                async with semaphore:
+                    page = await context.new_page()
+                    page.set_default_timeout(120000)
+                    watch_cloudflare(page)
+                    try:
+                        discovered = await get_server_urls(page, dashboard_url) or None
+                    finally:
+                        await page.close()
+                if server_urls is None:
+                    if not discovered:
+                        print(f"❌ 账号 #{account + 1} 无法获取服务器 URL")
+                        return cookie_value, [], None
+                    server_urls = discovered
+                elif discovered:
+                    added = [url for url in discovered if url not in known and url not in server_urls]
+                    if added:
+                        print(f"🆕 账号 #{account + 1} 新增 {len(added)} 台服务器")
+                    server_urls = server_urls + added
+
+            outcomes = await asyncio.gather(*(
+                process_server(context, url, account, semaphore) for url in server_urls
+            ))
 
             # 更新 Cookie
             new_name, new_value = await extract_remember_cookie(context)
-            if new_value and new_value != cookie_value:
-                print("🔄 更新 Cookie")
-                await update_github_secret("REMEMBER_WEB_COOKIE", new_value)
+            return new_value or cookie_value, list(outcomes), discovered
 
         except Exception as e:
-            print(f"❌ 异常: {repr(e)}（静默处理）")
+            print(f"❌ 账号 #{account + 1} 异常: {repr(e)}（静默处理）")
+            return cookie_value, [], None
 
-        finally:
-            await context.close()
-            await browser.close()
+
+def format_summary_notification(outcomes: list) -> str:
+    """把所有服务器的结果合并成一条汇总通知"""
+    counts = {}
+    for o in outcomes:
+        counts[o.status] = counts.get(o.status, 0) + 1
+    multi_account = len({o.account for o in outcomes}) > 1
+
+    sections = []
+    for o in outcomes:
+        if not o.message:
+            continue
+        prefix = f"👤 账号 #{o.account + 1}\n" if multi_account else ""
+        sections.append(prefix + o.message)
+
+    header = f"""🎁 <b>Weirdhost 续订汇总</b>
+
+✅ 成功 {counts.get('success', 0)} | ⚠️ 提醒 {counts.get('reminder', 0)} | ❌ 异常 {counts.get('error', 0)} | ℹ️ 无需操作 {counts.get('cooldown', 0) + counts.get('skipped', 0)}
+🛡 CF 验证: {CF_STATS['challenges']} 次 / {CF_STATS['seconds']:.0f} 秒 (超时 {CF_STATS['timeouts']})
+💻 执行器: {get_executor_name()}"""
+
+    return header + "\n\n" + "\n━━━━━━━━━━━━━━━━━━\n".join(sections)
+
+
+async def add_server_time():
+    cookie_values = parse_list_env("REMEMBER_WEB_COOKIE")
+    cookie_name = os.environ.get("REMEMBER_WEB_COOKIE_NAME", DEFAULT_COOKIE_NAME)
+    dashboard_url = os.environ.get("DASHBOARD_URL", DEFAULT_DASHBOARD_URL)
+    server_urls = parse_list_env("SERVER_URL")
+    concurrency = max(1, int(os.environ.get("WEIRDHOST_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+    if not cookie_values:
+        print("❌ REMEMBER_WEB_COOKIE 未设置")
+        return
+
+    if server_urls and len(cookie_values) > 1:
+        print("⚠️ 多账号模式下忽略 SERVER_URL，自动获取各账号服务器")
+        server_urls = []
+
+    # 预检查：根据缓存的到期时间和冷却窗口决定哪些服务器需要打开浏览器
+    state = load_state()
+    SCHEDULE.note_config("weirdhost")
+    shape = state.get("renew_request") or {}
+    direct_ok = DIRECT_RENEW and shape.get("method") and not shape.get("needs_captcha")
+    plans = []
+    direct_outcomes = []
+    async with aiohttp.ClientSession() as session:
+        for i, value in enumerate(cookie_values):
+            known = server_urls or state["accounts"].get(str(i))
+            if FORCE_RENEW or not known:
+                plans.append((i, value, server_urls or None, None))
+                continue
+            due_urls = []
+            for url in known:
+                due, reason, can_direct = await renewal_due(session, state, url, cookie_name, value)
+                print(f"{'🔔' if due else '⏭'} #{i + 1} {mask_server_id(extract_server_id(url))}: {reason}")
+                if due and can_direct and direct_ok:
+                    outcome = await try_direct_renew(shape, cookie_name, value, i, url)
+                    if outcome:
+                        direct_outcomes.append(outcome)
+                        continue
+                if due:
+                    due_urls.append(url)
+            # 自动获取的列表：要为该账号启动浏览器时顺便重新获取；列表过期时即使没有到期的服务器也启动一次，
+            # 否则账号下新增的服务器永远不会被处理。重新获取后只额外处理新增的服务器
+            discover = not server_urls
+            stale = discover and discovery_stale(state, i)
+            if stale:
+                print(f"🔎 #{i + 1} 服务器列表超过 {DISCOVERY_DAYS:g} 天未更新，重新获取")
+            if due_urls or stale:
+                plans.append((i, value, due_urls, known if discover else None))
+
+    for o in direct_outcomes:
+        record_outcome(state, o)
+
+    results = []
+    if not plans:
+        save_state(state)
+        print("✅ 没有需要浏览器处理的服务器，跳过浏览器")
+        if not direct_outcomes:
+            return
+    else:
+        print(f"🚀 启动 Playwright... ({len(plans)} 个账号，并发 {concurrency})")
+
+        async with browser_pool(size=0) as pool:
+            semaphore = asyncio.Semaphore(concurrency)
+            results = await asyncio.gather(*(
+                process_account(pool, cookie_name, value, i, dashboard_url, urls, semaphore, known)
+                for i, value, urls, known in plans
+            ))
+
+        for (i, _, _, _), (_, account_outcomes, discovered) in zip(plans, results):
+            if discovered and not server_urls:
+                state["accounts"][str(i)] = discovered
+                state["discovered_at"][str(i)] = time.time()
+            for o in account_outcomes:
+                record_outcome(state, o)
+        if RENEW_REQUEST_SHAPE:
+            state["renew_request"] = dict(RENEW_REQUEST_SHAPE)
+        save_state(state)
+
+    outcomes = direct_outcomes + [o for _, account_outcomes, _ in results for o in account_outcomes]
+    print(f"\n{'='*50}")
+    for o in outcomes:
+        print(f"#{o.account + 1} {mask_server_id(extract_server_id(o.server_url))}: {o.status}")
+    print(f"🛡 CF 验证: {CF_STATS['challenges']} 次，共 {CF_STATS['seconds']:.1f} 秒，超时 {CF_STATS['timeouts']} 次")
+    print(f"{'='*50}\n")
+
+    if any(o.message for o in outcomes):
+        await tg_notify(format_summary_notification(outcomes))
+        print("✅ 已发送汇总通知")
+        for o in outcomes:
+            if o.screenshot:
+                await tg_notify_photo(o.screenshot, f"🖥 <code>{extract_server_id(o.server_url)}</code>")
+
+    # 更新 Cookie
+    new_values = list(cookie_values)
+    for (i, _, _, _), (new, _, _) in zip(plans, results):
+        new_values[i] = new
+    if new_values != cookie_values:
+        print("🔄 更新 Cookie")
+        await update_github_secret("REMEMBER_WEB_COOKIE", ",".join(new_values))
+
+
+async def main():
+    with trace_run("weirdhost"):
+        await add_server_time()
 
 
 if __name__ == "__main__":
-    asyncio.run(add_server_time())
+    asyncio.run(main())